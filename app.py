@@ -4,11 +4,20 @@ Metromecanica Ingenieria y Metrologia S.A.C.
 """
 
 import os
-import sys
+import re
 import json
-import subprocess
+import io
+import gzip
+import hashlib
+import contextlib
+import time
 import tempfile
-from flask import Flask, request, jsonify, send_file, send_from_directory
+import logging
+import threading
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from flask import Flask, Request, Response, request, jsonify, send_file, send_from_directory, url_for
 
 try:
     import audit_logger
@@ -16,14 +25,42 @@ try:
 except ImportError:
     AUDIT_ENABLED = False
 
+try:
+    import brotli
+    BROTLI_ENABLED = True
+except ImportError:
+    BROTLI_ENABLED = False
+
+import extractor_pool
+import ot_renderer
+import office_converter
+import pdf_cache
+import artifact_store
+import extract_cache
+import jobs
+import zip_stream
+import metrics
+
+if AUDIT_ENABLED:
+    # Un número sin auditar cuya OT ya quedó guardada no vuelve al correlativo
+    audit_logger.ot_entregada = lambda ot_number: artifact_store.ubicar(f'{ot_number}.docx') is not None
+
 BASE_DIR      = os.path.dirname(os.path.abspath(__file__))
-EXTRACTOR     = os.path.join(BASE_DIR, "extract_proforma.py")
-GENERATOR     = os.path.join(BASE_DIR, "generate_ot.js")
 OUTPUT_DIR    = os.path.join(BASE_DIR, "ordenes_generadas")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Archivos subidos: en memoria hasta UPLOAD_SPOOL_MB y recién por encima se
+# vuelcan a un temporal (Werkzeug lo hace a partir de 500 KB)
+UPLOAD_SPOOL_BYTES = int(float(os.environ.get('UPLOAD_SPOOL_MB', 8)) * 1024 * 1024)
+
+class _Request(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+')
+
 app = Flask(__name__)
+app.request_class = _Request
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+metrics.instrumentar(app)
 
 from certbot_endpoint import certbot_bp
 app.register_blueprint(certbot_bp)
@@ -148,7 +185,7 @@ HTML = r"""<!DOCTYPE html>
     </div>
     <div class="download-group" id="downloadGroup">
       <a class="btn-download docx" id="btnDownloadDocx" href="#" download>📄 Descargar Word (.docx)</a>
-      <a class="btn-download pdf" id="btnDownloadPdf" href="#" download>📕 Descargar PDF</a>
+      <a class="btn-download pdf" id="btnDownloadPdf" href="#" onclick="return descargarPdf(this)">📕 Descargar PDF</a>
     </div>
   </div>
   <div class="card" id="previewCard" style="display:none">
@@ -219,34 +256,95 @@ function addHistorial(ot_num, filename) {
   cont.innerHTML = historial.slice(0,8).map(h =>
     `<div class="history-item"><div><div class="name">${h.ot_num}</div><div class="meta">${h.time}</div></div>
     <div class="downloads"><a href="/descargar/${h.filename}" download>Word</a>
-    <a href="/descargar-pdf/${h.filename.replace('.docx','.pdf')}" download>PDF</a></div></div>`
+    <a href="/descargar-pdf/${h.filename.replace('.docx','.pdf')}" onclick="return descargarPdf(this)">PDF</a></div></div>`
   ).join('');
 }
+async function descargarPdf(link) {
+  // El PDF se genera en segundo plano: esperar a que deje de responder 202
+  const url = link.getAttribute('href');
+  const label = link.textContent;
+  link.textContent = '⏳ Preparando PDF…';
+  try {
+    for (let i = 0; i < 60; i++) {
+      const res = await fetch(url, { method: 'HEAD' });
+      if (res.status !== 202) break;
+      await new Promise(r => setTimeout(r, 2000));
+    }
+    window.location.href = url;
+  } finally {
+    link.textContent = label;
+  }
+  return false;
+}
+function tituloOt(data) {
+  return data.existente ? `OT ya emitida para ${data.numero_proforma}: ${data.ot_num}` : `OT generada: ${data.ot_num}`;
+}
+const ETAPAS = {
+  queued:     'En cola…',
+  extracting: 'Leyendo y extrayendo datos de la proforma…',
+  generating: 'Generando la orden de trabajo…',
+};
+function mostrarResultado(data) {
+  if (data.error) {
+    showStatus('error', '❌', `<strong>Error:</strong> ${data.error}`);
+  } else if (!data.aprobada) {
+    showStatus('rejected', '⚠️', `<strong>Proforma ${data.numero_proforma} marcada como RECHAZADA.</strong><br>No se generó OT.`);
+  } else {
+    showStatus('success', '✅', `<strong>${tituloOt(data)}</strong><br>Cliente: ${(data.cliente||'').split('-')[0].trim()}<br><small>Preparando PDF…</small>`);
+    showPreview(data);
+    const dlDocx = document.getElementById('btnDownloadDocx');
+    const dlPdf  = document.getElementById('btnDownloadPdf');
+    dlDocx.href = `/descargar/${data.filename}`;
+    dlPdf.href  = `/descargar-pdf/${data.filename.replace('.docx','.pdf')}`;
+    document.getElementById('downloadGroup').className = 'download-group show';
+    addHistorial(data.ot_num, data.filename);
+  }
+}
+function seguirJob(job) {
+  // Progreso por Server-Sent Events: queued → extracting → generating → logged → pdf-ready
+  return new Promise(resolve => {
+    const es = new EventSource(job.eventos_url);
+    let resultado = null;
+    const fin = () => { es.close(); resolve(); };
+    Object.keys(ETAPAS).forEach(etapa =>
+      es.addEventListener(etapa, () => showStatus('loading', '⏳', ETAPAS[etapa])));
+    es.addEventListener('logged', e => {
+      resultado = JSON.parse(e.data);
+      mostrarResultado(resultado);
+      document.getElementById('btnGenerar').disabled = false;
+    });
+    es.addEventListener('pdf-ready', () => {
+      if (resultado) document.getElementById('statusText').innerHTML =
+        `<strong>${tituloOt(resultado)}</strong><br>Cliente: ${(resultado.cliente||'').split('-')[0].trim()}<br><small>PDF listo ✔</small>`;
+      fin();
+    });
+    es.addEventListener('pdf-error', fin);
+    es.addEventListener('done',  e => { mostrarResultado(JSON.parse(e.data)); fin(); });
+    es.addEventListener('error', e => {
+      if (e.data) mostrarResultado(JSON.parse(e.data));
+      else if (!resultado) showStatus('error', '❌', 'Se perdió la conexión con el servidor.');
+      fin();
+    });
+  });
+}
 async function procesar() {
   const fileInput = document.getElementById('fileInput');
   if (!fileInput.files || fileInput.files.length === 0) { alert('Selecciona un archivo PDF primero.'); return; }
   document.getElementById('btnGenerar').disabled = true;
   resetStatus();
-  showStatus('loading', '⏳', 'Leyendo y extrayendo datos de la proforma…');
+  showStatus('loading', '⏳', 'Subiendo proforma…');
   const fd = new FormData();
   fd.append('pdf', fileInput.files[0]);
   fd.append('estado', estadoSeleccionado);
   try {
-    const res  = await fetch('/procesar', { method:'POST', body:fd });
+    const res  = await fetch('/jobs', { method:'POST', body:fd });
     const data = await res.json();
-    if (data.error) {
-      showStatus('error', '❌', `<strong>Error:</strong> ${data.error}`);
-    } else if (!data.aprobada) {
-      showStatus('rejected', '⚠️', `<strong>Proforma ${data.numero_proforma} marcada como RECHAZADA.</strong><br>No se generó OT.`);
+    if (res.status === 429) {
+      showStatus('error', '⏳', `<strong>Servidor ocupado:</strong> ${data.error}`);
+    } else if (res.status !== 202) {
+      mostrarResultado(data);
     } else {
-      showStatus('success', '✅', `<strong>OT generada: ${data.ot_num}</strong><br>Cliente: ${(data.cliente||'').split('-')[0].trim()}`);
-      showPreview(data);
-      const dlDocx = document.getElementById('btnDownloadDocx');
-      const dlPdf  = document.getElementById('btnDownloadPdf');
-      dlDocx.href = `/descargar/${data.filename}`;
-      dlPdf.href  = `/descargar-pdf/${data.filename.replace('.docx','.pdf')}`;
-      document.getElementById('downloadGroup').className = 'download-group show';
-      addHistorial(data.ot_num, data.filename);
+      await seguirJob(data);
     }
   } catch(e) {
     showStatus('error', '❌', `Error de conexión: ${e.message}`);
@@ -259,62 +357,429 @@ async function procesar() {
 </html>"""
 
 
+# ═══ CACHÉ HTTP ══════════════════════════════════════════════════════════════
+# El índice y el logo se comprimen una sola vez al arrancar. Una OT no cambia
+# nunca después de emitida: se sirve con ETag fuerte (su SHA-256) e immutable,
+# y una descarga repetida se resuelve con un 304 sin leer el archivo.
+INMUTABLE = 'private, max-age=31536000, immutable'
+
+class _Estatico:
+    """Contenido fijo con sus variantes precomprimidas por codificación"""
+
+    def __init__(self, datos, mimetype):
+        self.mimetype  = mimetype
+        self.etag      = hashlib.sha256(datos).hexdigest()[:32]
+        self.variantes = {'identity': datos}
+        comprimidas = {'gzip': gzip.compress(datos, 9, mtime=0)}
+        if BROTLI_ENABLED:
+            comprimidas['br'] = brotli.compress(datos, quality=11)
+        for codificacion, variante in comprimidas.items():
+            # Un PNG ya viene comprimido: la variante se ofrece solo si ahorra algo
+            if len(variante) < len(datos) * 0.95:
+                self.variantes[codificacion] = variante
+
+    def respuesta(self, cache_control):
+        codificacion = next((c for c in ('br', 'gzip') if c in self.variantes and request.accept_encodings[c]), 'identity')
+        datos = self.variantes[codificacion]
+        resp  = Response(datos, mimetype=self.mimetype)
+        if codificacion == 'identity':
+            resp.set_etag(self.etag)
+        else:
+            resp.set_etag(f'{self.etag}-{codificacion}')
+            resp.content_encoding = codificacion
+        resp.vary.add('Accept-Encoding')
+        resp.headers['Cache-Control'] = cache_control
+        return resp.make_conditional(request, accept_ranges=True, complete_length=len(datos))
+
+def _no_modificado(etag):
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = INMUTABLE
+    return resp
+
+def _enviar_inmutable(fuente, etag, download_name, mimetype=None):
+    """send_file con ETag fuerte; Werkzeug atiende If-None-Match, Range e If-Range"""
+    resp = send_file(fuente, mimetype=mimetype, as_attachment=True, download_name=download_name, etag=etag)
+    resp.headers['Cache-Control'] = INMUTABLE
+    return resp
+
+_logo_path = os.path.join(BASE_DIR, 'logo_metromecanica.png')
+_LOGO = None
+if os.path.exists(_logo_path):
+    with open(_logo_path, 'rb') as f:
+        _LOGO = _Estatico(f.read(), 'image/png')
+    # URL versionada por contenido: el navegador no vuelve a pedir el logo
+    HTML = HTML.replace('src="/logo"', f'src="/logo?v={_LOGO.etag[:12]}"')
+_INDICE = _Estatico(HTML.encode('utf-8'), 'text/html; charset=utf-8')
+
 @app.route('/')
 def index():
-    return HTML
+    # Se revalida en cada carga; mientras no cambie el despliegue, 304 sin cuerpo
+    return _INDICE.respuesta('no-cache')
 
-@app.route('/procesar', methods=['POST'])
-def procesar():
-    pdf_file = request.files.get('pdf')
-    estado   = request.form.get('estado', 'aprobada')
-    if not pdf_file or not pdf_file.filename.lower().endswith('.pdf'):
-        return jsonify({'error': 'Debes subir un archivo PDF válido.'}), 400
-    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-        pdf_file.save(tmp.name)
-        tmp_pdf = tmp.name
+def _fila_auditoria(data, ot_num):
+    return {'ot_number': ot_num, 'expediente': data.get('expediente',''), 'numero_proforma': data.get('numero_proforma',''), 'cliente': data.get('cliente',''), 'ruc_cliente': data.get('ruc_cliente',''), 'total_items': data.get('total_items',0), 'tipo_servicio': data.get('tipo_servicio','GENERAL'), 'fecha_emision': data.get('fecha_emision',''), 'plazo_entrega': data.get('plazo_entrega','')}
+
+# ═══ IDEMPOTENCIA POR PROFORMA ═══════════════════════════════════════════════
+# Una proforma ya emitida devuelve su OT existente salvo force=1. El bloqueo
+# (por franjas, según el número) serializa los clics duplicados; _ots_en_curso
+# cubre las OTs ya generadas cuya fila de auditoría aún no se escribió (lotes).
+_LOCKS_PROFORMA = [threading.Lock() for _ in range(32)]
+_ots_en_curso   = {}   # numero_proforma -> (ot_num, ot_path)
+
+def _bloqueo_proforma(numero):
+    return _LOCKS_PROFORMA[hash(numero) % len(_LOCKS_PROFORMA)]
+
+def _ot_existente(numero):
+    """(ot_num, ot_path) de la última OT de la proforma, si su DOCX sigue disponible"""
+    existente = _ots_en_curso.get(numero)
+    if existente is None and AUDIT_ENABLED:
+        fila = audit_logger.get_ot_por_proforma(numero)
+        if fila:
+            existente = (fila['ot_number'], fila['filepath'] or f"{fila['ot_number']}.docx")
+    # El índice de artifact_store resuelve la ruta auditada aunque la OT ya esté empaquetada
+    if existente and artifact_store.ubicar(existente[1]):
+        return existente
+    return None
+
+def _liberar_proforma(fila):
+    """La OT ya quedó auditada: deja de resolverse desde memoria"""
+    numero = fila.get('numero_proforma', '')
+    if _ots_en_curso.get(numero, (None,))[0] == fila['ot_number']:
+        del _ots_en_curso[numero]
+
+def _respuesta_ot(data, ot_num, ot_filename, tiempos):
+    return {'aprobada': True, 'ot_num': ot_num, 'filename': ot_filename, 'cliente': data.get('cliente',''), 'equipos': data.get('equipos',[]), 'numero_proforma': data.get('numero_proforma',''), 'fecha_emision': data.get('fecha_emision',''), 'contacto_cliente': data.get('contacto_cliente',''), 'plazo_entrega': data.get('plazo_entrega',''), 'tiempos_ms': tiempos}
+
+def _asignar_numero(data):
+    """
+    Fija ot_number y expediente en data con el correlativo de audit_logger
+    (generate_ot.js los usa tal cual). Sin auditoría, el renderer numera solo.
+
+    Returns:
+        (año, número reservado o None)
+    """
+    fecha = data.get('fecha_emision', '')
+    anio  = int(fecha[-4:]) if re.fullmatch(r'\d{2}/\d{2}/\d{4}', fecha) else datetime.now().year
+    if not AUDIT_ENABLED:
+        return anio, None
+    correlativo = audit_logger.siguiente_ot(anio)
+    data['ot_number']  = audit_logger.formato_ot(anio, correlativo)
+    data['expediente'] = str(time.time_ns() // 1_000_000)
+    return anio, correlativo
+
+def _generar_ot(pdf_bytes, job=None, force=False):
+    """
+    Extrae y genera la OT de una proforma subida (sin auditar).
+    Si la proforma ya tiene OT y no se pide force, devuelve la existente con
+    existente=True y fila_auditoria None.
+
+    Returns:
+        (respuesta, status_http, ot_path, fila_auditoria)
+    """
+    emitir = job.emitir if job else (lambda etapa, datos=None, final=False: None)
+    emitir('extracting')
     try:
-        result = subprocess.run([sys.executable, EXTRACTOR, tmp_pdf, '--estado', estado], capture_output=True, text=True)
-        if result.returncode != 0:
-            return jsonify({'error': f'Error al leer el PDF: {result.stderr}'}), 500
-        data = json.loads(result.stdout)
-        if not data.get('aprobada'):
-            return jsonify({'aprobada': False, 'numero_proforma': data.get('numero_proforma', '')})
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as jf:
-            json.dump(data, jf, ensure_ascii=False)
-            tmp_json = jf.name
+        with metrics.etapa('extract'):
+            data, tiempos = extractor_pool.extraer(pdf_bytes)
+    except extractor_pool.ExtractionBusy as e:
+        return {'error': str(e)}, 503, None, None
+    except extractor_pool.ExtractionTimeout as e:
+        return {'error': f'Error al leer el PDF: {e}'}, 504, None, None
+    except Exception as e:
+        return {'error': f'Error al leer el PDF: {e}'}, 500, None, None
+    if not data.get('aprobada'):
+        return {'aprobada': False, 'numero_proforma': data.get('numero_proforma', '')}, 200, None, None
+    numero = data.get('numero_proforma', '')
+    identificada = numero not in ('', 'SIN-NUM')
+    with _bloqueo_proforma(numero) if identificada else contextlib.nullcontext():
+        existente = _ot_existente(numero) if identificada and not force else None
+        if existente:
+            ot_num, ot_path = existente
+            pdf_cache.programar(ot_path)
+            respuesta = _respuesta_ot(data, ot_num, os.path.basename(ot_path), tiempos)
+            respuesta['existente'] = True
+            return respuesta, 200, ot_path, None
+        emitir('generating', {'numero_proforma': numero})
+        t_gen = time.perf_counter()
+        anio, correlativo = _asignar_numero(data)
+        try:
+            with metrics.etapa('render'):
+                ot_num, docx_bytes = ot_renderer.render_ot(data)
+        except ot_renderer.RenderError as e:
+            if correlativo is not None:
+                audit_logger.devolver_ot(anio, correlativo)
+            return {'error': f'Error al generar OT: {e}'}, 500, None, None
+        ot_filename = f'{ot_num}.docx'
+        ot_path     = artifact_store.guardar(ot_filename, docx_bytes, ot_num)
+        if identificada:
+            _ots_en_curso[numero] = (ot_num, ot_path)
+    tiempos['generate'] = round((time.perf_counter() - t_gen) * 1000, 1)
+    pdf_cache.programar(ot_path)
+    return _respuesta_ot(data, ot_num, ot_filename, tiempos), 200, ot_path, _fila_auditoria(data, ot_num)
+
+def _procesar_pdf(pdf_bytes, job=None, force=False):
+    """
+    Extrae, genera y registra la OT de una proforma subida
+
+    Returns:
+        (respuesta, status_http, ot_path)
+    """
+    respuesta, status, ot_path, fila = _generar_ot(pdf_bytes, job, force)
+    if fila:
         try:
-            gen_result = subprocess.run(['node', GENERATOR, '--file', tmp_json], capture_output=True, text=True, cwd=OUTPUT_DIR)
-            if gen_result.returncode != 0:
-                return jsonify({'error': f'Error al generar OT: {gen_result.stderr}'}), 500
-            ot_path     = gen_result.stdout.strip().replace('OK:', '').strip()
-            ot_filename = os.path.basename(ot_path)
-            ot_num      = ot_filename.replace('.docx', '')
             if AUDIT_ENABLED:
-                audit_logger.register_ot({'ot_number': ot_num, 'expediente': data.get('expediente',''), 'numero_proforma': data.get('numero_proforma',''), 'cliente': data.get('cliente',''), 'ruc_cliente': data.get('ruc_cliente',''), 'total_items': data.get('total_items',0), 'tipo_servicio': data.get('tipo_servicio','GENERAL'), 'fecha_emision': data.get('fecha_emision',''), 'plazo_entrega': data.get('plazo_entrega','')}, ot_path)
-            return jsonify({'aprobada': True, 'ot_num': ot_num, 'filename': ot_filename, 'cliente': data.get('cliente',''), 'equipos': data.get('equipos',[]), 'numero_proforma': data.get('numero_proforma',''), 'fecha_emision': data.get('fecha_emision',''), 'contacto_cliente': data.get('contacto_cliente',''), 'plazo_entrega': data.get('plazo_entrega','')})
+                with metrics.etapa('audit'):
+                    audit_logger.register_ot(fila, ot_path)
         finally:
-            os.unlink(tmp_json)
+            _liberar_proforma(fila)
+    return respuesta, status, ot_path
+
+def _leer_upload():
+    """Valida el PDF del formulario y lo lee a memoria. Devuelve (bytes, error)"""
+    with metrics.etapa('upload'):
+        pdf_file = request.files.get('pdf')
+    if not pdf_file or not pdf_file.filename.lower().endswith('.pdf'):
+        return None, (jsonify({'error': 'Debes subir un archivo PDF válido.'}), 400)
+    return pdf_file.read(), None
+
+@app.route('/procesar', methods=['POST'])
+def procesar():
+    estado = request.form.get('estado', 'aprobada')
+    pdf_bytes, error = _leer_upload()
+    if error:
+        return error
+    if estado == 'rechazada':
+        return jsonify({'aprobada': False, 'numero_proforma': ''})
+    try:
+        respuesta, status, _ = _procesar_pdf(pdf_bytes, force=request.form.get('force') == '1')
+        return jsonify(respuesta), status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        os.unlink(tmp_pdf)
+
+# ═══ PROCESAMIENTO POR LOTE ══════════════════════════════════════════════════
+LOTE_WORKERS = int(os.environ.get('LOTE_WORKERS', os.cpu_count() or 2))
+
+def _archivos_lote():
+    """
+    Reúne los PDFs del formulario, sueltos o dentro de ZIPs. Devuelve
+    [(nombre, bytes)]; el total respeta los topes de zip_stream
+    """
+    archivos, total = [], 0
+    for f in request.files.getlist('pdf') + request.files.getlist('zip'):
+        nombre = os.path.basename(f.filename or '')
+        datos  = f.read()
+        if nombre.lower().endswith('.zip'):
+            nuevos = zip_stream.leer_entradas(datos, '.pdf',
+                                              max_bytes=zip_stream.LOTE_MAX_BYTES - total,
+                                              max_entradas=zip_stream.LOTE_MAX_ENTRADAS - len(archivos))
+        elif nombre.lower().endswith('.pdf'):
+            nuevos = [(nombre, datos)]
+        else:
+            continue
+        archivos.extend(nuevos)
+        total += sum(len(d) for _, d in nuevos)
+        if len(archivos) > zip_stream.LOTE_MAX_ENTRADAS:
+            raise zip_stream.LoteExcedido(f'El lote supera {zip_stream.LOTE_MAX_ENTRADAS} archivos')
+    return archivos
+
+def _procesar_archivo_lote(nombre, datos, incluir_pdf, force):
+    respuesta, status, ot_path, fila = _generar_ot(datos, force=force)
+    item = {'archivo': nombre, 'estado': 'ok' if ot_path else ('rechazada' if status == 200 else 'error')}
+    if status != 200:
+        item['error'] = respuesta.get('error', '')
+    if ot_path:
+        item.update({'ot_num': respuesta['ot_num'], 'numero_proforma': respuesta['numero_proforma'], 'docx': respuesta['filename']})
+        if respuesta.get('existente'):
+            item['existente'] = True
+        if incluir_pdf:
+            estado, detalle = pdf_cache.esperar(ot_path, timeout=office_converter.TIMEOUT + office_converter.QUEUE_TIMEOUT)
+            if estado == pdf_cache.LISTO:
+                item['pdf'] = respuesta['filename'].replace('.docx', '.pdf')
+                item['_pdf_path'] = detalle
+            else:
+                item['error_pdf'] = detalle or 'PDF no generado a tiempo'
+    return item, ot_path, fila
+
+class _AuditoriaLote:
+    """
+    Filas de auditoría de un lote: se escriben todas en una sola transacción
+    cuando terminaron todos los archivos, y una única vez. Lo dispara el final
+    del streaming o, si el cliente cortó la descarga o nunca la empezó, el
+    cierre de la respuesta; las OTs que siguen generándose en segundo plano
+    también quedan registradas
+    """
+    def __init__(self, futuros, executor):
+        self.futuros  = futuros
+        self.executor = executor
+        self.lock     = threading.Lock()
+        self.hecho    = False
+
+    def registrar(self):
+        with self.lock:
+            if self.hecho:
+                return
+            self.hecho = True
+            wait(self.futuros)
+            auditoria = []
+            for futuro in self.futuros:
+                if futuro.exception() is None:
+                    item, ot_path, fila = futuro.result()
+                    if fila:
+                        auditoria.append((item, fila, ot_path))
+            if auditoria and AUDIT_ENABLED:
+                try:
+                    with metrics.etapa('audit'):
+                        insertadas = audit_logger.register_ots([(fila, ot_path) for _, fila, ot_path in auditoria])
+                    for (item, _, _), ok in zip(auditoria, insertadas):
+                        item['auditado'] = ok
+                except Exception as e:
+                    metrics.log('auditoría del lote fallida', logging.ERROR, error=str(e))
+                    for item, _, _ in auditoria:
+                        item['auditado'] = False
+                        item['error_auditoria'] = str(e)
+            for _, fila, _ in auditoria:
+                _liberar_proforma(fila)
+            self.executor.shutdown(wait=False)
+
+@app.route('/procesar-lote', methods=['POST'])
+def procesar_lote():
+    try:
+        with metrics.etapa('upload'):
+            archivos = _archivos_lote()
+    except zip_stream.LoteExcedido as e:
+        return jsonify({'error': str(e)}), 413
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'El ZIP subido no es válido.'}), 400
+    if not archivos:
+        return jsonify({'error': 'Debes subir uno o más PDFs o un ZIP con PDFs.'}), 400
+    incluir_pdf = request.form.get('pdf_ot', '1') not in ('0', 'false', 'no')
+    force    = request.form.get('force') == '1'
+    executor = ThreadPoolExecutor(max_workers=min(LOTE_WORKERS, len(archivos)))
+    # Cada hilo suma sus etapas a la traza de esta solicitud
+    futuros  = {executor.submit(metrics.propagar(_procesar_archivo_lote), n, d, incluir_pdf, force): n for n, d in archivos}
+    auditoria = _AuditoriaLote(futuros, executor)
+
+    def generar():
+        zs = zip_stream.ZipStream()
+        manifiesto, en_zip = [], set()
+        try:
+            for futuro in as_completed(futuros):
+                try:
+                    item, ot_path, fila = futuro.result()
+                except Exception as e:
+                    item, ot_path, fila = {'archivo': futuros[futuro], 'estado': 'error', 'error': str(e)}, None, None
+                pdf_path = item.pop('_pdf_path', None)
+                if ot_path:
+                    # Proformas repetidas dentro del lote comparten la misma OT
+                    if item['docx'] not in en_zip:
+                        en_zip.add(item['docx'])
+                        yield zs.agregar(f"docx/{item['docx']}", artifact_store.leer(ot_path))
+                        if pdf_path:
+                            yield zs.agregar_archivo(f"pdf/{item['pdf']}", pdf_path)
+                manifiesto.append(item)
+        finally:
+            # Si el cliente cortó la descarga, espera al resto del lote y lo audita igual
+            auditoria.registrar()
+        resumen = {
+            'total': len(archivos),
+            'ok': sum(1 for m in manifiesto if m['estado'] == 'ok'),
+            'errores': sum(1 for m in manifiesto if m['estado'] == 'error'),
+            'archivos': manifiesto,
+        }
+        yield zs.agregar('manifiesto.json', json.dumps(resumen, ensure_ascii=False, indent=2))
+        yield zs.cerrar()
+
+    nombre_zip = f"ordenes_lote_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    respuesta  = Response(generar(), mimetype='application/zip', headers={'Content-Disposition': f'attachment; filename={nombre_zip}'})
+    # Un generador cerrado antes de su primer chunk no ejecuta su finally
+    respuesta.call_on_close(auditoria.registrar)
+    return respuesta
+
+# ═══ TRABAJOS ASÍNCRONOS ═════════════════════════════════════════════════════
+def _job_procesar(job, pdf_bytes, force=False):
+    respuesta, status, ot_path = _procesar_pdf(pdf_bytes, job, force)
+    job.terminar(respuesta, status)
+    # La solicitud que lo creó ya respondió 202: el trabajo deja su propia línea con el mismo request_id
+    traza = metrics.traza_actual()
+    metrics.log('trabajo', job_id=job.id, estado=status, **(traza.resumen() if traza else {}))
+    if status != 200:
+        job.emitir('error', respuesta, final=True)
+        return
+    if not ot_path:
+        job.emitir('done', respuesta, final=True)
+        return
+    job.emitir('logged', respuesta)
+    pdf_url = '/descargar-pdf/' + respuesta['filename'].replace('.docx', '.pdf')
+    def pdf_listo(estado, detalle):
+        if estado == pdf_cache.LISTO:
+            job.emitir('pdf-ready', {'pdf_url': pdf_url}, final=True)
+        else:
+            job.emitir('pdf-error', {'error': detalle}, final=True)
+    pdf_cache.al_terminar(ot_path, pdf_listo)
+
+@app.route('/jobs', methods=['POST'])
+def crear_job():
+    estado = request.form.get('estado', 'aprobada')
+    pdf_bytes, error = _leer_upload()
+    if error:
+        return error
+    if estado == 'rechazada':
+        return jsonify({'aprobada': False, 'numero_proforma': ''})
+    try:
+        job = jobs.enviar(metrics.propagar(_job_procesar), pdf_bytes, request.form.get('force') == '1')
+    except jobs.QueueFull as e:
+        resp = jsonify({'error': str(e)})
+        resp.headers['Retry-After'] = '5'
+        return resp, 429
+    return jsonify({'id': job.id, 'status_url': url_for('consultar_job', job_id=job.id), 'eventos_url': url_for('eventos_job', job_id=job.id)}), 202
+
+@app.route('/jobs/<job_id>')
+def consultar_job(job_id):
+    job = jobs.obtener(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/eventos')
+def eventos_job(job_id):
+    job = jobs.obtener(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    desde = request.headers.get('Last-Event-ID', type=int)
+    desde = 0 if desde is None else desde + 1
+    return Response(jobs.stream_sse(job, desde), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/logo')
 def serve_logo():
-    logo_path = os.path.join(BASE_DIR, 'logo_metromecanica.png')
-    if os.path.exists(logo_path):
-        return send_file(logo_path, mimetype='image/png')
-    return '', 404
+    if _LOGO is None:
+        return '', 404
+    if request.args.get('v') == _LOGO.etag[:12]:
+        return _LOGO.respuesta('public, max-age=31536000, immutable')
+    return _LOGO.respuesta('no-cache')
 
 @app.route('/descargar/<filename>')
 def descargar(filename):
     safe_name = os.path.basename(filename)
     if not safe_name.endswith('.docx'):
         return 'Archivo no válido', 400
-    filepath = os.path.join(OUTPUT_DIR, safe_name)
-    if not os.path.exists(filepath):
+    art = artifact_store.ubicar(safe_name)
+    if art is None:
+        return 'Archivo no encontrado', 404
+    etag = art.sha256 or artifact_store.sha256(safe_name)
+    if request.if_none_match.contains_weak(etag):
+        return _no_modificado(etag)
+    if art.desplazamiento is None:
+        try:
+            return _enviar_inmutable(art.ruta, etag, safe_name)
+        except FileNotFoundError:
+            # Se empaquetó entre ubicar y la apertura: leer la vuelve a ubicar
+            pass
+    # Empaquetada: se lee solo su tramo del ZIP mensual
+    try:
+        return _enviar_inmutable(io.BytesIO(artifact_store.leer(safe_name)), etag, safe_name)
+    except FileNotFoundError:
         return 'Archivo no encontrado', 404
-    return send_file(filepath, as_attachment=True, download_name=safe_name)
 
 @app.route('/descargar-pdf/<filename>')
 def descargar_pdf(filename):
@@ -322,42 +787,106 @@ def descargar_pdf(filename):
     if not safe_name.endswith('.pdf'):
         return 'Archivo no válido', 400
     docx_name = safe_name.replace('.pdf', '.docx')
-    docx_path = os.path.join(OUTPUT_DIR, docx_name)
-    if not os.path.exists(docx_path):
+    if artifact_store.ubicar(docx_name) is None:
         return 'Archivo Word no encontrado', 404
-    pdf_path = os.path.join(OUTPUT_DIR, safe_name)
-    if os.path.exists(pdf_path):
-        return send_file(pdf_path, as_attachment=True, download_name=safe_name)
-    try:
-        subprocess.run(['soffice', '--headless', '--convert-to', 'pdf', '--outdir', OUTPUT_DIR, docx_path], check=True, capture_output=True, timeout=30)
-        if os.path.exists(pdf_path):
-            return send_file(pdf_path, as_attachment=True, download_name=safe_name)
-        return 'Error al generar PDF', 500
-    except Exception as e:
-        return f'Error: {str(e)}', 500
+    # ETag = <sha256 del DOCX>.<generación del PDF>: el PDF de un mismo DOCX es
+    # equivalente aunque se haya desalojado y regenerado, así que basta el
+    # prefijo para el 304; la generación distingue los bytes para If-Range
+    digest = artifact_store.sha256(docx_name)
+    previo = next((e for e in request.if_none_match.as_set(include_weak=True) if e.split('.')[0] == digest), None)
+    if previo:
+        return _no_modificado(previo)
+    estado, detalle = pdf_cache.consultar(docx_name)
+    if estado == pdf_cache.LISTO:
+        etag = f'{digest}.{os.stat(detalle).st_mtime_ns:x}'
+        return _enviar_inmutable(detalle, etag, safe_name, mimetype='application/pdf')
+    if estado == pdf_cache.ERROR:
+        return f'Error: {detalle}', 500
+    poll_url = url_for('descargar_pdf', filename=safe_name)
+    resp = jsonify({'estado': pdf_cache.PENDIENTE, 'poll_url': poll_url})
+    resp.status_code = 202
+    resp.headers['Location']    = poll_url
+    resp.headers['Retry-After'] = '2'
+    return resp
+
+def _csv_stream(filas, comprimir=False, filas_por_bloque=500):
+    """Genera el CSV por bloques (BOM UTF-8 para Excel), opcionalmente en gzip"""
+    import csv
+    import io
+    import zlib
+    gz  = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    def drenar(final=False):
+        datos = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        if gz is None:
+            return datos
+        return gz.compress(datos) + (gz.flush() if final else b'')
+    buf.write('\ufeff')
+    writer.writerow(audit_logger.CSV_FIELDS)
+    for i, fila in enumerate(filas, 1):
+        writer.writerow(fila)
+        if i % filas_por_bloque == 0:
+            bloque = drenar()
+            if bloque:
+                yield bloque
+    yield drenar(final=True)
 
 @app.route('/auditoria/exportar')
 def exportar_auditoria():
     if not AUDIT_ENABLED:
         return jsonify({'error': 'Sistema de auditoría no disponible'}), 503
-    import tempfile
-    from datetime import datetime, timedelta
-    csv_file = tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False)
-    csv_path = csv_file.name
-    csv_file.close()
-    end_date   = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-    if audit_logger.export_audit_csv(csv_path, start_date, end_date):
-        return send_file(csv_path, mimetype='text/csv', as_attachment=True, download_name=f'auditoria_inacal_{end_date}.csv')
-    return jsonify({'error': 'No hay registros'}), 404
+    from datetime import datetime, timedelta, date
+    hoy = datetime.now()
+    end_date   = request.args.get('end') or hoy.strftime('%Y-%m-%d')
+    start_date = request.args.get('start') or (hoy - timedelta(days=365)).strftime('%Y-%m-%d')
+    cliente    = request.args.get('cliente') or None
+    after_id   = request.args.get('after_id', type=int)
+    comprimir  = request.args.get('gzip', '0') in ('1', 'true', 'si')
+    try:
+        date.fromisoformat(start_date)
+        date.fromisoformat(end_date)
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas, usa el formato YYYY-MM-DD'}), 400
+    filas   = audit_logger.iter_audit_rows(start_date, end_date, cliente, after_id)
+    primera = next(filas, None)
+    if primera is None:
+        return jsonify({'error': 'No hay registros'}), 404
+    def todas():
+        yield primera
+        yield from filas
+    nombre  = f'auditoria_inacal_{end_date}.csv' + ('.gz' if comprimir else '')
+    mime    = 'application/gzip' if comprimir else 'text/csv'
+    return Response(_csv_stream(todas(), comprimir), mimetype=mime, headers={'Content-Disposition': f'attachment; filename={nombre}'})
 
 @app.route('/auditoria/estadisticas')
 def estadisticas_auditoria():
     if not AUDIT_ENABLED:
         return jsonify({'error': 'Sistema de auditoría no disponible'}), 503
-    return jsonify(audit_logger.get_statistics())
+    etag = f'stats-{audit_logger.get_statistics_version()}'
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify(audit_logger.get_statistics())
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/conversor/estadisticas')
+def estadisticas_conversor():
+    return jsonify(office_converter.get_metricas())
+
+@app.route('/extraccion/estadisticas')
+def estadisticas_extraccion():
+    return jsonify(extract_cache.get_metricas())
+
+@app.route('/artefactos/estadisticas')
+def estadisticas_artefactos():
+    return jsonify(artifact_store.get_metricas())
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    print(f"\n{'='*55}\n  METROMECANICA · Sistema de OT\n  Puerto: {port}\n{'='*55}\n")
+    metrics.log('METROMECANICA · Sistema de OT', puerto=port)
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,496 @@
+"""
+artifact_store.py - Almacén de las OTs generadas: índice, archivo mensual y cuota
+Los DOCX se guardan en ordenes_generadas/AAAA/MM/ y se indexan en SQLite
+(nombre -> ubicación, tamaño y SHA-256). Los meses cerrados se empaquetan en un
+ZIP por mes (AAAA/AAAA-MM.zip) y cada OT se sigue leyendo del paquete por su
+desplazamiento, sin recorrer el ZIP. Los PDFs de pdf_cache, que se pueden
+regenerar, se desalojan por LRU cuando el total supera la cuota; los DOCX
+nunca se borran.
+
+El índice resuelve por nombre de archivo: la ruta guardada en audit_log
+(filepath) sigue sirviendo aunque la OT ya esté dentro de un paquete.
+
+Mantenimiento manual:
+    python artifact_store.py --mantenimiento [--reindexar]
+    python artifact_store.py --verificar
+"""
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import hashlib
+import zipfile
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+BASE_DIR  = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.path.join(BASE_DIR, 'ordenes_generadas')
+DB_PATH   = os.environ.get('ARTEFACTOS_DB_PATH', os.path.join(STORE_DIR, '.artefactos.db'))
+
+# El disco de Render es de 1 GB: se deja margen para las bases SQLite
+CUOTA_BYTES     = int(float(os.environ.get('ARTEFACTOS_CUOTA_MB', 800)) * 1024 * 1024)
+# Un mes se empaqueta cuando su último día tiene más de ARCHIVAR_DIAS días
+ARCHIVAR_DIAS   = int(os.environ.get('ARTEFACTOS_ARCHIVAR_DIAS', 45))
+MANTENIMIENTO_S = float(os.environ.get('ARTEFACTOS_MANTENIMIENTO_MIN', 60)) * 60
+# Los PDFs usados hace menos de esto no se desalojan (descargas y lotes en curso)
+PDF_GRACIA_S    = 600
+
+_RE_DOCX = re.compile(r'OT-[\w-]+\.docx$')
+_RE_PDF  = re.compile(r'[0-9a-f]{64}\.pdf$')
+
+_lock          = threading.Lock()
+_lock_mantener = threading.Lock()
+_local         = threading.local()
+_iniciado      = False
+_ultimo_mantenimiento = 0.0
+_metricas = {'guardados': 0, 'empaquetados': 0, 'pdfs_desalojados': 0, 'bytes_desalojados': 0,
+             'mantenimientos': 0, 'ultimo_mantenimiento': None, 'error_mantenimiento': None}
+
+
+class ArtefactoCorrupto(Exception):
+    """El contenido leído no coincide con el CRC registrado"""
+
+
+# desplazamiento es None para un archivo suelto; en un paquete apunta al
+# inicio de los datos del miembro y guardado es su tamaño comprimido
+Artefacto = namedtuple('Artefacto', 'nombre ruta desplazamiento tamano guardado compresion crc sha256')
+
+
+def _get_conn():
+    """Conexión por hilo y por proceso; las tablas se crean una vez"""
+    global _iniciado
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # El índice es lo único que ubica una OT dentro de su paquete
+        conn.execute('PRAGMA synchronous=FULL')
+        _local.conn, _local.pid = conn, os.getpid()
+    with _lock:
+        if not _iniciado:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS artefactos (
+                nombre         TEXT PRIMARY KEY,
+                ot_number      TEXT,
+                mes            TEXT NOT NULL,
+                ruta           TEXT NOT NULL,
+                desplazamiento INTEGER,
+                tamano         INTEGER NOT NULL,
+                guardado       INTEGER NOT NULL,
+                compresion     INTEGER NOT NULL DEFAULT 0,
+                crc            INTEGER,
+                sha256         TEXT,
+                creado         REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_artefactos_mes ON artefactos(mes);
+            CREATE TABLE IF NOT EXISTS pdfs (
+                sha256 TEXT PRIMARY KEY,
+                ruta   TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                usado  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pdfs_usado ON pdfs(usado);
+            ''')
+            _iniciado = True
+    return conn
+
+
+def _contar(clave, n=1):
+    with _lock:
+        _metricas[clave] += n
+
+
+def _absoluta(ruta):
+    # Rutas relativas a STORE_DIR: el punto de montaje del disco puede cambiar
+    return os.path.join(STORE_DIR, ruta)
+
+
+def _relativa(ruta):
+    return os.path.relpath(ruta, STORE_DIR)
+
+
+# ═══ DOCX ════════════════════════════════════════════════════════════════════
+
+def guardar(nombre, datos, ot_number=None):
+    """
+    Escribe el DOCX en el directorio del mes en curso y lo indexa
+
+    Returns:
+        Ruta absoluta del archivo (la que se registra en audit_log)
+    """
+    ahora = time.time()
+    mes   = datetime.fromtimestamp(ahora).strftime('%Y-%m')
+    ruta  = os.path.join(STORE_DIR, *mes.split('-'), nombre)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + '.tmp', 'wb') as f:
+        f.write(datos)
+    os.replace(ruta + '.tmp', ruta)
+    conn = _get_conn()
+    with conn:
+        conn.execute('''INSERT OR REPLACE INTO artefactos
+                        (nombre, ot_number, mes, ruta, desplazamiento, tamano, guardado, compresion, crc, sha256, creado)
+                        VALUES (?, ?, ?, ?, NULL, ?, ?, 0, NULL, ?, ?)''',
+                     (nombre, ot_number, mes, _relativa(ruta), len(datos), len(datos),
+                      hashlib.sha256(datos).hexdigest(), ahora))
+    _contar('guardados')
+    _programar_mantenimiento()
+    return ruta
+
+
+def _indexar_suelto(conn, ruta):
+    """Registra un DOCX suelto que no está en el índice (disposición plana anterior)"""
+    st = os.stat(ruta)
+    with open(ruta, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    nombre = os.path.basename(ruta)
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO artefactos
+                        (nombre, ot_number, mes, ruta, desplazamiento, tamano, guardado, compresion, crc, sha256, creado)
+                        VALUES (?, ?, ?, ?, NULL, ?, ?, 0, NULL, ?, ?)''',
+                     (nombre, nombre[:-5], datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m'),
+                      _relativa(ruta), st.st_size, st.st_size, digest, st.st_mtime))
+
+
+def _fila(conn, nombre):
+    return conn.execute('''SELECT nombre, ruta, desplazamiento, tamano, guardado, compresion, crc, sha256
+                           FROM artefactos WHERE nombre = ?''', (nombre,)).fetchone()
+
+
+def ubicar(ref):
+    """
+    Ubica una OT por nombre de archivo o por cualquier ruta que termine en él
+    (p. ej. el filepath de audit_log, aunque la OT ya esté empaquetada)
+
+    Returns:
+        Artefacto, o None si no existe
+    """
+    nombre = os.path.basename(ref)
+    if not _RE_DOCX.match(nombre):
+        return None
+    conn = _get_conn()
+    fila = _fila(conn, nombre)
+    if fila is None:
+        # OT anterior al índice: queda registrada la primera vez que se pide
+        for ruta in (os.path.join(STORE_DIR, nombre), ref if os.path.isabs(ref) else None):
+            if ruta and os.path.isfile(ruta):
+                _indexar_suelto(conn, ruta)
+                fila = _fila(conn, nombre)
+                break
+        else:
+            return None
+    return Artefacto(fila[0], _absoluta(fila[1]), *fila[2:])
+
+
+def _leer(art):
+    with open(art.ruta, 'rb') as f:
+        if art.desplazamiento is None:
+            return f.read()
+        f.seek(art.desplazamiento)
+        datos = f.read(art.guardado)
+    if art.compresion == zipfile.ZIP_DEFLATED:
+        datos = zlib.decompress(datos, -15)
+    if len(datos) != art.tamano or zlib.crc32(datos) != art.crc:
+        raise ArtefactoCorrupto(f'{art.nombre}: el contenido no coincide con el índice')
+    return datos
+
+
+def leer(ref):
+    """Bytes del DOCX (Artefacto, nombre o ruta); FileNotFoundError si no existe"""
+    art = ref if isinstance(ref, Artefacto) else ubicar(ref)
+    if art is None:
+        raise FileNotFoundError(ref)
+    try:
+        return _leer(art)
+    except FileNotFoundError:
+        # Se empaquetó entre la consulta al índice y la lectura
+        art = ubicar(art.nombre)
+        if art is None:
+            raise
+        return _leer(art)
+
+
+def sha256(ref):
+    """SHA-256 del DOCX; se calcula una vez y queda en el índice"""
+    art = ubicar(ref)
+    if art is None:
+        raise FileNotFoundError(ref)
+    if art.sha256:
+        return art.sha256
+    digest = hashlib.sha256(leer(art)).hexdigest()
+    conn = _get_conn()
+    with conn:
+        conn.execute('UPDATE artefactos SET sha256 = ? WHERE nombre = ?', (digest, art.nombre))
+    return digest
+
+
+# ═══ PAQUETES MENSUALES ══════════════════════════════════════════════════════
+
+def _compresion(datos):
+    # Un DOCX ya es un ZIP comprimido: deflate solo si gana algo
+    return zipfile.ZIP_DEFLATED if len(zlib.compress(datos, 6)) < len(datos) * 0.95 else zipfile.ZIP_STORED
+
+
+def _miembros(pack):
+    """{nombre: (desplazamiento de los datos, tamaño comprimido, compresión, crc)}"""
+    miembros = {}
+    with zipfile.ZipFile(pack) as zf, open(pack, 'rb') as f:
+        for info in zf.infolist():
+            f.seek(info.header_offset)
+            cabecera = f.read(30)
+            if cabecera[:4] != b'PK\x03\x04':
+                raise ArtefactoCorrupto(f'{pack}: cabecera local inválida en {info.filename}')
+            largo_nombre, largo_extra = struct.unpack('<HH', cabecera[26:30])
+            miembros[info.filename] = (info.header_offset + 30 + largo_nombre + largo_extra,
+                                       info.compress_size, info.compress_type, info.CRC)
+    return miembros
+
+
+def _empaquetar(conn, mes):
+    """
+    Mueve los DOCX sueltos del mes a AAAA/AAAA-MM.zip. El paquete se reescribe
+    completo y se reemplaza de forma atómica; el índice se actualiza en una
+    transacción y recién después se borran los sueltos.
+    """
+    anio, mm = mes.split('-')
+    pack = os.path.join(STORE_DIR, anio, f'{mes}.zip')
+    sueltos = [(nombre, _absoluta(ruta), creado) for nombre, ruta, creado in conn.execute(
+        'SELECT nombre, ruta, creado FROM artefactos WHERE mes = ? AND desplazamiento IS NULL', (mes,))]
+    sueltos = [s for s in sueltos if os.path.isfile(s[1])]
+    if not sueltos:
+        return 0
+    os.makedirs(os.path.dirname(pack), exist_ok=True)
+    nuevos = {nombre for nombre, _, _ in sueltos}
+    with zipfile.ZipFile(pack + '.tmp', 'w') as zout:
+        if os.path.exists(pack):
+            with zipfile.ZipFile(pack) as zin:
+                for info in zin.infolist():
+                    if info.filename not in nuevos:
+                        zout.writestr(info, zin.read(info))
+        for nombre, ruta, creado in sueltos:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+            info = zipfile.ZipInfo(nombre, time.localtime(creado)[:6])
+            info.compress_type = _compresion(datos)
+            zout.writestr(info, datos)
+        zout.fp.flush()
+        os.fsync(zout.fp.fileno())
+    os.replace(pack + '.tmp', pack)
+
+    miembros = _miembros(pack)
+    with conn:
+        conn.executemany('''UPDATE artefactos SET ruta = ?, desplazamiento = ?, guardado = ?, compresion = ?, crc = ?
+                            WHERE nombre = ?''',
+                         [(_relativa(pack), *ubicacion, nombre) for nombre, ubicacion in miembros.items()])
+    for _, ruta, _ in sueltos:
+        _borrar(ruta)
+    try:
+        os.rmdir(os.path.join(STORE_DIR, anio, mm))
+    except OSError:
+        pass
+    _contar('empaquetados', len(sueltos))
+    return len(sueltos)
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def _sueltos_en_disco():
+    """DOCX en la raíz (disposición anterior) y en los directorios AAAA/MM"""
+    for entrada in os.scandir(STORE_DIR):
+        if entrada.is_file() and _RE_DOCX.match(entrada.name):
+            yield entrada.path
+        elif entrada.is_dir() and entrada.name.isdigit():
+            for mes in os.scandir(entrada.path):
+                if mes.is_dir():
+                    for f in os.scandir(mes.path):
+                        if f.is_file() and _RE_DOCX.match(f.name):
+                            yield f.path
+
+
+def _indexar_disco(conn, reindexar=False):
+    """
+    Registra los DOCX y PDFs que no están en el índice y borra los sueltos
+    que ya quedaron dentro de un paquete (corte entre reescribir el paquete y
+    borrarlos). Con reindexar, también vuelve a leer los paquetes.
+    """
+    for ruta in _sueltos_en_disco():
+        art = ubicar(ruta)
+        if art is not None and art.desplazamiento is not None:
+            try:
+                _leer(art)
+                _borrar(ruta)
+            except (OSError, ArtefactoCorrupto, zlib.error):
+                pass
+    if reindexar:
+        for anio in os.scandir(STORE_DIR):
+            if not (anio.is_dir() and anio.name.isdigit()):
+                continue
+            for pack in os.scandir(anio.path):
+                if not pack.name.endswith('.zip'):
+                    continue
+                with zipfile.ZipFile(pack.path) as zf:
+                    tamanos = {i.filename: (i.file_size, i.date_time) for i in zf.infolist()}
+                with conn:
+                    for nombre, (desplazamiento, guardado, compresion, crc) in _miembros(pack.path).items():
+                        conn.execute('''INSERT OR REPLACE INTO artefactos
+                                        (nombre, ot_number, mes, ruta, desplazamiento, tamano, guardado, compresion, crc, sha256, creado)
+                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)''',
+                                     (nombre, nombre[:-5], pack.name[:-4], _relativa(pack.path), desplazamiento,
+                                      tamanos[nombre][0], guardado, compresion, crc,
+                                      time.mktime(tamanos[nombre][1] + (0, 0, -1))))
+    cache = os.path.join(STORE_DIR, '.pdf_cache')
+    if os.path.isdir(cache):
+        conocidos = {d for d, in conn.execute('SELECT sha256 FROM pdfs')}
+        with conn:
+            for f in os.scandir(cache):
+                if f.is_file() and _RE_PDF.match(f.name) and f.name[:-4] not in conocidos:
+                    st = f.stat()
+                    conn.execute('INSERT OR IGNORE INTO pdfs (sha256, ruta, tamano, usado) VALUES (?, ?, ?, ?)',
+                                 (f.name[:-4], _relativa(f.path), st.st_size, st.st_atime))
+
+
+# ═══ PDFs REGENERABLES Y CUOTA ═══════════════════════════════════════════════
+
+def registrar_pdf(digest, ruta):
+    """pdf_cache terminó una conversión: se indexa y se aplica la cuota"""
+    conn = _get_conn()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO pdfs (sha256, ruta, tamano, usado) VALUES (?, ?, ?, ?)',
+                     (digest, _relativa(ruta), os.path.getsize(ruta), time.time()))
+    _aplicar_cuota(conn)
+
+
+def usar_pdf(digest):
+    """Marca el PDF como recién usado (orden LRU del desalojo)"""
+    conn = _get_conn()
+    with conn:
+        conn.execute('UPDATE pdfs SET usado = ? WHERE sha256 = ?', (time.time(), digest))
+
+
+def _total(conn):
+    docx, = conn.execute('SELECT COALESCE(SUM(guardado), 0) FROM artefactos').fetchone()
+    pdfs, = conn.execute('SELECT COALESCE(SUM(tamano), 0) FROM pdfs').fetchone()
+    return docx + pdfs
+
+
+def _aplicar_cuota(conn):
+    """Desaloja los PDFs menos usados hasta bajar al 90 % de la cuota"""
+    exceso = _total(conn) - CUOTA_BYTES
+    if exceso <= 0:
+        return 0
+    exceso += CUOTA_BYTES // 10
+    candidatos = conn.execute('SELECT sha256, ruta, tamano FROM pdfs WHERE usado < ? ORDER BY usado',
+                              (time.time() - PDF_GRACIA_S,)).fetchall()
+    desalojados = liberados = 0
+    for digest, ruta, tamano in candidatos:
+        if liberados >= exceso:
+            break
+        _borrar(_absoluta(ruta))
+        with conn:
+            conn.execute('DELETE FROM pdfs WHERE sha256 = ?', (digest,))
+        desalojados += 1
+        liberados   += tamano
+    _contar('pdfs_desalojados', desalojados)
+    _contar('bytes_desalojados', liberados)
+    return desalojados
+
+
+# ═══ MANTENIMIENTO ═══════════════════════════════════════════════════════════
+
+def mantenimiento(reindexar=False):
+    """Indexa lo que falte, empaqueta los meses cerrados y aplica la cuota"""
+    with _lock_mantener:
+        conn  = _get_conn()
+        _indexar_disco(conn, reindexar)
+        limite = (datetime.now() - timedelta(days=ARCHIVAR_DIAS)).strftime('%Y-%m')
+        meses  = [m for m, in conn.execute(
+            'SELECT DISTINCT mes FROM artefactos WHERE desplazamiento IS NULL AND mes < ? ORDER BY mes', (limite,))]
+        empaquetados = {mes: _empaquetar(conn, mes) for mes in meses}
+        desalojados  = _aplicar_cuota(conn)
+    with _lock:
+        _metricas['mantenimientos'] += 1
+        _metricas['ultimo_mantenimiento'] = datetime.now().isoformat(timespec='seconds')
+    return {'empaquetados': empaquetados, 'pdfs_desalojados': desalojados}
+
+
+def _mantenimiento_seguro():
+    try:
+        mantenimiento()
+        error = None
+    except Exception as e:
+        error = str(e)
+    with _lock:
+        _metricas['error_mantenimiento'] = error
+
+
+def _programar_mantenimiento():
+    """Lanza el mantenimiento en segundo plano como mucho cada MANTENIMIENTO_S"""
+    global _ultimo_mantenimiento
+    with _lock:
+        if time.time() - _ultimo_mantenimiento < MANTENIMIENTO_S:
+            return
+        _ultimo_mantenimiento = time.time()
+    threading.Thread(target=_mantenimiento_seguro, name='artefactos', daemon=True).start()
+
+
+def verificar():
+    """Lee cada OT indexada y compara su SHA-256. Devuelve [(nombre, error)]"""
+    errores = []
+    filas = _get_conn().execute('''SELECT nombre, ruta, desplazamiento, tamano, guardado, compresion, crc, sha256
+                                   FROM artefactos ORDER BY nombre''').fetchall()
+    for fila in filas:
+        art = Artefacto(fila[0], _absoluta(fila[1]), *fila[2:])
+        try:
+            datos = _leer(art)
+            if art.sha256 and hashlib.sha256(datos).hexdigest() != art.sha256:
+                raise ArtefactoCorrupto('SHA-256 distinto del registrado')
+        except Exception as e:
+            errores.append((art.nombre, str(e)))
+    return errores
+
+
+def get_metricas():
+    conn = _get_conn()
+    sueltos, bytes_sueltos = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(guardado), 0) FROM artefactos WHERE desplazamiento IS NULL').fetchone()
+    en_paquetes, bytes_paquetes, bytes_originales, paquetes = conn.execute(
+        '''SELECT COUNT(*), COALESCE(SUM(guardado), 0), COALESCE(SUM(tamano), 0), COUNT(DISTINCT ruta)
+           FROM artefactos WHERE desplazamiento IS NOT NULL''').fetchone()
+    pdfs, bytes_pdfs = conn.execute('SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM pdfs').fetchone()
+    with _lock:
+        metricas = dict(_metricas)
+    metricas.update(docx_sueltos=sueltos, bytes_sueltos=bytes_sueltos,
+                    docx_empaquetados=en_paquetes, paquetes=paquetes,
+                    bytes_paquetes=bytes_paquetes, bytes_sin_comprimir=bytes_originales,
+                    pdfs=pdfs, bytes_pdfs=bytes_pdfs,
+                    total_bytes=bytes_sueltos + bytes_paquetes + bytes_pdfs, cuota_bytes=CUOTA_BYTES)
+    return metricas
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mantenimiento', action='store_true', help='Empaqueta los meses cerrados y aplica la cuota')
+    parser.add_argument('--reindexar', action='store_true', help='Vuelve a indexar los paquetes existentes')
+    parser.add_argument('--verificar', action='store_true', help='Lee cada OT indexada y comprueba su SHA-256')
+    args = parser.parse_args()
+
+    if args.mantenimiento or args.reindexar:
+        print(json.dumps(mantenimiento(args.reindexar), ensure_ascii=False, indent=2))
+    if args.verificar:
+        errores = verificar()
+        for nombre, error in errores:
+            print(f'{nombre}: {error}')
+        print(f'{len(errores)} errores')
+        sys.exit(1 if errores else 0)
+    print(json.dumps(get_metricas(), ensure_ascii=False, indent=2))
@@ -5,8 +5,11 @@
 const CONFIG = {
   CARPETA_ORIGEN:    "1q32NVy5hjv5pdOykGXHz8bAE4HrP422l",
   CARPETA_DESTINO:   "1hJkm-2HhTMmU4W12sqfyh2Kdei_lrrX-",
-  RAILWAY_URL:       "https://metromecanica-ot-production.up.railway.app/firmar-pdf",
-  LOTE_MAX:          5,
+  RAILWAY_URL:       "https://metromecanica-ot-production.up.railway.app",
+  LOTE_MAX:          40,
+  // El lote se corta por tamaño: el ZIP enviado debe entrar en MAX_CONTENT_LENGTH
+  // (50 MB) y el ZIP firmado, que crece con el membrete, en el límite de UrlFetchApp
+  LOTE_MAX_BYTES:    15 * 1024 * 1024,
   NOMBRE_PROCESADOS: "PROCESADOS"
 };
 
@@ -18,11 +21,15 @@ function procesarCertificados() {
 
   const archivos = carpetaOrigen.getFilesByType(MimeType.PDF);
   const lote     = [];
+  let bytes      = 0;
 
   while (archivos.hasNext() && lote.length < CONFIG.LOTE_MAX) {
     const archivo = archivos.next();
     if (archivo.getParents().next().getId() !== CONFIG.CARPETA_ORIGEN) continue;
+    // Un archivo que por sí solo supera el tope viaja solo; el resto espera a la próxima corrida
+    if (lote.length > 0 && bytes + archivo.getSize() > CONFIG.LOTE_MAX_BYTES) break;
     lote.push(archivo);
+    bytes += archivo.getSize();
   }
 
   if (lote.length === 0) {
@@ -30,40 +37,19 @@ function procesarCertificados() {
     return;
   }
 
-  Logger.log("Procesando " + lote.length + " archivo(s)...");
+  Logger.log("Procesando " + lote.length + " archivo(s), " + Math.round(bytes / 1024) + " KB...");
 
   const procesadosOk = [];
   const errores      = [];
 
-  lote.forEach(function(archivo) {
-    const nombre = archivo.getName();
-    try {
-      const blob = archivo.getBlob().setContentType("application/pdf");
-
-      const opciones = {
-        method:             "post",
-        payload:            { file: blob },   // multipart/form-data automático
-        muteHttpExceptions: true
-      };
-
-      const respuesta = UrlFetchApp.fetch(CONFIG.RAILWAY_URL, opciones);
-      const codigo    = respuesta.getResponseCode();
-
-      if (codigo !== 200) {
-        errores.push({ nombre: nombre, error: "HTTP " + codigo + ": " + respuesta.getContentText().substring(0, 300) });
-        return;
-      }
-
-      // Respuesta es el PDF firmado directamente
-      const pdfBlob = respuesta.getBlob().setName(nombre).setContentType("application/pdf");
-      carpetaDestino.createFile(pdfBlob);
-      procesadosOk.push(archivo);
-      Logger.log("✅ Emitido: " + nombre);
-
-    } catch(e) {
-      errores.push({ nombre: nombre, error: e.message });
-    }
-  });
+  if (!firmarLote(lote, carpetaDestino, procesadosOk, errores)) {
+    // Si el lote completo falla, cada archivo se envía por separado: uno
+    // defectuoso no bloquea a los demás en cada corrida
+    Logger.log("Reintentando archivo por archivo...");
+    lote.filter(function(archivo) { return procesadosOk.indexOf(archivo) < 0; }).forEach(function(archivo) {
+      firmarArchivo(archivo, carpetaDestino, procesadosOk, errores);
+    });
+  }
 
   errores.forEach(function(e) {
     Logger.log("❌ Error en " + e.nombre + ": " + e.error);
@@ -79,6 +65,79 @@ function procesarCertificados() {
 }
 
 
+// Un solo envío: ZIP con todo el lote; el servidor estampa en paralelo y
+// devuelve otro ZIP con firmados/<n>.pdf y manifiesto.json (n = posición en el lote).
+// Devuelve false si la solicitud no llegó a procesarse (el lote se reintenta por archivo)
+function firmarLote(lote, carpetaDestino, procesadosOk, errores) {
+  const blobs = lote.map(function(archivo, i) {
+    return archivo.getBlob().setName(i + ".pdf").setContentType("application/pdf");
+  });
+
+  try {
+    const respuesta = UrlFetchApp.fetch(CONFIG.RAILWAY_URL + "/firmar-lote", {
+      method:             "post",
+      payload:            { zip: Utilities.zip(blobs, "lote.zip") },   // multipart/form-data automático
+      muteHttpExceptions: true
+    });
+    const codigo = respuesta.getResponseCode();
+
+    if (codigo !== 200) {
+      Logger.log("❌ Lote HTTP " + codigo + ": " + respuesta.getContentText().substring(0, 300));
+      return false;
+    }
+
+    const entradas = {};
+    Utilities.unzip(respuesta.getBlob().setContentType("application/zip")).forEach(function(blob) {
+      entradas[blob.getName().split("/").pop()] = blob;
+    });
+    const manifiesto = JSON.parse(entradas["manifiesto.json"].getDataAsString());
+
+    manifiesto.archivos.forEach(function(item) {
+      const archivo = lote[item.indice];
+      if (item.estado !== "ok") {
+        errores.push({ nombre: archivo.getName(), error: item.error });
+        return;
+      }
+      const pdfBlob = entradas[item.salida.split("/").pop()].setName(archivo.getName()).setContentType("application/pdf");
+      carpetaDestino.createFile(pdfBlob);
+      procesadosOk.push(archivo);
+      Logger.log("✅ Emitido: " + archivo.getName());
+    });
+    return true;
+
+  } catch(e) {
+    Logger.log("❌ Error en el lote: " + e.message);
+    return false;
+  }
+}
+
+
+function firmarArchivo(archivo, carpetaDestino, procesadosOk, errores) {
+  const nombre = archivo.getName();
+  try {
+    const respuesta = UrlFetchApp.fetch(CONFIG.RAILWAY_URL + "/firmar-pdf", {
+      method:             "post",
+      payload:            { file: archivo.getBlob().setContentType("application/pdf") },
+      muteHttpExceptions: true
+    });
+    const codigo = respuesta.getResponseCode();
+
+    if (codigo !== 200) {
+      errores.push({ nombre: nombre, error: "HTTP " + codigo + ": " + respuesta.getContentText().substring(0, 300) });
+      return;
+    }
+
+    // Respuesta es el PDF firmado directamente
+    carpetaDestino.createFile(respuesta.getBlob().setName(nombre).setContentType("application/pdf"));
+    procesadosOk.push(archivo);
+    Logger.log("✅ Emitido: " + nombre);
+
+  } catch(e) {
+    errores.push({ nombre: nombre, error: e.message });
+  }
+}
+
+
 function obtenerOCrearSubcarpeta(padre, nombre) {
   const iter = padre.getFoldersByName(nombre);
   if (iter.hasNext()) return iter.next();
@@ -5,13 +5,45 @@ Registra todas las OTs generadas con trazabilidad completa
 import sqlite3
 import json
 import os
-from datetime import datetime
+import re
+import time
+import queue
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime, date, timedelta
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'audit_log.db')
+import metrics
+
+DB_PATH = os.environ.get('AUDIT_DB_PATH', os.path.join(os.path.dirname(__file__), 'audit_log.db'))
+
+BUSY_TIMEOUT_MS = int(os.environ.get('AUDIT_BUSY_TIMEOUT_MS', 5000))
+# Escritura diferida con commit agrupado: el llamador sigue esperando su commit
+WRITE_BEHIND    = os.environ.get('AUDIT_WRITE_BEHIND', '0') == '1'
+FLUSH_MS        = float(os.environ.get('AUDIT_FLUSH_MS', 5))
+MAX_LOTE        = int(os.environ.get('AUDIT_MAX_LOTE', 256))
+
+_local = threading.local()
+
+def get_conn():
+    """
+    Conexión SQLite reutilizable, una por hilo y por proceso
+    (WAL + busy_timeout; sqlite3 cachea las sentencias preparadas)
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=64)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        # FULL: cada commit queda en disco antes de confirmar (trazabilidad INACAL)
+        conn.execute('PRAGMA synchronous=FULL')
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
 
 def init_audit_db():
     """Inicializa la base de datos de auditoría"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_conn()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -40,8 +72,280 @@ def init_audit_db():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_proforma ON audit_log(proforma_number)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_fecha ON audit_log(timestamp)')
     
+    # Correlativo de OTs por año y números reservados que volvieron sin usarse
+    cursor.execute('CREATE TABLE IF NOT EXISTS ot_secuencia (anio INTEGER PRIMARY KEY, ultimo INTEGER NOT NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS ot_libres (anio INTEGER NOT NULL, numero INTEGER NOT NULL, PRIMARY KEY (anio, numero))')
+    # Números en bloques reservados y su dueño, para recuperarlos si el proceso muere
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ot_reservas (
+        anio INTEGER NOT NULL,
+        numero INTEGER NOT NULL,
+        host TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        inicio INTEGER,
+        creado REAL NOT NULL,
+        PRIMARY KEY (anio, numero)
+    )
+    ''')
+    
     conn.commit()
-    conn.close()
+    _aplicar_migraciones(conn)
+    _asegurar_fts(conn)
+
+# ═══ MIGRACIONES (versión en PRAGMA user_version) ═════════════════════════════
+def _crear_fts(cursor):
+    """Índice trigram FTS5 sobre cliente, RUC y proforma para búsquedas por subcadena"""
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS audit_fts USING fts5(
+        cliente, ruc_cliente, proforma_number,
+        content='audit_log', content_rowid='id', tokenize='trigram'
+    )
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS audit_fts_ai AFTER INSERT ON audit_log BEGIN
+        INSERT INTO audit_fts(rowid, cliente, ruc_cliente, proforma_number)
+        VALUES (new.id, new.cliente, new.ruc_cliente, new.proforma_number);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS audit_fts_ad AFTER DELETE ON audit_log BEGIN
+        INSERT INTO audit_fts(audit_fts, rowid, cliente, ruc_cliente, proforma_number)
+        VALUES ('delete', old.id, old.cliente, old.ruc_cliente, old.proforma_number);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS audit_fts_au AFTER UPDATE ON audit_log BEGIN
+        INSERT INTO audit_fts(audit_fts, rowid, cliente, ruc_cliente, proforma_number)
+        VALUES ('delete', old.id, old.cliente, old.ruc_cliente, old.proforma_number);
+        INSERT INTO audit_fts(rowid, cliente, ruc_cliente, proforma_number)
+        VALUES (new.id, new.cliente, new.ruc_cliente, new.proforma_number);
+    END
+    ''')
+    # Backfill de los registros existentes
+    cursor.execute("INSERT INTO audit_fts(audit_fts) VALUES ('rebuild')")
+
+def _sql_stats(fila, signo):
+    """Sentencias que suman (signo=+1) o restan (-1) una fila a los resúmenes"""
+    mes, tipo, ruc = f"substr({fila}.timestamp, 1, 7)", f"IFNULL({fila}.tipo_servicio, '')", f"{fila}.ruc_cliente"
+    sql = f'''
+        UPDATE stats_global SET valor = valor + {signo} WHERE clave = 'total_ots';
+        UPDATE stats_global SET valor = valor + 1 WHERE clave = 'version';
+        INSERT INTO stats_mes(mes, cantidad) VALUES ({mes}, {signo})
+            ON CONFLICT(mes) DO UPDATE SET cantidad = cantidad + {signo};
+        INSERT INTO stats_tipo(tipo_servicio, cantidad) VALUES ({tipo}, {signo})
+            ON CONFLICT(tipo_servicio) DO UPDATE SET cantidad = cantidad + {signo};
+    '''
+    if signo > 0:
+        sql += f'''
+        UPDATE stats_global SET valor = valor + 1 WHERE clave = 'clientes_unicos'
+            AND NOT EXISTS (SELECT 1 FROM stats_cliente WHERE ruc_cliente = {ruc});
+        INSERT INTO stats_cliente(ruc_cliente, cantidad) VALUES ({ruc}, 1)
+            ON CONFLICT(ruc_cliente) DO UPDATE SET cantidad = cantidad + 1;
+        '''
+    else:
+        sql += f'''
+        UPDATE stats_cliente SET cantidad = cantidad - 1 WHERE ruc_cliente = {ruc};
+        UPDATE stats_global SET valor = valor - 1 WHERE clave = 'clientes_unicos'
+            AND EXISTS (SELECT 1 FROM stats_cliente WHERE ruc_cliente = {ruc} AND cantidad <= 0);
+        DELETE FROM stats_cliente WHERE ruc_cliente = {ruc} AND cantidad <= 0;
+        DELETE FROM stats_mes WHERE cantidad <= 0;
+        DELETE FROM stats_tipo WHERE cantidad <= 0;
+        '''
+    return sql
+
+def _migracion_2_stats(cursor):
+    """Resúmenes mantenidos por triggers para /auditoria/estadisticas"""
+    cursor.execute('CREATE TABLE IF NOT EXISTS stats_global (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS stats_mes (mes TEXT PRIMARY KEY, cantidad INTEGER NOT NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS stats_tipo (tipo_servicio TEXT PRIMARY KEY, cantidad INTEGER NOT NULL)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS stats_cliente (ruc_cliente TEXT PRIMARY KEY, cantidad INTEGER NOT NULL)')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS stats_ai AFTER INSERT ON audit_log BEGIN {_sql_stats("new", +1)} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS stats_ad AFTER DELETE ON audit_log BEGIN {_sql_stats("old", -1)} END')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS stats_au AFTER UPDATE ON audit_log BEGIN
+        {_sql_stats("old", -1)} {_sql_stats("new", +1)} END''')
+    _recalcular_stats(cursor)
+
+def _recalcular_stats(cursor):
+    cursor.execute("INSERT OR IGNORE INTO stats_global(clave, valor) VALUES ('version', 0)")
+    cursor.execute("UPDATE stats_global SET valor = valor + 1 WHERE clave = 'version'")
+    cursor.execute("INSERT OR REPLACE INTO stats_global(clave, valor) SELECT 'total_ots', COUNT(*) FROM audit_log")
+    cursor.execute("INSERT OR REPLACE INTO stats_global(clave, valor) SELECT 'clientes_unicos', COUNT(DISTINCT ruc_cliente) FROM audit_log")
+    cursor.execute('DELETE FROM stats_mes')
+    cursor.execute("INSERT INTO stats_mes SELECT substr(timestamp, 1, 7), COUNT(*) FROM audit_log GROUP BY 1")
+    cursor.execute('DELETE FROM stats_tipo')
+    cursor.execute("INSERT INTO stats_tipo SELECT IFNULL(tipo_servicio, ''), COUNT(*) FROM audit_log GROUP BY 1")
+    cursor.execute('DELETE FROM stats_cliente')
+    cursor.execute("INSERT INTO stats_cliente SELECT ruc_cliente, COUNT(*) FROM audit_log GROUP BY 1")
+
+# Solo migraciones obligatorias. La 1 (índice FTS) salió de la cadena: es
+# opcional y se crea aparte en _asegurar_fts; las bases que ya la tenían
+# conservan su índice
+MIGRACIONES = [
+    (2, _migracion_2_stats),
+]
+
+FTS_ENABLED = False
+
+def _aplicar_migraciones(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for numero, migracion in MIGRACIONES:
+        if numero <= version:
+            continue
+        try:
+            migracion(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {numero}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _asegurar_fts(conn):
+    """
+    Crea el índice trigram si falta. Con SQLite sin FTS5/trigram se sigue sin
+    él (FTS_ENABLED = False: búsquedas con LIKE) y se reintenta en el próximo
+    arranque
+    """
+    global FTS_ENABLED
+    existe = lambda: conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'audit_fts'").fetchone() is not None
+    if not existe():
+        try:
+            _crear_fts(conn.cursor())
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            metrics.log('índice FTS5 no disponible, búsquedas sin índice', logging.WARNING, error=str(e))
+    FTS_ENABLED = existe()
+
+def _filtros(start_date=None, end_date=None, cliente=None):
+    """
+    Predicados WHERE sobre columnas indexadas
+
+    Las fechas se comparan contra el timestamp ISO crudo (usa idx_fecha):
+    [start_date, end_date + 1 día). Sin fecha de inicio, el cliente se busca
+    en el índice trigram; con rango acotado basta filtrar las filas del rango.
+    """
+    query, params = '', []
+    if start_date:
+        query += ' AND timestamp >= ?'
+        params.append(start_date)
+    if end_date:
+        query += ' AND timestamp < ?'
+        params.append((date.fromisoformat(end_date) + timedelta(days=1)).isoformat())
+    if cliente:
+        if FTS_ENABLED and len(cliente) >= 3 and not start_date:
+            query += ' AND id IN (SELECT rowid FROM audit_fts WHERE cliente LIKE ?)'
+        else:
+            query += ' AND cliente LIKE ?'
+        params.append(f'%{cliente}%')
+    return query, params
+
+_INSERT_OT = '''
+        INSERT INTO audit_log (
+            timestamp, ot_number, expediente, proforma_number,
+            cliente, ruc_cliente, total_items, tipo_servicio,
+            fecha_emision, fecha_entrega, estado, filepath, metadata
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+
+def _fila_ot(ot_data, filepath):
+    return (
+        datetime.now().isoformat(),
+        ot_data.get('ot_number', ''),
+        ot_data.get('expediente', ''),
+        ot_data.get('numero_proforma', ''),
+        ot_data.get('cliente', ''),
+        ot_data.get('ruc_cliente', ''),
+        ot_data.get('total_items', 0),
+        ot_data.get('tipo_servicio', ''),
+        ot_data.get('fecha_emision', ''),
+        ot_data.get('plazo_entrega', ''),
+        'APROBADA',
+        filepath,
+        json.dumps(ot_data, ensure_ascii=False)
+    )
+
+_RE_OT = re.compile(r'OT-(\d{4})-(\d+)$')
+
+def _insertar(cursor, filas):
+    """
+    Inserta las filas en la transacción en curso y cierra la reserva de su
+    número en ot_reservas. Devuelve un bool por fila
+    """
+    resultados = []
+    for fila in filas:
+        try:
+            cursor.execute(_INSERT_OT, fila)
+            numero = _RE_OT.match(fila[1])
+            if numero:
+                cursor.execute('DELETE FROM ot_reservas WHERE anio = ? AND numero = ?',
+                               (int(numero[1]), int(numero[2])))
+            resultados.append(True)
+        except sqlite3.IntegrityError:
+            # OT ya existe - esto está bien, significa que el número es único
+            resultados.append(False)
+    return resultados
+
+def _insertar_lote(filas):
+    conn = get_conn()
+    try:
+        resultados = _insertar(conn.cursor(), filas)
+        conn.commit()
+        return resultados
+    except Exception:
+        conn.rollback()
+        raise
+
+class _GroupCommit:
+    """
+    Cola de escritura diferida: agrupa las filas que llegan en FLUSH_MS en una
+    sola transacción. register_ot no retorna hasta que su fila está confirmada,
+    así que no se relaja la durabilidad; solo se comparten los fsync.
+    """
+
+    def __init__(self):
+        self.cola  = queue.Queue()
+        self.pid   = os.getpid()
+        self.hilo  = threading.Thread(target=self._loop, name='audit-writer', daemon=True)
+        self.hilo.start()
+
+    def enviar(self, fila):
+        pendiente = {'fila': fila, 'listo': threading.Event(), 'ok': False, 'error': None}
+        self.cola.put(pendiente)
+        pendiente['listo'].wait()
+        if pendiente['error'] is not None:
+            raise pendiente['error']
+        return pendiente['ok']
+
+    def _loop(self):
+        while True:
+            lote   = [self.cola.get()]
+            limite = time.monotonic() + FLUSH_MS / 1000
+            while len(lote) < MAX_LOTE:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self.cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                for pendiente, ok in zip(lote, _insertar_lote([p['fila'] for p in lote])):
+                    pendiente['ok'] = ok
+            except Exception as e:
+                for pendiente in lote:
+                    pendiente['error'] = e
+            for pendiente in lote:
+                pendiente['listo'].set()
+
+_writer_lock = threading.Lock()
+_writer = None
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = _GroupCommit()
+        return _writer
 
 def register_ot(ot_data, filepath=None):
     """
@@ -50,40 +354,26 @@ def register_ot(ot_data, filepath=None):
     Args:
         ot_data: Dict con los datos de la OT
         filepath: Ruta del archivo generado
+    
+    Returns:
+        True si se registró, False si la OT ya existía
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    fila = _fila_ot(ot_data, filepath)
+    if WRITE_BEHIND:
+        return _get_writer().enviar(fila)
+    return _insertar_lote([fila])[0]
+
+def register_ots(registros):
+    """
+    Registra un lote de OTs en una sola transacción
     
-    try:
-        cursor.execute('''
-        INSERT INTO audit_log (
-            timestamp, ot_number, expediente, proforma_number,
-            cliente, ruc_cliente, total_items, tipo_servicio,
-            fecha_emision, fecha_entrega, estado, filepath, metadata
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            datetime.now().isoformat(),
-            ot_data.get('ot_number', ''),
-            ot_data.get('expediente', ''),
-            ot_data.get('numero_proforma', ''),
-            ot_data.get('cliente', ''),
-            ot_data.get('ruc_cliente', ''),
-            ot_data.get('total_items', 0),
-            ot_data.get('tipo_servicio', ''),
-            ot_data.get('fecha_emision', ''),
-            ot_data.get('plazo_entrega', ''),
-            'APROBADA',
-            filepath,
-            json.dumps(ot_data, ensure_ascii=False)
-        ))
-        
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # OT ya existe - esto está bien, significa que el número es único
-        return False
-    finally:
-        conn.close()
+    Args:
+        registros: Lista de tuplas (ot_data, filepath)
+    
+    Returns:
+        Lista de bool (True si la fila se insertó, False si la OT ya existía)
+    """
+    return _insertar_lote([_fila_ot(ot_data, filepath) for ot_data, filepath in registros])
 
 def get_audit_log(start_date=None, end_date=None, cliente=None):
     """
@@ -97,34 +387,118 @@ def get_audit_log(start_date=None, end_date=None, cliente=None):
     Returns:
         Lista de registros
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_conn()
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
     
-    query = 'SELECT * FROM audit_log WHERE 1=1'
-    params = []
-    
-    if start_date:
-        query += ' AND DATE(timestamp) >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND DATE(timestamp) <= ?'
-        params.append(end_date)
-    
-    if cliente:
-        query += ' AND cliente LIKE ?'
-        params.append(f'%{cliente}%')
-    
+    filtros, params = _filtros(start_date, end_date, cliente)
+    query = 'SELECT * FROM audit_log WHERE 1=1' + filtros
     query += ' ORDER BY timestamp DESC'
     
     cursor.execute(query, params)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
-def export_audit_csv(output_path, start_date=None, end_date=None):
+def get_ot_por_proforma(numero_proforma):
+    """
+    Última OT emitida para una proforma (usa idx_proforma)
+
+    Returns:
+        Registro como dict, o None si la proforma no tiene OT
+    """
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute('''
+    SELECT * FROM audit_log WHERE proforma_number = ? AND estado = 'APROBADA'
+    ORDER BY id DESC LIMIT 1
+    ''', (numero_proforma,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def buscar(texto, limite=50):
+    """
+    Búsqueda por subcadena en cliente, RUC o número de proforma
+    
+    Args:
+        texto: Fragmento a buscar (mínimo 3 caracteres para usar el índice)
+        limite: Máximo de registros
+    
+    Returns:
+        Lista de registros, más recientes primero
+    """
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    if FTS_ENABLED and len(texto) >= 3:
+        frase = '"' + texto.replace('"', '""') + '"'
+        cursor.execute('''
+        SELECT * FROM audit_log
+        WHERE id IN (SELECT rowid FROM audit_fts WHERE audit_fts MATCH ?)
+        ORDER BY timestamp DESC LIMIT ?
+        ''', (frase, limite))
+    else:
+        patron = f'%{texto}%'
+        cursor.execute('''
+        SELECT * FROM audit_log
+        WHERE cliente LIKE ? OR ruc_cliente LIKE ? OR proforma_number LIKE ?
+        ORDER BY timestamp DESC LIMIT ?
+        ''', (patron, patron, patron, limite))
+    
+    return [dict(row) for row in cursor.fetchall()]
+
+CSV_FIELDS = [
+    'id', 'timestamp', 'ot_number', 'expediente', 'proforma_number',
+    'cliente', 'ruc_cliente', 'total_items', 'tipo_servicio',
+    'fecha_emision', 'fecha_entrega', 'estado'
+]
+
+def iter_audit_rows(start_date=None, end_date=None, cliente=None, after_id=None, chunk_size=1000):
+    """
+    Recorre el log de auditoría por bloques, en orden de id, con memoria constante
+    
+    Cada bloque es una consulta independiente (paginación por id > último),
+    así que no se mantiene una transacción de lectura abierta entre bloques.
+    
+    Args:
+        start_date, end_date, cliente: Igual que get_audit_log
+        after_id: Reanudar a partir de este id (exclusivo)
+        chunk_size: Filas por consulta
+    
+    Yields:
+        Tuplas con las columnas de CSV_FIELDS
+    """
+    conn = get_conn()
+    filtros, params = _filtros(start_date, end_date, cliente)
+    
+    # Acotar el recorrido por rowid al rango de fechas (resuelto con idx_fecha)
+    ultimo = after_id or 0
+    tope = None
+    if start_date or end_date:
+        fechas, fparams = _filtros(start_date, end_date)
+        minimo, tope = conn.execute(
+            'SELECT MIN(id), MAX(id) FROM audit_log WHERE 1=1' + fechas, fparams
+        ).fetchone()
+        if minimo is None:
+            return
+        ultimo = max(ultimo, minimo - 1)
+    
+    columnas = ', '.join(CSV_FIELDS)
+    query = f'SELECT {columnas} FROM audit_log WHERE id > ?'
+    if tope is not None:
+        query += f' AND id <= {int(tope)}'
+    query += filtros + ' ORDER BY id LIMIT ?'
+    
+    while True:
+        filas = conn.execute(query, [ultimo] + params + [chunk_size]).fetchall()
+        if not filas:
+            return
+        yield from filas
+        ultimo = filas[-1][0]
+
+def export_audit_csv(output_path, start_date=None, end_date=None, cliente=None):
     """
     Exporta el log de auditoría a CSV para revisión INACAL
     
@@ -132,64 +506,292 @@ def export_audit_csv(output_path, start_date=None, end_date=None):
         output_path: Ruta donde guardar el CSV
         start_date: Fecha inicio filtro
         end_date: Fecha fin filtro
+        cliente: Filtrar por cliente
     """
     import csv
     
-    records = get_audit_log(start_date, end_date)
+    filas = iter_audit_rows(start_date, end_date, cliente)
+    primera = next(filas, None)
     
-    if not records:
+    if primera is None:
         return False
     
     with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
-        fieldnames = [
-            'timestamp', 'ot_number', 'expediente', 'proforma_number',
-            'cliente', 'ruc_cliente', 'total_items', 'tipo_servicio',
-            'fecha_emision', 'fecha_entrega', 'estado'
-        ]
-        
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        for record in records:
-            writer.writerow({k: record.get(k, '') for k in fieldnames})
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        writer.writerow(primera)
+        writer.writerows(filas)
     
     return True
 
 def get_statistics():
-    """Obtiene estadísticas para reportes de auditoría"""
-    conn = sqlite3.connect(DB_PATH)
+    """Obtiene estadísticas para reportes de auditoría (desde las tablas de resumen)"""
+    conn = get_conn()
     cursor = conn.cursor()
     
     stats = {}
+    global_ = dict(cursor.execute('SELECT clave, valor FROM stats_global').fetchall())
     
     # Total de OTs generadas
-    cursor.execute('SELECT COUNT(*) FROM audit_log')
-    stats['total_ots'] = cursor.fetchone()[0]
+    stats['total_ots'] = global_.get('total_ots', 0)
     
     # OTs por mes
-    cursor.execute('''
-    SELECT strftime('%Y-%m', timestamp) as mes, COUNT(*) as cantidad
-    FROM audit_log
-    GROUP BY mes
-    ORDER BY mes DESC
-    LIMIT 12
-    ''')
+    cursor.execute('SELECT mes, cantidad FROM stats_mes ORDER BY mes DESC LIMIT 12')
     stats['por_mes'] = cursor.fetchall()
     
     # Clientes únicos
-    cursor.execute('SELECT COUNT(DISTINCT ruc_cliente) FROM audit_log')
-    stats['clientes_unicos'] = cursor.fetchone()[0]
+    stats['clientes_unicos'] = global_.get('clientes_unicos', 0)
     
     # Tipos de servicio
-    cursor.execute('''
-    SELECT tipo_servicio, COUNT(*) as cantidad
-    FROM audit_log
-    GROUP BY tipo_servicio
-    ''')
+    cursor.execute('SELECT tipo_servicio, cantidad FROM stats_tipo ORDER BY tipo_servicio')
     stats['por_tipo'] = cursor.fetchall()
     
-    conn.close()
     return stats
 
+def get_statistics_version():
+    """Contador que cambia con cada alta/baja en audit_log (para ETag)"""
+    fila = get_conn().execute("SELECT valor FROM stats_global WHERE clave = 'version'").fetchone()
+    return fila[0] if fila else 0
+
+def rebuild_statistics():
+    """Recalcula las tablas de resumen desde audit_log"""
+    conn = get_conn()
+    try:
+        _recalcular_stats(conn.cursor())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# ═══ CORRELATIVO DE OTs ══════════════════════════════════════════════════════
+OT_BLOQUE = int(os.environ.get('OT_BLOQUE', 20))
+# Un proceso usa su bloque durante OT_RESERVA_S como máximo; pasado ese plazo
+# más OT_RESERVA_GRACIA_S (render y auditoría de lo ya entregado) cualquier
+# proceso puede recuperar lo que quede, aunque el dueño esté en otra máquina
+OT_RESERVA_S        = float(os.environ.get('OT_RESERVA_S', 300))
+OT_RESERVA_GRACIA_S = float(os.environ.get('OT_RESERVA_GRACIA_S', 600))
+
+# Si la OT de un número sin auditar ya se entregó, no se reutiliza. app lo
+# responde con artifact_store; sin esa información se asume que no
+ot_entregada = lambda ot_number: False
+
+def formato_ot(anio, numero):
+    return f'OT-{anio}-{numero:04d}'
+
+def _inicio_proceso(pid):
+    """Arranque del proceso en ticks desde el boot: distingue un pid reutilizado"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+_HOST = socket.gethostname()
+
+def _dueno_propio():
+    return _HOST, os.getpid(), _inicio_proceso(os.getpid())
+
+def _muerto(host, pid, inicio):
+    """Solo se puede saber en la misma máquina; de otra decide el vencimiento"""
+    if host != _HOST:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    actual = _inicio_proceso(pid)
+    return inicio is not None and actual is not None and actual != inicio
+
+def _a_libres(conn, anio, numeros):
+    """Dentro de una transacción: números sin usar a ot_libres; si cierran el correlativo, este retrocede"""
+    conn.executemany('INSERT OR IGNORE INTO ot_libres (anio, numero) VALUES (?, ?)', [(anio, n) for n in numeros])
+    while conn.execute('''
+        DELETE FROM ot_libres WHERE anio = ? AND numero = (SELECT ultimo FROM ot_secuencia WHERE anio = ?)
+        ''', (anio, anio)).rowcount:
+        conn.execute('UPDATE ot_secuencia SET ultimo = ultimo - 1 WHERE anio = ?', (anio,))
+
+def _abandonadas(conn, anio, dueno):
+    """
+    Fuera de la transacción, para no alargar el bloqueo de escritura: dueños
+    de reservas que ya no las van a usar, con el creado hasta el que se
+    recuperan. De un proceso muerto (kill -9, OOM, timeout de gunicorn), todas;
+    de uno que puede seguir vivo, solo las vencidas
+    """
+    ahora   = time.time()
+    vencido = ahora - OT_RESERVA_S - OT_RESERVA_GRACIA_S
+    abandonadas = []
+    for host, pid, inicio, creado in conn.execute('''
+            SELECT host, pid, inicio, MIN(creado) FROM ot_reservas WHERE anio = ? GROUP BY host, pid, inicio
+            ''', (anio,)):
+        if (host, pid, inicio) != dueno and _muerto(host, pid, inicio):
+            abandonadas.append((host, pid, inicio, ahora))
+        elif creado < vencido:
+            abandonadas.append((host, pid, inicio, vencido))
+    return abandonadas
+
+def _recuperar(conn, anio, abandonadas):
+    """
+    Dentro de la transacción: devuelve a ot_libres las reservas abandonadas.
+    Las auditadas ya salieron de ot_reservas al registrarse; lo que llegó a
+    entregarse sin auditar queda usado.
+
+    Returns:
+        Cantidad de números recuperados
+    """
+    recuperados = []
+    for host, pid, inicio, hasta in abandonadas:
+        numeros = [n for (n,) in conn.execute('''
+            DELETE FROM ot_reservas WHERE anio = ? AND host = ? AND pid = ? AND inicio IS ? AND creado <= ?
+            RETURNING numero
+            ''', (anio, host, pid, inicio, hasta))]
+        recuperados += [n for n in numeros if not ot_entregada(formato_ot(anio, n))
+                        and conn.execute('SELECT 1 FROM audit_log WHERE ot_number = ?', (formato_ot(anio, n),)).fetchone() is None]
+    if recuperados:
+        _a_libres(conn, anio, recuperados)
+        metrics.log('números de OT recuperados de reservas abandonadas', logging.WARNING,
+                    anio=anio, numeros=sorted(recuperados))
+    return len(recuperados)
+
+def _reservar_bloque(anio, cantidad, dueno, recuperar=True):
+    """
+    Reserva `cantidad` números del año en una transacción IMMEDIATE: primero
+    los devueltos o recuperados de otros procesos (si `recuperar`), luego
+    avanzando ot_secuencia. Se saltan los números que ya usa una OT
+    registrada (numeración anterior por timestamp). La reserva queda a nombre
+    de `dueno` (host, pid, arranque) en ot_reservas.
+    """
+    conn = get_conn()
+    abandonadas = _abandonadas(conn, anio, dueno) if recuperar else []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _recuperar(conn, anio, abandonadas)
+        numeros = [n for (n,) in conn.execute('''
+            DELETE FROM ot_libres WHERE rowid IN (
+                SELECT rowid FROM ot_libres WHERE anio = ? ORDER BY numero LIMIT ?
+            ) RETURNING numero
+            ''', (anio, cantidad)).fetchall()]
+        conn.execute('INSERT INTO ot_secuencia (anio, ultimo) VALUES (?, 0) ON CONFLICT(anio) DO NOTHING', (anio,))
+        while len(numeros) < cantidad:
+            faltan = cantidad - len(numeros)
+            ultimo = conn.execute('UPDATE ot_secuencia SET ultimo = ultimo + ? WHERE anio = ? RETURNING ultimo',
+                                  (faltan, anio)).fetchone()[0]
+            candidatos = {formato_ot(anio, n): n for n in range(ultimo - faltan + 1, ultimo + 1)}
+            usados = {ot for (ot,) in conn.execute(
+                f'SELECT ot_number FROM audit_log WHERE ot_number IN ({",".join("?" * len(candidatos))})',
+                list(candidatos))}
+            numeros += [n for ot, n in candidatos.items() if ot not in usados]
+        ahora = time.time()
+        conn.executemany('INSERT OR REPLACE INTO ot_reservas (anio, numero, host, pid, inicio, creado) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(anio, n, *dueno, ahora) for n in numeros])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return sorted(numeros)
+
+def _devolver_numeros(anio, numeros, dueno):
+    """Devuelve números reservados sin usar y los quita de las reservas de `dueno`"""
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('DELETE FROM ot_reservas WHERE anio = ? AND numero = ? AND host = ? AND pid = ? AND inicio IS ?',
+                         [(anio, n, *dueno) for n in numeros])
+        _a_libres(conn, anio, numeros)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+class _Correlativo:
+    """
+    Asigna números de OT desde bloques reservados por proceso: un viaje a la
+    base cada OT_BLOQUE OTs. Los números que no llegan a usarse (render
+    fallido, fin ordenado del proceso, bloque vencido) se devuelven; los de un
+    proceso que muere sin devolverlos los recupera otro al reservar: en su
+    primera reserva (el worker que gunicorn levanta en su lugar) y después
+    cada OT_RESERVA_S.
+    """
+
+    def __init__(self):
+        self.pid     = os.getpid()
+        self.dueno   = _dueno_propio()
+        self.lock    = threading.Lock()
+        self.bloques = {}   # anio -> números reservados, de menor a mayor
+        self.vence   = {}   # anio -> instante en que el bloque deja de usarse
+        self.revisar = {}   # anio -> próxima búsqueda de reservas abandonadas
+
+    def siguiente(self, anio):
+        with self.lock:
+            bloque = self.bloques.get(anio)
+            if bloque and time.time() >= self.vence[anio]:
+                # Otro proceso ya puede considerarlo abandonado: se renueva
+                _devolver_numeros(anio, bloque, self.dueno)
+                bloque = None
+            if not bloque:
+                ahora     = time.time()
+                recuperar = ahora >= self.revisar.get(anio, 0)
+                bloque = self.bloques[anio] = _reservar_bloque(anio, OT_BLOQUE, self.dueno, recuperar)
+                self.vence[anio] = ahora + OT_RESERVA_S
+                if recuperar:
+                    self.revisar[anio] = ahora + OT_RESERVA_S
+            return bloque.pop(0)
+
+    def devolver(self, anio, numero):
+        with self.lock:
+            bloque = self.bloques.setdefault(anio, [])
+            bloque.append(numero)
+            bloque.sort()
+            self.vence.setdefault(anio, time.time() + OT_RESERVA_S)
+
+    def liberar(self):
+        with self.lock:
+            bloques, self.bloques = self.bloques, {}
+        for anio, numeros in bloques.items():
+            if numeros:
+                _devolver_numeros(anio, numeros, self.dueno)
+
+_correlativo_lock = threading.Lock()
+_correlativo = None
+
+def _get_correlativo():
+    global _correlativo
+    with _correlativo_lock:
+        if _correlativo is None or _correlativo.pid != os.getpid():
+            _correlativo = _Correlativo()
+        return _correlativo
+
+def siguiente_ot(anio):
+    """
+    Reserva el siguiente número correlativo de OT del año
+
+    Returns:
+        Entero; formato_ot(anio, numero) da el código 'OT-YYYY-NNNN'
+    """
+    return _get_correlativo().siguiente(int(anio))
+
+def devolver_ot(anio, numero):
+    """Devuelve un número reservado que no llegó a usarse (p. ej. falló el render)"""
+    _get_correlativo().devolver(int(anio), numero)
+
+def liberar_reservas():
+    """Devuelve a la base los números que este proceso reservó y no usó"""
+    correlativo = _correlativo
+    if correlativo is not None and correlativo.pid == os.getpid():
+        correlativo.liberar()
+
+atexit.register(liberar_reservas)
+
 # Inicializar DB al importar el módulo
 init_audit_db()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild-stats", action="store_true", help="Recalcula las tablas de resumen de estadísticas")
+    args = parser.parse_args()
+
+    if args.rebuild_stats:
+        rebuild_statistics()
+        print(json.dumps(get_statistics(), ensure_ascii=False, indent=2))
@@ -0,0 +1,106 @@
+"""
+bench_artefactos.py - Espacio en disco y lectura de OTs en artifact_store
+
+Genera OTs sintéticas repartidas en varios meses y compara el directorio plano
+anterior (un archivo por OT, os.path.exists + open) con el almacén actual antes
+y después de empaquetar los meses cerrados: bloques ocupados en disco, número
+de archivos y latencia de ubicar + leer una OT. Verifica que cada OT se lea
+idéntica desde su paquete.
+
+Uso:
+    python benchmarks/bench_artefactos.py --ots 3000 --meses 12 --lecturas 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+def _disco(directorio):
+    """(bytes en bloques ocupados, archivos)"""
+    bloques = archivos = 0
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            bloques  += os.stat(os.path.join(raiz, nombre)).st_blocks * 512
+            archivos += 1
+    return bloques, archivos
+
+
+def _latencias(leer, nombres, lecturas):
+    rng = random.Random(0)
+    tiempos = []
+    for nombre in (rng.choice(nombres) for _ in range(lecturas)):
+        t = time.perf_counter()
+        leer(nombre)
+        tiempos.append((time.perf_counter() - t) * 1e6)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ots', type=int, default=3000)
+    parser.add_argument('--meses', type=int, default=12, help='Meses cerrados entre los que se reparten las OTs')
+    parser.add_argument('--lecturas', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        plano = os.path.join(tmpdir, 'plano')
+        os.makedirs(plano)
+        os.environ['ARTEFACTOS_DB_PATH'] = os.path.join(tmpdir, 'store', '.artefactos.db')
+        os.environ['ARTEFACTOS_MANTENIMIENTO_MIN'] = '1e9'
+        import artifact_store
+        artifact_store.STORE_DIR = os.path.join(tmpdir, 'store')
+
+        originales = {}
+        for i in range(args.ots):
+            nombre = f'OT-2025-{i + 1:04d}.docx'
+            originales[nombre] = datos = fixtures.docx_ot(nombre[:-5], n_items=1 + i % 12, seed=i)
+            with open(os.path.join(plano, nombre), 'wb') as f:
+                f.write(datos)
+            artifact_store.guardar(nombre, datos, nombre[:-5])
+        # Cada OT pasa a un mes cerrado de 2025 (el archivo sigue donde se escribió)
+        conn = artifact_store._get_conn()
+        with conn:
+            conn.executemany('UPDATE artefactos SET mes = ? WHERE nombre = ?',
+                             [(f'2025-{1 + i % args.meses:02d}', n) for i, n in enumerate(originales)])
+        nombres = list(originales)
+        print(f'{args.ots} OTs, {sum(map(len, originales.values())) / args.ots / 1024:.1f} KB de media, {args.meses} meses')
+
+        def leer_plano(nombre):
+            ruta = os.path.join(plano, nombre)
+            if os.path.exists(ruta):
+                with open(ruta, 'rb') as f:
+                    return f.read()
+
+        print(f"{'disposición':>22}{'disco (MB)':>12}{'archivos':>10}{'p50 (µs)':>10}{'p95 (µs)':>10}")
+        filas = [('plano', _disco(plano), _latencias(leer_plano, nombres, args.lecturas))]
+        filas.append(('índice, sueltos', _disco(artifact_store.STORE_DIR),
+                      _latencias(artifact_store.leer, nombres, args.lecturas)))
+        t = time.perf_counter()
+        artifact_store.mantenimiento()
+        empaquetar = time.perf_counter() - t
+        filas.append(('índice, empaquetados', _disco(artifact_store.STORE_DIR),
+                      _latencias(artifact_store.leer, nombres, args.lecturas)))
+        for nombre, (bloques, archivos), (p50, p95) in filas:
+            print(f'{nombre:>22}{bloques / 2**20:>12.1f}{archivos:>10}{p50:>10.0f}{p95:>10.0f}')
+        print(f'\nempaquetado: {empaquetar:.2f} s')
+
+        distintas = [n for n, d in originales.items() if artifact_store.leer(n) != d]
+        if distintas or artifact_store.verificar():
+            print(f'(!) {len(distintas)} OTs difieren tras empaquetar')
+            sys.exit(1)
+        print('todas las OTs se leen idénticas desde los paquetes')
+
+
+if __name__ == '__main__':
+    main()
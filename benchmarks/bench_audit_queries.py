@@ -0,0 +1,112 @@
+"""
+bench_audit_queries.py - Consultas de auditoría sobre una tabla sintética
+
+Compara los predicados anteriores (DATE(timestamp), cliente LIKE '%x%')
+con los actuales de audit_logger (rango sobre idx_fecha + índice trigram).
+
+Uso:
+    python benchmarks/bench_audit_queries.py --rows 1000000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+CLIENTES = [
+    'MINERA ANDINA SAC', 'AGROINDUSTRIAL DEL NORTE SAA', 'LABORATORIOS PERUANOS SA',
+    'CEMENTOS DEL SUR SAC', 'PESQUERA PACIFICO EIRL', 'CONSTRUCTORA LIMA SAC',
+    'ALIMENTOS SELECTOS SA', 'TEXTIL CALLAO SAC', 'METALURGICA AREQUIPA SAA',
+    'FARMACEUTICA INCA SAC',
+]
+TIPOS = ['CALIBRACION', 'REEMPLAZO_COMPONENTE', 'GENERICO']
+
+
+def poblar(conn, filas):
+    inicio = datetime.now() - timedelta(days=3 * 365)
+    rng = random.Random(17025)
+    lote = []
+    insert = '''
+    INSERT INTO audit_log (timestamp, ot_number, expediente, proforma_number, cliente,
+                           ruc_cliente, total_items, tipo_servicio, estado)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'APROBADA')
+    '''
+    for i in range(filas):
+        ts = inicio + timedelta(seconds=i * (3 * 365 * 86400 // filas))
+        cliente = f'{rng.choice(CLIENTES)} {i % 997:03d}'
+        lote.append((ts.isoformat(), f'OT-{i:08d}', str(i), f'P001-{i:06d}', cliente,
+                     f'20{rng.randrange(10**9):09d}', rng.randint(1, 20), rng.choice(TIPOS)))
+        if len(lote) == 50000:
+            conn.executemany(insert, lote)
+            lote = []
+    if lote:
+        conn.executemany(insert, lote)
+    conn.commit()
+
+
+def medir(fn, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        n = fn()
+        tiempos.append((time.perf_counter() - t) * 1000)
+    return statistics.median(tiempos), n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_audit_')
+    os.environ['AUDIT_DB_PATH'] = os.path.join(tmpdir, 'audit_log.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import audit_logger
+
+    conn = audit_logger.get_conn()
+    conn.row_factory = audit_logger.sqlite3.Row
+    t = time.perf_counter()
+    poblar(conn, args.rows)
+    print(f'{args.rows:,} filas insertadas en {time.perf_counter() - t:.1f} s (FTS: {audit_logger.FTS_ENABLED})')
+
+    hoy = datetime.now().date()
+    desde, hasta = (hoy - timedelta(days=30)).isoformat(), hoy.isoformat()
+    anio = (hoy - timedelta(days=365)).isoformat()
+
+    def anterior(start, end, cliente=None):
+        q = 'SELECT * FROM audit_log WHERE DATE(timestamp) >= ? AND DATE(timestamp) <= ?'
+        p = [start, end]
+        if cliente:
+            q += ' AND cliente LIKE ?'
+            p.append(f'%{cliente}%')
+        return len([dict(r) for r in conn.execute(q + ' ORDER BY timestamp DESC', p).fetchall()])
+
+    casos = [
+        ('últimos 30 días',        lambda: anterior(desde, hasta),           lambda: len(audit_logger.get_audit_log(desde, hasta))),
+        ('último año',             lambda: anterior(anio, hasta),            lambda: len(audit_logger.get_audit_log(anio, hasta))),
+        ('30 días + cliente',      lambda: anterior(desde, hasta, 'CALLAO'), lambda: len(audit_logger.get_audit_log(desde, hasta, 'CALLAO'))),
+        ('cliente (todo el log)',  lambda: anterior('1970-01-01', hasta, 'INCA SAC 42'),
+                                   lambda: len(audit_logger.get_audit_log(cliente='INCA SAC 42'))),
+        ('buscar RUC/proforma',    lambda: len(conn.execute("SELECT id FROM audit_log WHERE proforma_number LIKE '%-000123%' OR ruc_cliente LIKE '%-000123%'").fetchall()),
+                                   lambda: len(audit_logger.buscar('-000123', limite=10**9))),
+    ]
+
+    print(f"\n{'consulta':<24}{'filas':>9}{'antes (ms)':>14}{'ahora (ms)':>14}{'mejora':>9}")
+    try:
+        for nombre, viejo, nuevo in casos:
+            t_viejo, n_viejo = medir(viejo, args.repeat)
+            t_nuevo, n_nuevo = medir(nuevo, args.repeat)
+            marca = '' if n_viejo == n_nuevo else f'  (!) {n_viejo} vs {n_nuevo}'
+            print(f'{nombre:<24}{n_nuevo:>9,}{t_viejo:>14.1f}{t_nuevo:>14.1f}{t_viejo / max(t_nuevo, 1e-3):>8.1f}x{marca}')
+    finally:
+        conn.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+bench_certificado.py - Preparación del Excel de /generar-certificado
+
+Compara el flujo anterior (tres cargas completas del libro: valores,
+copia con fórmulas y keep_vba, y lectura del nombre) con la carga única de
+certbot_endpoint, que solo parsea CERTIFICADO y CALIBRACION. Cada flujo corre
+en un proceso nuevo para medir su pico de memoria. Verifica que ambos dejen
+los mismos valores en la hoja exportada y el mismo nombre de PDF.
+
+Uso:
+    python benchmarks/bench_certificado.py --hojas 8 --filas 400 --repeat 3
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+def _anterior(ruta_excel, tmpdir):
+    """Flujo anterior, tal como estaba en certbot_endpoint"""
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import MergedCell
+    from certbot_endpoint import fmt_val
+
+    t = time.perf_counter()
+    wb_vals = load_workbook(ruta_excel, read_only=False, data_only=True)
+    cert_name = next((s for s in wb_vals.sheetnames if s.upper() == "CERTIFICADO"), wb_vals.sheetnames[-1])
+    valores = {c.coordinate: fmt_val(c.value, c.number_format)
+               for row in wb_vals[cert_name].iter_rows() for c in row
+               if not isinstance(c, MergedCell) and c.value is not None}
+    wb_vals.close()
+
+    ruta_copia = os.path.join(tmpdir, "certificado_final.xlsx")
+    shutil.copy2(ruta_excel, ruta_copia)
+    wb = load_workbook(ruta_copia, data_only=False, keep_vba=True)
+    carga = time.perf_counter() - t
+    ws = wb[cert_name]
+    for coord, val in valores.items():
+        cell = ws[coord]
+        if isinstance(cell, MergedCell):
+            for rng in ws.merged_cells.ranges:
+                if coord in rng:
+                    ws.cell(row=rng.min_row, column=rng.min_col).value = val
+                    break
+        else:
+            cell.value = val
+    for row in ws.iter_rows():
+        for cell in row:
+            if not isinstance(cell, MergedCell) and isinstance(cell.value, str) and cell.value.startswith("="):
+                cell.value = None
+    for i, s in enumerate(wb.worksheets):
+        if s.title == cert_name:
+            wb.active = i
+            s.sheet_state = "visible"
+    for nombre in wb.sheetnames:
+        if nombre != cert_name:
+            wb[nombre].sheet_state = "veryHidden"
+    wb.save(ruta_copia)
+
+    t = time.perf_counter()
+    wb = load_workbook(ruta_excel, read_only=True, data_only=True)
+    cal = wb["CALIBRACION"]
+    nombre = "_".join(str(cal[f"B{r}"].value).strip() for r in range(150, 155))
+    wb.close()
+    carga += time.perf_counter() - t
+    return ruta_copia, cert_name, nombre, carga
+
+
+def _actual(ruta_excel, tmpdir):
+    import certbot_endpoint
+    t = time.perf_counter()
+    wb, cert_name = certbot_endpoint.cargar_libro(ruta_excel)
+    carga = time.perf_counter() - t
+    cal = wb["CALIBRACION"]
+    nombre = "_".join(str(cal[f"B{r}"].value).strip() for r in range(150, 155))
+    ruta_copia = certbot_endpoint.preparar_para_pdf(wb, cert_name, tmpdir)
+    return ruta_copia, cert_name, nombre, carga
+
+
+def _hoja_exportada(ruta, cert_name):
+    from openpyxl import load_workbook
+    ws = load_workbook(ruta)[cert_name]
+    return ({c.coordinate: c.value for row in ws.iter_rows() for c in row if c.value is not None},
+            sorted(str(r) for r in ws.merged_cells.ranges), ws.print_area)
+
+
+def _escribir_libro(ruta, hojas, filas):
+    with open(ruta, 'wb') as f:
+        f.write(fixtures.libro_calibracion(hojas, filas))
+
+
+def _medir(modo, ruta_excel, repeat):
+    """Se ejecuta en un proceso nuevo. Devuelve (p50 total ms, p50 carga ms, RSS inicial y pico en MB, hoja exportada, nombre)"""
+    flujo = _anterior if modo == 'anterior' else _actual
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    totales, cargas = [], []
+    for _ in range(repeat):
+        tmpdir = tempfile.mkdtemp(prefix='bench_cert_')
+        t = time.perf_counter()
+        ruta_copia, cert_name, nombre, carga = flujo(ruta_excel, tmpdir)
+        totales.append((time.perf_counter() - t) * 1000)
+        cargas.append(carga * 1000)
+        hoja = _hoja_exportada(ruta_copia, cert_name)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return statistics.median(totales), statistics.median(cargas), (base / 1024, pico / 1024), hoja, nombre
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hojas', type=int, default=8, help='Hojas de datos además de CERTIFICADO y CALIBRACION')
+    parser.add_argument('--filas', type=int, default=400, help='Filas por hoja de datos')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Todo corre en procesos hijos: el pico de RSS del padre se hereda al hacer fork
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ruta = os.path.join(tmpdir, 'MLL-1042-2026_CALIBRACION.xlsm')
+        with ctx.Pool(1) as pool:
+            pool.apply(_escribir_libro, (ruta, args.hojas, args.filas))
+        print(f'{args.hojas + 2} hojas, {args.filas} filas por hoja de datos, {os.path.getsize(ruta) / 1024:.0f} KB')
+
+        print(f"{'flujo':>10}{'total (ms)':>12}{'carga (ms)':>12}{'RSS inicial (MB)':>18}{'pico RSS (MB)':>15}")
+        resultados = {}
+        for modo in ('anterior', 'actual'):
+            with ctx.Pool(1) as pool:
+                total, carga, pico, hoja, nombre = resultados[modo] = pool.apply(_medir, (modo, ruta, args.repeat))
+            print(f'{modo:>10}{total:>12.0f}{carga:>12.0f}{pico[0]:>18.1f}{pico[1]:>15.1f}')
+
+    if resultados['anterior'][3:] != resultados['actual'][3:]:
+        print('\n(!) la hoja exportada o el nombre difieren del flujo anterior')
+        sys.exit(1)
+    print('\nmisma hoja exportada y mismo nombre de PDF')
+
+
+if __name__ == '__main__':
+    main()
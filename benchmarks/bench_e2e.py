@@ -0,0 +1,364 @@
+"""
+bench_e2e.py - Pruebas de rendimiento de extremo a extremo y de carga
+
+Genera con fixtures proformas (distintos ítems, tipos de servicio y páginas),
+libros de calibración .xlsm y certificados PDF, y mide:
+  - componentes: extract_proforma, generate_ot.js (ot_renderer),
+    aplicar_membrete_y_firma y cargar_libro + preparar_para_pdf
+  - rutas Flask con el test client y N clientes concurrentes: /, /procesar,
+    /descargar (completa y 304), /firmar-pdf y /generar-certificado
+
+Cada escenario corre en un proceso nuevo, con bases y directorios temporales,
+para medir su pico de RSS y el de sus subprocesos. Reporta p50/p95/p99,
+throughput y memoria. Los resultados se guardan como línea base JSON (propia
+de cada máquina) y las corridas siguientes se comparan contra ella.
+
+Uso:
+    python benchmarks/bench_e2e.py --guardar            # crea o actualiza la línea base
+    python benchmarks/bench_e2e.py --comparar           # sale con 1 si algo empeora más de --tolerancia
+    python benchmarks/bench_e2e.py --escenarios procesar firmar-pdf --concurrencia 1 4 8 --solicitudes 200
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import itertools
+import threading
+import statistics
+import multiprocessing
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _entorno(tmpdir):
+    """Bases, caché y almacén de OTs en tmpdir; se llama antes de importar app"""
+    os.environ.update({
+        'AUDIT_DB_PATH': os.path.join(tmpdir, 'audit_log.db'),
+        'ARTEFACTOS_DB_PATH': os.path.join(tmpdir, 'ordenes', '.artefactos.db'),
+        'ARTEFACTOS_MANTENIMIENTO_MIN': '1e9',
+        # Se mide la extracción real, no los aciertos de extract_cache
+        'EXTRACT_CACHE': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    import artifact_store
+    import pdf_cache
+    artifact_store.STORE_DIR = os.path.join(tmpdir, 'ordenes')
+    pdf_cache.CACHE_DIR = os.path.join(tmpdir, 'ordenes', '.pdf_cache')
+
+
+def _esperar(respuesta, *estados):
+    if respuesta.status_code not in estados:
+        raise RuntimeError(f'HTTP {respuesta.status_code}: {respuesta.get_data(as_text=True)[:200]}')
+    return respuesta
+
+
+# ═══ ESCENARIOS ══════════════════════════════════════════════════════════════
+# preparar(args, tmpdir) devuelve tarea(i); tarea lanza una excepción si falla
+
+def _extract(args, tmpdir):
+    import extract_proforma
+    corpus = fixtures.corpus_proformas(args.docs)
+    return lambda i: extract_proforma.extract_proforma(corpus[i % len(corpus)][1])
+
+
+def _datos_ot(args):
+    import extract_proforma
+    datos = [extract_proforma.extract_proforma(pdf) for _, pdf, _ in fixtures.corpus_proformas(args.docs)]
+    return [d for d in datos if d.get('aprobada')]
+
+
+def _render(args, tmpdir):
+    import ot_renderer
+    datos = _datos_ot(args)
+    return lambda i: ot_renderer.render_ot(dict(datos[i % len(datos)]))
+
+
+def _firma(args, tmpdir):
+    import firmar_endpoint
+    membrete = firmar_endpoint.get_overlay(firmar_endpoint.MEMBRETE_DEFAULT, 'membrete')
+    firma    = firmar_endpoint.get_overlay(firmar_endpoint.FIRMA_DEFAULT, 'firma')
+    certificados = [fixtures.certificado_pdf(p) for p in (1, 3, 10)]
+    return lambda i: firmar_endpoint.aplicar_membrete_y_firma(certificados[i % 3], membrete, firma)
+
+
+def _excel(args, tmpdir):
+    import certbot_endpoint
+    libro = fixtures.libro_calibracion(args.hojas, 200)
+    def tarea(i):
+        wb, cert_name = certbot_endpoint.cargar_libro(io.BytesIO(libro))
+        with tempfile.TemporaryDirectory(dir=tmpdir) as salida:
+            certbot_endpoint.preparar_para_pdf(wb, cert_name, salida)
+    return tarea
+
+
+_clientes = threading.local()
+
+def _cliente():
+    """Un test client por hilo del generador de carga"""
+    import app
+    if not hasattr(_clientes, 'c'):
+        _clientes.c = app.app.test_client()
+    return _clientes.c
+
+
+def _procesar(pdf, force=True):
+    datos = {'pdf': (io.BytesIO(pdf), 'proforma.pdf')}
+    if force:
+        datos['force'] = '1'
+    return _esperar(_cliente().post('/procesar', data=datos, content_type='multipart/form-data'), 200)
+
+
+def _ruta_indice(args, tmpdir):
+    return lambda i: _esperar(_cliente().get('/', headers={'Accept-Encoding': 'gzip, br'}), 200)
+
+
+def _ruta_procesar(args, tmpdir):
+    corpus = fixtures.corpus_proformas(args.docs)
+    return lambda i: _procesar(corpus[i % len(corpus)][1])
+
+
+def _ots_generadas(args):
+    corpus = fixtures.corpus_proformas(args.docs)
+    return [r['filename'] for r in (_procesar(pdf).get_json() for _, pdf, _ in corpus) if r.get('filename')]
+
+
+def _ruta_descargar(args, tmpdir):
+    ots = _ots_generadas(args)
+    return lambda i: _esperar(_cliente().get(f'/descargar/{ots[i % len(ots)]}'), 200)
+
+
+def _ruta_descargar_304(args, tmpdir):
+    ots   = _ots_generadas(args)
+    etags = [_cliente().get(f'/descargar/{ot}').headers['ETag'] for ot in ots]
+    return lambda i: _esperar(_cliente().get(f'/descargar/{ots[i % len(ots)]}',
+                                             headers={'If-None-Match': etags[i % len(ots)]}), 304)
+
+
+def _ruta_firmar(args, tmpdir):
+    certificados = [fixtures.certificado_pdf(p) for p in (1, 3, 10)]
+    return lambda i: _esperar(_cliente().post('/firmar-pdf', content_type='multipart/form-data',
+                                              data={'file': (io.BytesIO(certificados[i % 3]), 'certificado.pdf')}), 200)
+
+
+def _ruta_certificado(args, tmpdir):
+    libro = fixtures.libro_calibracion(args.hojas, 200)
+    return lambda i: _esperar(_cliente().post('/generar-certificado', content_type='multipart/form-data',
+                                              data={'file': (io.BytesIO(libro), 'MLL-1042-2026.xlsm')}), 200)
+
+
+# nombre -> (preparar, es ruta HTTP, requisitos externos; ver REQUISITOS)
+ESCENARIOS = {
+    'extract':             (_extract, False, ()),
+    'render':              (_render, False, ('renderer',)),
+    'firma':               (_firma, False, ()),
+    'excel':               (_excel, False, ()),
+    'indice':              (_ruta_indice, True, ()),
+    'procesar':            (_ruta_procesar, True, ('renderer',)),
+    'descargar':           (_ruta_descargar, True, ('renderer',)),
+    'descargar-304':       (_ruta_descargar_304, True, ('renderer',)),
+    'firmar-pdf':          (_ruta_firmar, True, ()),
+    'generar-certificado': (_ruta_certificado, True, ('soffice',)),
+}
+
+
+def _renderer():
+    """
+    node en el PATH no basta: sin las dependencias de generate_ot.js el
+    renderer muere al arrancar. Se hace un render de prueba
+    """
+    import extract_proforma
+    import ot_renderer
+    try:
+        ot_renderer.render_ot(extract_proforma.extract_proforma(fixtures.proforma_pdf(1)), timeout=30)
+    except (ot_renderer.RenderError, OSError) as e:
+        return f'el renderer de OT no arranca ({e})'
+    finally:
+        ot_renderer.shutdown()
+
+
+def _soffice():
+    if not (shutil.which('soffice') or shutil.which('libreoffice')):
+        return 'falta soffice'
+
+
+# requisito -> verificación; devuelve None o el motivo para omitir el escenario
+REQUISITOS = {'renderer': _renderer, 'soffice': _soffice}
+
+
+# ═══ EJECUCIÓN ═══════════════════════════════════════════════════════════════
+
+def _percentil(ordenadas, p):
+    return ordenadas[min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))]
+
+
+def _apagar_pools():
+    for nombre in ('extractor_pool', 'ot_renderer', 'firma_pool', 'office_converter'):
+        if nombre in sys.modules:
+            sys.modules[nombre].shutdown()
+
+
+def _medir(nombre, args, concurrencia):
+    """Devuelve las estadísticas del escenario"""
+    with tempfile.TemporaryDirectory(prefix='bench_e2e_') as tmpdir:
+        _entorno(tmpdir)
+        try:
+            tarea = ESCENARIOS[nombre][0](args, tmpdir)
+            for i in range(min(args.calentamiento, args.solicitudes)):
+                tarea(i)
+            base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            latencias, errores, lock = [], [], threading.Lock()
+            contador = itertools.count()
+            def cliente():
+                while (i := next(contador)) < args.solicitudes:
+                    t = time.perf_counter()
+                    try:
+                        tarea(i)
+                    except Exception as e:
+                        with lock:
+                            errores.append(str(e))
+                        continue
+                    with lock:
+                        latencias.append((time.perf_counter() - t) * 1000)
+
+            inicio = time.perf_counter()
+            hilos  = [threading.Thread(target=cliente) for _ in range(concurrencia)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+            duracion = time.perf_counter() - inicio
+        finally:
+            _apagar_pools()
+
+    propio, hijos = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    latencias.sort()
+    return {
+        'solicitudes': args.solicitudes,
+        'concurrencia': concurrencia,
+        'errores': len(errores),
+        'primer_error': errores[0] if errores else None,
+        'p50_ms': round(_percentil(latencias, 50), 2) if latencias else None,
+        'p95_ms': round(_percentil(latencias, 95), 2) if latencias else None,
+        'p99_ms': round(_percentil(latencias, 99), 2) if latencias else None,
+        'max_ms': round(latencias[-1], 2) if latencias else None,
+        'media_ms': round(statistics.fmean(latencias), 2) if latencias else None,
+        'rps': round(len(latencias) / duracion, 2),
+        'rss_inicial_mb': round(base / 1024, 1),
+        'rss_pico_mb': round(propio.ru_maxrss / 1024, 1),
+        'rss_pico_subprocesos_mb': round(hijos.ru_maxrss / 1024, 1),
+    }
+
+
+def _proceso(cola, nombre, args, concurrencia):
+    """
+    Destino del proceso hijo de cada escenario. No se usa multiprocessing.Pool:
+    sus workers son daemon y no pueden arrancar los pools de extracción y firma
+    """
+    try:
+        cola.put(_medir(nombre, args, concurrencia))
+    except Exception as e:
+        cola.put({'fallo': f'{type(e).__name__}: {e}'})
+
+
+def _comparar(resultados, anterior, tolerancia):
+    """Imprime la variación contra la línea base. Devuelve las claves que empeoraron"""
+    print(f"\n{'escenario':>26}{'p95 base':>10}{'p95':>10}{'Δ p95':>9}{'rps base':>10}{'rps':>10}{'Δ rps':>9}")
+    regresiones = []
+    for clave, actual in resultados.items():
+        base = anterior.get('escenarios', {}).get(clave)
+        if not base or not base.get('p95_ms') or not actual.get('p95_ms'):
+            continue
+        d_p95 = actual['p95_ms'] / base['p95_ms'] - 1
+        d_rps = actual['rps'] / base['rps'] - 1 if base['rps'] else 0.0
+        marca = ''
+        if d_p95 > tolerancia or d_rps < -tolerancia or actual['errores'] > base['errores']:
+            regresiones.append(clave)
+            marca = '  (!)'
+        print(f"{clave:>26}{base['p95_ms']:>10.1f}{actual['p95_ms']:>10.1f}{d_p95:>+9.0%}"
+              f"{base['rps']:>10.1f}{actual['rps']:>10.1f}{d_rps:>+9.0%}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--escenarios', nargs='+', choices=list(ESCENARIOS), default=list(ESCENARIOS))
+    parser.add_argument('--solicitudes', type=int, default=50, help='Operaciones medidas por escenario y concurrencia')
+    parser.add_argument('--concurrencia', type=int, nargs='+', default=[1, 4], help='Clientes simultáneos en las rutas HTTP')
+    parser.add_argument('--calentamiento', type=int, default=3, help='Operaciones previas sin medir')
+    parser.add_argument('--docs', type=int, default=12, help='Proformas sintéticas del corpus')
+    parser.add_argument('--hojas', type=int, default=4, help='Hojas de datos de los libros de calibración')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--guardar', action='store_true', help='Guarda los resultados como línea base')
+    parser.add_argument('--comparar', action='store_true', help='Compara contra la línea base y sale con 1 si hay regresiones')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='Empeoramiento admitido de p95 y throughput')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'escenario':>26}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'req/s':>9}{'errores':>9}"
+          f"{'RSS pico (MB)':>15}{'subproc. (MB)':>15}")
+    resultados, verificados = {}, {}
+    for nombre in args.escenarios:
+        preparar, es_ruta, requiere = ESCENARIOS[nombre]
+        for requisito in requiere:
+            if requisito not in verificados:
+                verificados[requisito] = REQUISITOS[requisito]()
+        faltan = [verificados[r] for r in requiere if verificados[r]]
+        if faltan:
+            print(f"{nombre:>26}  omitido: {'; '.join(faltan)}")
+            continue
+        for concurrencia in (args.concurrencia if es_ruta else [1]):
+            clave = f'{nombre}@{concurrencia}'
+            cola = ctx.Queue()
+            proceso = ctx.Process(target=_proceso, args=(cola, nombre, args, concurrencia))
+            proceso.start()
+            r = cola.get()
+            proceso.join()
+            if 'fallo' in r:
+                print(f"{clave:>26}  falló la preparación: {r['fallo']}")
+                continue
+            resultados[clave] = r
+            if not r['p50_ms']:
+                print(f"{clave:>26}  sin operaciones exitosas: {r['primer_error']}")
+                continue
+            print(f"{clave:>26}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['rps']:>9.1f}"
+                  f"{r['errores']:>9}{r['rss_pico_mb']:>15.1f}{r['rss_pico_subprocesos_mb']:>15.1f}")
+
+    regresiones = []
+    if args.comparar:
+        if not os.path.exists(args.baseline):
+            print(f'\nNo hay línea base en {args.baseline}; se crea con --guardar')
+        else:
+            with open(args.baseline, encoding='utf-8') as f:
+                regresiones = _comparar(resultados, json.load(f), args.tolerancia)
+            print(f"\n{len(regresiones)} regresiones" + (f": {', '.join(regresiones)}" if regresiones else ''))
+
+    if args.guardar:
+        linea_base = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'maquina': {'plataforma': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('guardar', 'comparar', 'baseline')},
+            'escenarios': resultados,
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(linea_base, f, ensure_ascii=False, indent=2)
+        print(f'\nLínea base guardada en {args.baseline}')
+
+    sys.exit(1 if regresiones else 0)
+
+
+if __name__ == '__main__':
+    main()
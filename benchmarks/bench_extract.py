@@ -0,0 +1,81 @@
+"""
+bench_extract.py - Rendimiento de extract_proforma sobre un corpus sintético
+
+Reporta, por etapa (lectura del PDF y parseo de campos), páginas por segundo
+y el peor tiempo por documento. La lectura se compara entre el texto completo
+con pdfplumber y la lectura con corte temprano de extract_proforma (backend
+EXTRACT_BACKEND), verificando que ambas den el mismo resultado.
+
+Uso:
+    python benchmarks/bench_extract.py --docs 30 --repeat 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+import extract_proforma
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=30, help='Proformas sintéticas a generar')
+    parser.add_argument('--repeat', type=int, default=20, help='Repeticiones del parseo por documento')
+    args = parser.parse_args()
+
+    corpus = fixtures.corpus_proformas(args.docs)
+    total_paginas = sum(p for _, _, p in corpus)
+
+    completo, lectura, parseo, peor = [], [], [], ('', 0.0)
+    leidas, backends, distintos = 0, {}, []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nombre, pdf_bytes, paginas in corpus:
+            ruta = os.path.join(tmpdir, nombre)
+            with open(ruta, 'wb') as f:
+                f.write(pdf_bytes)
+
+            t = time.perf_counter()
+            texto = extract_proforma.leer_texto(ruta, 'layout', hasta_total=False)
+            completo.append(time.perf_counter() - t)
+
+            info = {}
+            t = time.perf_counter()
+            data = extract_proforma.extract_proforma(ruta, info=info)
+            t_lectura = time.perf_counter() - t
+            leidas += info['paginas_leidas']
+            backends[info['backend']] = backends.get(info['backend'], 0) + 1
+            if data != extract_proforma.parsear_texto(texto):
+                distintos.append(nombre)
+
+            muestras = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                extract_proforma.parsear_texto(texto)
+                muestras.append(time.perf_counter() - t)
+            t_parseo = statistics.median(muestras)
+
+            lectura.append(t_lectura)
+            parseo.append(t_parseo)
+            if t_lectura > peor[1]:
+                peor = (nombre, t_lectura)
+
+    print(f'{len(corpus)} proformas, {total_paginas} páginas ({leidas} leídas con corte temprano)')
+    print(f'backend final: {backends}')
+    print(f"{'etapa':<18}{'total (s)':>11}{'pág/s':>10}{'p50 doc (ms)':>14}{'máx doc (ms)':>14}")
+    for etapa, tiempos in (('lectura completa', completo), ('lectura + parseo', lectura), ('parseo', parseo)):
+        total = sum(tiempos)
+        print(f'{etapa:<18}{total:>11.3f}{total_paginas / total:>10.1f}'
+              f'{statistics.median(tiempos) * 1000:>14.2f}{max(tiempos) * 1000:>14.2f}')
+    print(f'peor documento: {peor[0]} ({peor[1] * 1000:.1f} ms)')
+    if distintos:
+        print(f'(!) resultados distintos a la lectura completa: {distintos}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+bench_firma.py - Estampado de membrete y firma según páginas del certificado
+
+Compara la fusión anterior (deepcopy + merge_page por página, que reescribe
+el contenido de cada página y repite el del membrete) con la actual de
+firmar_endpoint (membrete y firma como Form XObject compartido). Cada modo
+corre en un proceso nuevo para medir su pico de memoria. Usa los overlays
+registrados en assets/ y certificados sintéticos de fixtures.
+
+Uso:
+    python benchmarks/bench_firma.py --paginas 1 10 100 --repeat 5
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import resource
+import statistics
+import multiprocessing
+from copy import deepcopy
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+def _paginas_anteriores(firmar_endpoint):
+    """Overlays como los preparaba la versión anterior (firma ya transformada)"""
+    from pypdf import PdfReader, PdfWriter
+    membrete = PdfReader(io.BytesIO(firmar_endpoint._leer_asset(firmar_endpoint.MEMBRETE_DEFAULT))).pages[0]
+    firma    = PdfReader(io.BytesIO(firmar_endpoint._leer_asset(firmar_endpoint.FIRMA_DEFAULT))).pages[0]
+    ancho, alto = float(firma.mediabox.width), float(firma.mediabox.height)
+    sx = firmar_endpoint.TARGET_W / ancho
+    firma.add_transformation([sx, 0, 0, sx, firmar_endpoint.FIRMA_X, firmar_endpoint.FIRMA_Y])
+    firma.mediabox.lower_left  = (0, 0)
+    firma.mediabox.upper_right = (firmar_endpoint.PAGE_W, firmar_endpoint.PAGE_H)
+    for page in (membrete, firma):
+        PdfWriter().add_page(page)
+    return membrete, firma
+
+
+def _anterior(pdf_bytes, membrete, firma):
+    from pypdf import PdfReader, PdfWriter
+    writer = PdfWriter()
+    for i, page in enumerate(PdfReader(io.BytesIO(pdf_bytes), strict=False).pages):
+        nueva = deepcopy(page)
+        nueva.merge_page(membrete, expand=False, over=False)
+        if i == 0:
+            nueva.merge_page(firma, over=True)
+        writer.add_page(nueva)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _medir(modo, paginas, repeat):
+    """Se ejecuta en un proceso nuevo. Devuelve (p50 ms, pico RSS MB sobre la base, bytes de salida)"""
+    import firmar_endpoint
+    if modo == 'anterior':
+        membrete, firma = _paginas_anteriores(firmar_endpoint)
+        estampar = _anterior
+    else:
+        membrete = firmar_endpoint.get_overlay(firmar_endpoint.MEMBRETE_DEFAULT, 'membrete')
+        firma    = firmar_endpoint.get_overlay(firmar_endpoint.FIRMA_DEFAULT, 'firma')
+        estampar = firmar_endpoint.aplicar_membrete_y_firma
+    cert = fixtures.certificado_pdf(paginas)
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tiempos = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        salida = estampar(cert, membrete, firma)
+        tiempos.append((time.perf_counter() - t) * 1000)
+    pico = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+    return statistics.median(tiempos), pico, len(salida)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paginas', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5, help='Estampados por medición')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'páginas':>8}{'modo':>10}{'p50 (ms)':>11}{'ms/pág':>9}{'pico RSS (MB)':>15}{'salida (KB)':>13}")
+    for paginas in args.paginas:
+        for modo in ('anterior', 'xobject'):
+            with ctx.Pool(1) as pool:
+                ms, pico, tamano = pool.apply(_medir, (modo, paginas, args.repeat))
+            print(f'{paginas:>8}{modo:>10}{ms:>11.1f}{ms / paginas:>9.2f}{pico:>15.1f}{tamano / 1024:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
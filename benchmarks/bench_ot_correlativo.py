@@ -0,0 +1,143 @@
+"""
+bench_ot_correlativo.py - Prueba de carga del correlativo de OTs
+
+Varios procesos (como workers de gunicorn) con varios hilos cada uno piden
+números de OT en paralelo sobre la misma base de auditoría; una fracción
+simula un render fallido y devuelve su número. Al terminar se verifica que
+los números usados no se repiten ni se pierden: todo número del correlativo
+está usado o en ot_libres (se entrega en la próxima reserva). Antes de la
+carga, un proceso reserva un bloque, audita parte, deja un número en curso y
+muere con SIGKILL sin devolver nada: lo suyo se tiene que recuperar. Se
+compara el costo con reservar de a un número (OT_BLOQUE=1).
+
+Uso:
+    python benchmarks/bench_ot_correlativo.py --procesos 4 --hilos 8 --ots 50
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANIO = 2026
+
+
+def _preparar(db_path, legado):
+    """Base con OTs de la numeración anterior (timestamp) que el correlativo debe saltar"""
+    os.environ['AUDIT_DB_PATH'] = db_path
+    sys.path.insert(0, RAIZ)
+    import audit_logger
+    audit_logger.register_ots([({'ot_number': audit_logger.formato_ot(ANIO, n), 'numero_proforma': f'P001-{n}'}, None)
+                               for n in legado])
+
+
+def _muere(db_path, bloque, conexion):
+    """Reserva un bloque, audita la mitad, deja uno en curso y muere sin liberar"""
+    os.environ['AUDIT_DB_PATH'] = db_path
+    os.environ['OT_BLOQUE'] = str(bloque)
+    sys.path.insert(0, RAIZ)
+    import audit_logger
+    numeros = [audit_logger.siguiente_ot(ANIO) for _ in range(max(1, bloque // 2))]
+    auditados = numeros[:-1]
+    audit_logger.register_ots([({'ot_number': audit_logger.formato_ot(ANIO, n), 'numero_proforma': f'K-{n}'}, None)
+                               for n in auditados])
+    conexion.send(auditados)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _worker(db_path, bloque, hilos, ots, fallos, seed):
+    """Un proceso: `hilos` hilos pidiendo `ots` números cada uno. Devuelve los usados"""
+    os.environ['AUDIT_DB_PATH'] = db_path
+    os.environ['OT_BLOQUE'] = str(bloque)
+    sys.path.insert(0, RAIZ)
+    import audit_logger
+
+    def pedir(h):
+        rng, usados = random.Random(seed * 1000 + h), []
+        for _ in range(ots):
+            numero = audit_logger.siguiente_ot(ANIO)
+            if rng.random() < fallos:
+                audit_logger.devolver_ot(ANIO, numero)
+            else:
+                usados.append(numero)
+        return usados
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ex:
+        usados = [n for lista in ex.map(pedir, range(hilos)) for n in lista]
+    duracion = time.perf_counter() - t
+    audit_logger.liberar_reservas()
+    return usados, duracion
+
+
+def correr(args, bloque, legado):
+    tmpdir = tempfile.mkdtemp(prefix='bench_ot_')
+    db_path = os.path.join(tmpdir, 'audit_log.db')
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(1) as pool:
+            pool.apply(_preparar, (db_path, legado))
+
+        recibe, envia = ctx.Pipe(duplex=False)
+        proceso = ctx.Process(target=_muere, args=(db_path, bloque, envia))
+        proceso.start()
+        muertos = recibe.recv()
+        proceso.join()
+
+        with ctx.Pool(args.procesos) as pool:
+            resultados = pool.starmap(_worker, [(db_path, bloque, args.hilos, args.ots, args.fallos, p)
+                                                for p in range(args.procesos)])
+
+        usados = muertos + [n for lista, _ in resultados for n in lista]
+        conn = sqlite3.connect(db_path)
+        ultimo = conn.execute('SELECT ultimo FROM ot_secuencia WHERE anio = ?', (ANIO,)).fetchone()[0]
+        libres = {n for (n,) in conn.execute('SELECT numero FROM ot_libres WHERE anio = ?', (ANIO,))}
+        conn.close()
+        esperado = set(range(1, ultimo + 1)) - set(legado)
+        return {
+            'ots': len(usados),
+            'duplicados': len(usados) - len(set(usados)),
+            'perdidos': len(esperado - set(usados) - libres),
+            'libres': len(libres),
+            'choques_legado': len(set(usados) & set(legado)),
+            'ultimo': ultimo,
+            'segundos': max(d for _, d in resultados),
+        }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--ots', type=int, default=50, help='Números pedidos por hilo')
+    parser.add_argument('--fallos', type=float, default=0.05, help='Fracción de renders fallidos')
+    parser.add_argument('--bloque', type=int, default=20)
+    args = parser.parse_args()
+
+    legado = sorted(random.Random(17025).sample(range(1, args.procesos * args.hilos * args.ots), 25))
+    print(f'{args.procesos} procesos x {args.hilos} hilos x {args.ots} OTs, {args.fallos:.0%} renders fallidos, '
+          f'{len(legado)} OTs previas en la base, 1 proceso muerto con SIGKILL')
+    print(f"\n{'bloque':>7}{'OTs':>7}{'dup.':>6}{'perdidos':>10}{'libres':>8}{'legado':>8}{'último':>8}{'OTs/s':>10}")
+    errores = 0
+    for bloque in (1, args.bloque):
+        r = correr(args, bloque, legado)
+        errores += r['duplicados'] + r['perdidos'] + r['choques_legado']
+        print(f"{bloque:>7}{r['ots']:>7}{r['duplicados']:>6}{r['perdidos']:>10}{r['libres']:>8}{r['choques_legado']:>8}"
+              f"{r['ultimo']:>8}{r['ots'] / r['segundos']:>10.0f}")
+    if errores:
+        print('\n(!) numeración con duplicados, números perdidos o choques')
+        sys.exit(1)
+    print('\nsin duplicados ni números perdidos')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+fixtures.py - Generadores de documentos sintéticos para los benchmarks
+
+Produce PDFs mínimos (texto Helvetica/WinAnsi, sin dependencias externas) con
+la estructura de una proforma Metromecanica, certificados de varias páginas
+y overlays tipo membrete/firma; libros Excel de calibración (openpyxl) con
+fórmulas y su valor en caché, como los que guarda Excel; y DOCX de OT con la
+estructura y el logo que arma generate_ot.js.
+"""
+import io
+import os
+import re
+import random
+import zipfile
+import datetime
+
+TIPOS = ('CALIBRACION', 'REEMPLAZO_COMPONENTE', 'GENERICO')
+
+INSTRUMENTOS = ('MICROMETRO', 'MANOMETRO', 'TERMOMETRO', 'DINAMOMETRO', 'DUROMETRO')
+AREAS        = ('CONTROL DE CALIDAD', 'MAESTRANZA', 'MOLINO', 'AUTOCLAVE', 'ENSAMBLE')
+CLIENTES     = ('MINERA ANDINA SAC', 'AGROINDUSTRIAL DEL NORTE SAA', 'CEMENTOS DEL SUR SAC',
+                'PESQUERA PACIFICO EIRL', 'LABORATORIOS PERUANOS SA')
+
+LINEAS_POR_PAGINA = 60
+
+
+def _escapar(linea):
+    return linea.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _operadores(lineas, alto, tamano):
+    """
+    Cada línea es un texto (operador ', una línea debajo de la anterior) o una
+    lista de celdas [(x, texto)] colocadas una por una con Tm, como las tablas
+    que arman los generadores de PDF
+    """
+    ops = []
+    for k, linea in enumerate(lineas, 1):
+        if isinstance(linea, str):
+            ops.append(f"({_escapar(linea)}) '")
+            continue
+        y = alto - 40 - k * (tamano + 2)
+        ops += [f'1 0 0 1 {x} {y} Tm ({_escapar(celda)}) Tj' for x, celda in linea]
+        ops.append(f'1 0 0 1 40 {y} Tm')
+    return ' '.join(ops)
+
+
+def pdf_texto(paginas, ancho=595, alto=842, tamano=9):
+    """PDF con una lista de páginas, cada una una lista de líneas (ver _operadores)"""
+    objs = []
+
+    def agregar(cuerpo):
+        objs.append(cuerpo)
+        return len(objs)
+
+    fuente = agregar(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    raiz   = agregar(b'')
+    hijos  = []
+    for lineas in paginas:
+        ops = _operadores(lineas, alto, tamano)
+        stream = f'BT /F1 {tamano} Tf 40 {alto - 40} Td {tamano + 2} TL {ops} ET'.encode('latin-1', 'replace')
+        contenido = agregar(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        hijos.append(agregar(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+            b'/Resources << /Font << /F1 %d 0 R >> >> >>' % (raiz, ancho, alto, contenido, fuente)
+        ))
+    objs[raiz - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % h for h in hijos), len(hijos))
+    catalogo = agregar(b'<< /Type /Catalog /Pages %d 0 R >>' % raiz)
+
+    salida = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, cuerpo in enumerate(objs, 1):
+        offsets.append(len(salida))
+        salida += b'%d 0 obj\n' % i + cuerpo + b'\nendobj\n'
+    xref = len(salida)
+    salida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objs) + 1)
+    salida += b''.join(b'%010d 00000 n \n' % o for o in offsets)
+    salida += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs) + 1, catalogo, xref)
+    return bytes(salida)
+
+
+def _paginar(lineas):
+    return [lineas[i:i + LINEAS_POR_PAGINA] for i in range(0, len(lineas), LINEAS_POR_PAGINA)] or [[]]
+
+
+# Columnas de la tabla de ítems: Item, Cant., U.M., Descripción, P.Unit, Total
+COLUMNAS = (40, 62, 95, 125, 470, 520)
+
+
+def proforma_lineas(n_items=3, tipo='CALIBRACION', paginas_anexo=0, seed=0, celdas=False):
+    """
+    Líneas de texto de una proforma sintética. Con celdas, cada fila de la
+    tabla de ítems es una lista de celdas posicionadas
+    """
+    rng = random.Random(seed)
+    cliente = rng.choice(CLIENTES)
+    lineas = [
+        'METROMECANICA - Metrología y Calibración SAC    R.U.C. 20605421696',
+        f'PROFORMA P001-{rng.randrange(10**5):05d}',
+        f'Fecha de emisión: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2026',
+        f'Señor(es): {cliente} Atención: Compras',
+        f'Dirección: AV. INDUSTRIAL {rng.randint(100, 999)} LIMA R.U.C.: 20{rng.randrange(10**9):09d}',
+        f'Teléfono: 9{rng.randrange(10**8):08d}',
+        f'compras@{cliente.split()[0].lower()}.com.pe   ventas@metromecanica.com.pe',
+        'Forma de pago    Plazo de entrega    Garantía',
+        f'CRÉDITO 30 DÍAS  {rng.randint(3, 7)} a {rng.randint(8, 15)} DÍAS Juan Pérez',
+        'Item Cant. U.M. Descripción P.Unit Total',
+    ]
+    venta = 0
+    for i in range(1, n_items + 1):
+        precio = rng.randint(50, 900)
+        venta += precio
+        if tipo == 'CALIBRACION':
+            desc = f'CALIBRACION DE {rng.choice(INSTRUMENTOS)} IM-{rng.randint(1, 999):03d} / {rng.choice(AREAS)}'
+        elif tipo == 'REEMPLAZO_COMPONENTE':
+            desc = 'COMPRA DE BATERIA 6V 4.5AH PARA BALANZA 300 KG Y 500 KG'
+        else:
+            desc = f'SERVICIO DE MANTENIMIENTO PREVENTIVO EQUIPO {i}'
+        fila = (str(i), '1.00', 'NIU', desc, f'{precio}.00', f'{precio}.00')
+        lineas.append(list(zip(COLUMNAS, fila)) if celdas else ' '.join(fila))
+    lineas += [
+        'SON: MIL CIENTO VEINTE Y 00/100 SOLES',
+        f'Venta Gravada {venta:.2f}  IGV {venta * 0.18:.2f}  Total {venta * 1.18:.2f}',
+        'Observaciones:',
+        '- EL SERVICIO INCLUYE certificado de calibración trazable a INACAL',
+        '- Etiquetas de identificación en cada equipo calibrado',
+        '- Los precios INCLUYEN IGV',
+        '"SIRVASE ABONAR EN LA CUENTA CORRIENTE"',
+        'GRACIAS POR SU PREFERENCIA   www.metromecanica.com.pe',
+    ]
+    for p in range(paginas_anexo):
+        lineas += [f'ANEXO {p + 1} - TÉRMINOS Y CONDICIONES GENERALES DEL SERVICIO'] + [
+            f'{p + 1}.{k} El laboratorio conserva registros técnicos según ISO/IEC 17025:2017, cláusula 7.5, '
+            f'por un periodo no menor a cinco años desde la emisión del certificado.'
+            for k in range(LINEAS_POR_PAGINA - 1)
+        ]
+    return lineas
+
+
+def proforma_pdf(n_items=3, tipo='CALIBRACION', paginas_anexo=0, seed=0, celdas=False):
+    """PDF de una proforma sintética"""
+    return pdf_texto(_paginar(proforma_lineas(n_items, tipo, paginas_anexo, seed, celdas)))
+
+
+def corpus_proformas(cantidad=30, seed=17025):
+    """
+    [(nombre, pdf_bytes, páginas)] con distintos tamaños y tipos de servicio;
+    la mitad con la tabla de ítems armada celda por celda
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(cantidad):
+        tipo   = TIPOS[i % len(TIPOS)]
+        items  = rng.choice((1, 3, 10, 40))
+        anexo  = rng.choice((0, 0, 1, 3, 8))
+        celdas = i % 2 == 1
+        lineas = proforma_lineas(items, tipo, anexo, seed=i, celdas=celdas)
+        paginas = _paginar(lineas)
+        sufijo = '_celdas' if celdas else ''
+        corpus.append((f'proforma_{i:03d}_{tipo.lower()}_{items}it_{len(paginas)}p{sufijo}.pdf', pdf_texto(paginas), len(paginas)))
+    return corpus
+
+
+def certificado_pdf(paginas=1):
+    """Certificado de calibración sintético de N páginas"""
+    return pdf_texto([
+        [f'CERTIFICADO DE CALIBRACIÓN MLL-{1000 + p}-2026', f'Página {p + 1} de {paginas}'] +
+        [f'Punto {k}: lectura {k * 1.25:.2f} kg  incertidumbre ±0.02 kg' for k in range(40)]
+        for p in range(paginas)
+    ])
+
+
+def overlay_pdf(texto, ancho=595, alto=842):
+    """PDF de una página para usar como membrete o firma"""
+    return pdf_texto([[texto] * 5], ancho=ancho, alto=alto, tamano=14)
+
+
+def _con_formulas(xlsx_bytes, formulas):
+    """Agrega <f> a las celdas indicadas conservando su <v> (valor en caché)"""
+    entrada, salida = zipfile.ZipFile(io.BytesIO(xlsx_bytes)), io.BytesIO()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as z:
+        for info in entrada.infolist():
+            datos = entrada.read(info)
+            por_celda = formulas.get(info.filename)
+            if por_celda:
+                def agregar(m):
+                    f = por_celda.get(m.group(1))
+                    if f is None:
+                        return m.group(0)
+                    f = f.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                    return m.group(0)[:-3] + f'<f>{f}</f><v>'
+                datos = re.sub(r'<c r="([A-Z]+\d+)"[^>]*><v>', agregar, datos.decode('utf-8')).encode('utf-8')
+            z.writestr(info, datos)
+    return salida.getvalue()
+
+
+def libro_calibracion(hojas_datos=8, filas=400, seed=0):
+    """
+    Libro de calibración (.xlsm) sintético: CALIBRACION (datos del nombre del
+    PDF en B150:B154), `hojas_datos` hojas de mediciones con una columna de
+    fórmulas y CERTIFICADO al final, con celdas combinadas, formatos numéricos,
+    fechas, área de impresión y fórmulas hacia las otras hojas
+    """
+    from openpyxl import Workbook
+    from openpyxl.workbook.defined_name import DefinedName
+    rng = random.Random(seed)
+    wb  = Workbook()
+    formulas = {}
+
+    cal = wb.active
+    cal.title = 'CALIBRACION'
+    for r in range(1, 150):
+        cal.cell(r, 1, f'Parámetro {r}')
+        cal.cell(r, 2, round(rng.uniform(0, 50), 3))
+    for r, v in zip(range(150, 155), ('MLL-1042-2026', 'MASA', 'BALANZA 300 KG', rng.choice(CLIENTES), 'OT-2026-0042')):
+        cal.cell(r, 2, v)
+
+    for h in range(1, hojas_datos + 1):
+        ws = wb.create_sheet(f'DATOS {h}')
+        hoja = formulas[f'xl/worksheets/sheet{h + 1}.xml'] = {}
+        for r in range(1, filas + 1):
+            lecturas = [round(rng.uniform(0, 100), 4) for _ in range(19)]
+            for c, v in enumerate(lecturas, 1):
+                ws.cell(r, c, v)
+            ws.cell(r, 20, sum(lecturas) / 19)
+            hoja[f'T{r}'] = f'AVERAGE(A{r}:S{r})'
+        ws.defined_names['lecturas'] = DefinedName('lecturas', attr_text=f"'DATOS {h}'!$A$1:$S${filas}")
+
+    cert = wb.create_sheet('CERTIFICADO')
+    hoja = formulas[f'xl/worksheets/sheet{hojas_datos + 2}.xml'] = {}
+    cert.merge_cells('A1:L1')
+    cert['A1'] = 'CERTIFICADO DE CALIBRACIÓN'
+    cert.merge_cells('A3:D3')
+    cert['A3'] = 'MLL-1042-2026'
+    hoja['A3'] = 'CALIBRACION!B150'
+    cert['E3'] = datetime.datetime(2026, 3, 14)
+    cert['E3'].number_format = 'dd/mm/yyyy'
+    formatos = ('0.00', '0.000', '0', 'General', '#,##0.0', '0.0000')
+    for r in range(6, 6 + min(filas, 120)):
+        cert.merge_cells(f'A{r}:C{r}')
+        cert[f'A{r}'] = f'Punto {r - 5}'
+        for c, fmt in zip('DEFGHI', formatos):
+            h = rng.randint(1, hojas_datos) if hojas_datos else 0
+            if h:
+                v = wb[f'DATOS {h}'].cell(r - 5, 20).value
+                hoja[f'{c}{r}'] = f"'DATOS {h}'!T{r - 5}"
+            else:
+                v = rng.uniform(0, 100)
+            cert[f'{c}{r}'] = float(round(v)) if fmt == 'General' and r % 2 else v
+            cert[f'{c}{r}'].number_format = fmt
+        cert.merge_cells(f'J{r}:L{r}')
+        cert[f'J{r}'] = 'CONFORME' if r % 3 else None
+    cert.print_area = f'A1:L{6 + min(filas, 120)}'
+
+    salida = io.BytesIO()
+    wb.save(salida)
+    return _con_formulas(salida.getvalue(), formulas)
+
+
+LOGO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logo_metromecanica.png')
+
+
+def docx_ot(ot_number, n_items=3, seed=0):
+    """DOCX mínimo de una OT: document.xml con la tabla de ítems y el logo embebido"""
+    rng = random.Random(seed)
+    celdas = lambda *textos: ''.join(f'<w:tc><w:p><w:r><w:t>{t}</w:t></w:r></w:p></w:tc>' for t in textos)
+    filas = ''.join(
+        f'<w:tr>{celdas(i, rng.choice(INSTRUMENTOS), rng.choice(AREAS), f"S/N {rng.randint(10000, 99999)}", "0 - 25 mm")}</w:tr>'
+        for i in range(1, n_items + 1))
+    documento = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                 '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                 f'<w:p><w:r><w:t>ORDEN DE TRABAJO {ot_number}</w:t></w:r></w:p>'
+                 f'<w:p><w:r><w:t>{rng.choice(CLIENTES)}</w:t></w:r></w:p>'
+                 f'<w:tbl>{filas}</w:tbl></w:body></w:document>')
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        zf.writestr('word/document.xml', documento)
+        with open(LOGO, 'rb') as f:
+            zf.writestr('word/media/image1.png', f.read())
+    return salida.getvalue()
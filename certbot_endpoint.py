@@ -1,16 +1,30 @@
 import os
+import io
 import re
-import subprocess
+import html
+import zipfile
 import tempfile
 import datetime
-import shutil
+import posixpath
+import functools
+from xml.etree import ElementTree
 from flask import Blueprint, request, jsonify, send_file
 from openpyxl import load_workbook
 from openpyxl.cell.cell import MergedCell
 
+import office_converter
+import metrics
+
 certbot_bp = Blueprint('certbot', __name__)
 
 
+@functools.lru_cache(maxsize=256)
+def _decimales(number_format):
+    """Decimales de un formato numérico ('0.00' -> 2); se repite en cada celda"""
+    m = re.search(r'\.([0#]+)', number_format)
+    return len(m.group(1)) if m else 0
+
+
 def fmt_val(val, number_format=None):
     if val is None or isinstance(val, bool) or isinstance(val, str):
         return val
@@ -21,8 +35,7 @@ def fmt_val(val, number_format=None):
             if isinstance(val, float) and val == int(val):
                 return int(val)
             return val
-        m = re.search(r'\.([0#]+)', number_format)
-        decimales = len(m.group(1)) if m else 0
+        decimales = _decimales(number_format)
         redondeado = round(float(val), decimales)
         if decimales == 0:
             return int(redondeado)
@@ -31,87 +44,145 @@ def fmt_val(val, number_format=None):
     return val
 
 
-def leer_certificado(ruta_excel):
-    wb_vals = load_workbook(ruta_excel, read_only=False, data_only=True)
-    cert_name = next(
-        (s for s in wb_vals.sheetnames if s.upper() == "CERTIFICADO"),
-        wb_vals.sheetnames[-1]
-    )
-    ws_vals = wb_vals[cert_name]
-    valores = {}
-    for row in ws_vals.iter_rows():
-        for cell in row:
-            if isinstance(cell, MergedCell):
-                continue
-            if cell.value is not None:
-                valores[cell.coordinate] = (cell.value, cell.number_format)
-    wb_vals.close()
-    resultado = {}
-    for coord, (val, fmt) in valores.items():
-        resultado[coord] = fmt_val(val, fmt)
-    return resultado, cert_name
+# ═══ CARGA ÚNICA DEL LIBRO ═══════════════════════════════════════════════════
+# Los libros de calibración traen muchas hojas de datos; solo se parsean
+# CERTIFICADO (la que se exporta) y CALIBRACION (datos del nombre del PDF)
+HOJA_CERTIFICADO = "CERTIFICADO"
+HOJA_CALIBRACION = "CALIBRACION"
 
+_RE_SHEET        = re.compile(rb'<(?:\w+:)?sheet\b[^>]*?/>')
+_RE_DEFINED_NAME = re.compile(rb'<((?:\w+:)?)definedName\b([^>]*?)(?:/>|>.*?</\1definedName>)', re.S)
+_RE_LOCAL_ID     = re.compile(rb'\blocalSheetId="(\d+)"')
 
-def preparar_para_pdf(ruta_excel, tmpdir):
-    valores_cert, cert_name = leer_certificado(ruta_excel)
 
-    ruta_copia = os.path.join(tmpdir, "certificado_final.xlsx")
-    shutil.copy2(ruta_excel, ruta_copia)
+def _atributo(tag, nombre):
+    m = re.search(rb'\s' + nombre + rb'="([^"]*)"', tag)
+    return html.unescape(m.group(1).decode('utf-8')) if m else None
 
-    wb = load_workbook(ruta_copia, data_only=False, keep_vba=True)
-    ws = wb[cert_name]
 
-    # Inyectar valores estáticos
-    for coord, val in valores_cert.items():
-        try:
-            cell = ws[coord]
-            if isinstance(cell, MergedCell):
-                for rng in ws.merged_cells.ranges:
-                    if coord in rng:
-                        wb[cert_name].cell(row=rng.min_row, column=rng.min_col).value = val
-                        break
-            else:
-                cell.value = val
-        except Exception:
-            pass
+def _relaciones(archive, parte):
+    """{Id: (Type, ruta en el zip)} de las relaciones internas de `parte`"""
+    ruta = posixpath.join(posixpath.dirname(parte), '_rels', posixpath.basename(parte) + '.rels')
+    try:
+        raiz = ElementTree.fromstring(archive.read(ruta))
+    except KeyError:
+        return {}
+    rels = {}
+    for rel in raiz:
+        if rel.get('TargetMode') == 'External':
+            continue
+        destino = rel.get('Target')
+        destino = destino[1:] if destino.startswith('/') else posixpath.normpath(posixpath.join(posixpath.dirname(parte), destino))
+        rels[rel.get('Id')] = (rel.get('Type'), destino)
+    return rels
+
+
+def _hojas(archive):
+    """(parte del workbook, [(<sheet>, nombre, r:id)] en el orden del libro)"""
+    libro = next(p for t, p in _relaciones(archive, '').values() if t.endswith('/officeDocument'))
+    hojas = [(m.group(0), _atributo(m.group(0), rb'name'), _atributo(m.group(0), rb'\w+:id'))
+             for m in _RE_SHEET.finditer(archive.read(libro))]
+    return libro, hojas
+
+
+def _recortar_libro(archive, libro, hojas, conservar):
+    """
+    Copia en memoria del paquete xlsx/xlsm sin las hojas que no están en
+    `conservar`: quita sus <sheet> y sus partes, y renumera los nombres
+    definidos por hoja (área de impresión, títulos)
+    """
+    rels   = _relaciones(archive, libro)
+    indice = {}   # índice original -> índice en el libro recortado
+    fuera  = {'xl/calcChain.xml'}
+    for i, (_, nombre, rid) in enumerate(hojas):
+        if nombre in conservar:
+            indice[i] = len(indice)
+        elif rid in rels:
+            parte = rels[rid][1]
+            fuera |= {parte, posixpath.join(posixpath.dirname(parte), '_rels', posixpath.basename(parte) + '.rels')}
+
+    def hoja(m):
+        return m.group(0) if _atributo(m.group(0), rb'name') in conservar else b''
+
+    def nombre_definido(m):
+        local = _RE_LOCAL_ID.search(m.group(2))
+        if local is None:
+            return m.group(0)
+        nuevo = indice.get(int(local.group(1)))
+        if nuevo is None:
+            return b''
+        return _RE_LOCAL_ID.sub(b'localSheetId="%d"' % nuevo, m.group(0), count=1)
+
+    xml = _RE_SHEET.sub(hoja, archive.read(libro))
+    xml = _RE_DEFINED_NAME.sub(nombre_definido, xml)
+    xml = re.sub(rb'\b(activeTab|firstSheet)="\d+"', rb'\1="0"', xml)
+
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_STORED) as recortado:
+        for info in archive.infolist():
+            if info.filename not in fuera:
+                recortado.writestr(info.filename, xml if info.filename == libro else archive.read(info))
+    salida.seek(0)
+    return salida
+
+
+def cargar_libro(origen):
+    """
+    Abre el libro (ruta o archivo subido, sin copiarlo a disco) una sola vez
+    con los valores en caché (data_only): las fórmulas del certificado se
+    reemplazan por esos mismos valores, así que no hace falta una segunda
+    carga con fórmulas. Devuelve (wb, cert_name)
+    """
+    with zipfile.ZipFile(origen) as archive:
+        libro, hojas = _hojas(archive)
+        nombres   = [nombre for _, nombre, _ in hojas]
+        cert_name = next((s for s in nombres if s.upper() == HOJA_CERTIFICADO), nombres[-1])
+        recortado = _recortar_libro(archive, libro, hojas, {cert_name, HOJA_CALIBRACION})
+    return load_workbook(recortado, data_only=True), cert_name
+
+
+def valor_estatico(cell):
+    """Valor final de una celda del certificado: el de caché con su formato, sin fórmulas residuales"""
+    val = fmt_val(cell.value, cell.number_format)
+    if isinstance(val, str) and val.startswith("="):
+        return None
+    return val
+
+
+def preparar_para_pdf(wb, cert_name, tmpdir):
+    """Deja en el libro solo la hoja del certificado, con valores estáticos, y lo guarda"""
+    ws = wb[cert_name]
 
-    # Limpiar fórmulas residuales
+    # Inyectar valores estáticos y limpiar fórmulas en una sola pasada. Cada
+    # celda ya trae su valor en caché (carga data_only), así que se reescribe
+    # en su lugar; las celdas combinadas que no son ancla no tienen valor
     for row in ws.iter_rows():
         for cell in row:
             if isinstance(cell, MergedCell):
                 continue
             try:
-                if isinstance(cell.value, str) and cell.value.startswith("="):
-                    cell.value = None
+                cell.value = valor_estatico(cell)
             except Exception:
                 pass
 
-    # Primero marcar CERTIFICADO como visible y activa
-    for i, s in enumerate(wb.worksheets):
-        if s.title == cert_name:
-            wb.active = i
-            s.sheet_state = "visible"
-            break
-
-    # Luego ocultar todas las demás
+    # Solo se exporta el certificado: el resto de hojas no viaja a LibreOffice
     for nombre in wb.sheetnames:
         if nombre != cert_name:
-            try:
-                wb[nombre].sheet_state = "veryHidden"
-            except Exception:
-                pass
+            wb.remove(wb[nombre])
+    ws.sheet_state = "visible"
+    wb.active = 0
 
+    ruta_copia = os.path.join(tmpdir, "certificado_final.xlsx")
     wb.save(ruta_copia)
     wb.close()
-    return ruta_copia, cert_name
+    return ruta_copia
 
 
-def construir_nombre(ruta_excel, nombre_archivo):
+def construir_nombre(wb, nombre_archivo):
     n_cert = magnitud = equipo = cliente = ot = ""
     try:
-        wb = load_workbook(ruta_excel, read_only=True, data_only=True)
-        if "CALIBRACION" in wb.sheetnames:
-            cal = wb["CALIBRACION"]
+        if HOJA_CALIBRACION in wb.sheetnames:
+            cal = wb[HOJA_CALIBRACION]
             def g(coord):
                 v = cal[coord].value
                 return str(v).strip() if v else ""
@@ -120,7 +191,6 @@ def construir_nombre(ruta_excel, nombre_archivo):
             equipo   = g("B152")
             cliente  = g("B153")
             ot       = g("B154")
-        wb.close()
     except Exception:
         pass
 
@@ -143,18 +213,24 @@ def construir_nombre(ruta_excel, nombre_archivo):
 
 @certbot_bp.route('/generar-certificado', methods=['POST'])
 def generar_certificado():
-    if 'file' not in request.files:
+    with metrics.etapa('upload'):
+        archivo = request.files.get('file')
+    if archivo is None:
         return jsonify({"error": "No se envió archivo"}), 400
+    nombre = archivo.filename
 
-    archivo = request.files['file']
-    nombre  = archivo.filename
+    try:
+        with metrics.etapa('excel'):
+            wb, cert_name = cargar_libro(archivo.stream)
+            nombre_pdf    = construir_nombre(wb, nombre)
+    except Exception as e:
+        return jsonify({"error": f"Error preparando archivo: {str(e)}"}), 500
 
+    # LibreOffice trabaja con archivos: solo la hoja preparada y su PDF pasan por el temporal
     with tempfile.TemporaryDirectory() as tmpdir:
-        ruta_excel = os.path.join(tmpdir, nombre)
-        archivo.save(ruta_excel)
-
         try:
-            ruta_copia, cert_name = preparar_para_pdf(ruta_excel, tmpdir)
+            with metrics.etapa('excel'):
+                ruta_copia = preparar_para_pdf(wb, cert_name, tmpdir)
         except Exception as e:
             return jsonify({"error": f"Error preparando archivo: {str(e)}"}), 500
 
@@ -163,47 +239,37 @@ def generar_certificado():
         env["LC_ALL"]     = "es_PE.UTF-8"
         env["LC_NUMERIC"] = "es_PE.UTF-8"
 
-        cmd = [
-            "libreoffice", "--headless",
-            "--infilter=Calc MS Excel 2007 XML",
-            "--convert-to", f"pdf:calc_pdf_Export:EmbedStandardFonts=true,SheetRanges={cert_name}",
-            "--outdir", tmpdir,
-            ruta_copia
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=90, env=env)
-
-        print(f"stdout: {result.stdout}")
-        print(f"stderr: {result.stderr}")
-        print(f"returncode: {result.returncode}")
-        print(f"archivos: {os.listdir(tmpdir)}")
-
-        if result.returncode != 0:
-            return jsonify({"error": "Error LibreOffice", "detalle": result.stderr}), 500
-
-        pdfs = [f for f in os.listdir(tmpdir) if f.endswith('.pdf')]
-        print(f"PDFs: {pdfs}")
-
-        if not pdfs:
-            return jsonify({"error": "PDF no generado", "archivos": os.listdir(tmpdir)}), 500
-
-        pdf_generado = os.path.join(tmpdir, pdfs[0])
-        pdf_final    = os.path.join(tmpdir, construir_nombre(ruta_excel, nombre))
-
+        try:
+            pdf_generado = office_converter.convertir_a_pdf(
+                ruta_copia, tmpdir,
+                filter_name="calc_pdf_Export",
+                filter_options={"EmbedStandardFonts": True, "SheetRanges": cert_name},
+                infilter="Calc MS Excel 2007 XML",
+                env=env,
+                timeout=90
+            )
+        except office_converter.ConversionBusy as e:
+            return jsonify({"error": str(e)}), 503
+        except office_converter.ConversionError as e:
+            return jsonify({"error": "Error LibreOffice", "detalle": str(e)}), 500
+
+        pdf_final = io.BytesIO()
         try:
             from pypdf import PdfReader, PdfWriter
             reader = PdfReader(pdf_generado)
             writer = PdfWriter()
             for page in reader.pages:
                 writer.add_page(page)
-            with open(pdf_final, "wb") as f:
-                writer.write(f)
+            writer.write(pdf_final)
         except Exception:
-            pdf_final = pdf_generado
-
-        return send_file(
-            pdf_final,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=os.path.basename(pdf_final)
-        )
+            with open(pdf_generado, "rb") as f:
+                pdf_final = io.BytesIO(f.read())
+            nombre_pdf = os.path.basename(pdf_generado)
+
+    pdf_final.seek(0)
+    return send_file(
+        pdf_final,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=nombre_pdf
+    )
@@ -0,0 +1,145 @@
+"""
+extract_cache.py - Caché persistente de resultados de extracción
+Guarda el dict de extract_proforma indexado por el SHA-256 del PDF subido.
+Cada entrada lleva la versión del extractor (hash de extract_proforma.py y
+del backend configurado): si el extractor cambia, las entradas viejas se
+descartan solas. Tamaño acotado con desalojo LRU.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
+DB_PATH     = os.environ.get('EXTRACT_CACHE_PATH', os.path.join(BASE_DIR, 'ordenes_generadas', '.extract_cache.db'))
+ENABLED     = os.environ.get('EXTRACT_CACHE', '1') == '1'
+MAX_ENTRIES = int(os.environ.get('EXTRACT_CACHE_MAX_ENTRIES', 5000))
+MAX_BYTES   = int(float(os.environ.get('EXTRACT_CACHE_MAX_MB', 64)) * 1024 * 1024)
+
+
+def _version_extractor():
+    h = hashlib.sha256()
+    with open(os.path.join(BASE_DIR, 'extract_proforma.py'), 'rb') as f:
+        h.update(f.read())
+    h.update(os.environ.get('EXTRACT_BACKEND', 'layout').encode())
+    return h.hexdigest()[:16]
+
+
+VERSION = _version_extractor()
+
+_lock    = threading.Lock()
+_local   = threading.local()
+_metricas = {'aciertos': 0, 'fallos': 0, 'guardados': 0, 'desalojados': 0, 'invalidados': 0}
+_iniciado = False
+
+
+def sha256_datos(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 16), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _get_conn():
+    """Conexión por hilo y por proceso; la tabla se crea y purga una vez"""
+    global _iniciado
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Es una caché: perder la última escritura ante un corte no importa
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn, _local.pid = conn, os.getpid()
+    with _lock:
+        if not _iniciado:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS extracciones (
+                sha256  TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                data    TEXT NOT NULL,
+                tamano  INTEGER NOT NULL,
+                usado   REAL NOT NULL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_extracciones_usado ON extracciones(usado)')
+            cur = conn.execute('DELETE FROM extracciones WHERE version != ?', (VERSION,))
+            _metricas['invalidados'] += cur.rowcount
+            conn.commit()
+            _iniciado = True
+    return conn
+
+
+def _contar(clave, n=1):
+    with _lock:
+        _metricas[clave] += n
+
+
+def obtener(digest):
+    """Devuelve el dict cacheado para el PDF con ese SHA-256, o None"""
+    if not ENABLED:
+        return None
+    try:
+        conn = _get_conn()
+        fila = conn.execute('SELECT data FROM extracciones WHERE sha256 = ? AND version = ?',
+                            (digest, VERSION)).fetchone()
+        if fila is None:
+            _contar('fallos')
+            return None
+        conn.execute('UPDATE extracciones SET usado = ? WHERE sha256 = ?', (time.time(), digest))
+        conn.commit()
+    except sqlite3.Error:
+        _contar('fallos')
+        return None
+    _contar('aciertos')
+    return json.loads(fila[0])
+
+
+def guardar(digest, data):
+    """Guarda el resultado y desaloja las entradas menos usadas si se excede el límite"""
+    if not ENABLED:
+        return
+    texto = json.dumps(data, ensure_ascii=False)
+    try:
+        conn = _get_conn()
+        conn.execute('INSERT OR REPLACE INTO extracciones (sha256, version, data, tamano, usado) VALUES (?, ?, ?, ?, ?)',
+                     (digest, VERSION, texto, len(texto.encode()), time.time()))
+        # Se conservan las más recientes mientras quepan en MAX_ENTRIES y MAX_BYTES
+        cur = conn.execute('''
+        DELETE FROM extracciones WHERE sha256 IN (
+            SELECT sha256 FROM (
+                SELECT sha256,
+                       ROW_NUMBER() OVER (ORDER BY usado DESC) AS n,
+                       SUM(tamano) OVER (ORDER BY usado DESC ROWS UNBOUNDED PRECEDING) AS acumulado
+                FROM extracciones
+            ) WHERE n > ? OR acumulado > ?
+        )''', (MAX_ENTRIES, MAX_BYTES))
+        conn.commit()
+    except sqlite3.Error:
+        return
+    _contar('guardados')
+    if cur.rowcount > 0:
+        _contar('desalojados', cur.rowcount)
+
+
+def get_metricas():
+    entradas = tamano = 0
+    if ENABLED:
+        try:
+            entradas, tamano = _get_conn().execute(
+                'SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM extracciones').fetchone()
+        except sqlite3.Error:
+            pass
+    with _lock:
+        metricas = dict(_metricas)
+    consultas = metricas['aciertos'] + metricas['fallos']
+    metricas.update(tasa_aciertos=round(metricas['aciertos'] / consultas, 3) if consultas else None,
+                    habilitado=ENABLED, version=VERSION, entradas=entradas, bytes=tamano,
+                    max_entradas=MAX_ENTRIES, max_bytes=MAX_BYTES)
+    return metricas
@@ -2,83 +2,282 @@
 extract_proforma.py - Extractor GENÉRICO de proformas Metromecanica
 Versión 2.0 - Funciona con cualquier tipo de servicio
 """
-import re, sys, json, argparse
+import io, os, re, sys, json, time, argparse
 import pdfplumber
 
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+# layout: pdfplumber (por defecto)
+# auto: texto crudo con pypdf, aceptado solo si sus ítems cuadran con la Venta
+#       Gravada; si no, pdfplumber
+# rapido: solo pypdf, sin verificación
+BACKEND = os.environ.get('EXTRACT_BACKEND', 'layout')
+
 def clean(t): return " ".join(t.split()).strip()
 
-def find(text, pattern, group=1, default="", flags=re.IGNORECASE|re.DOTALL):
-    m = re.search(pattern, text, flags)
-    return clean(m.group(group)) if m else default
+# ═══ PATRONES PRECOMPILADOS ══════════════════════════════════════════════════
+_F = re.IGNORECASE | re.DOTALL
+
+# Tabla declarativa de campos: (nombre, sección, patrón, default).
+# Cada campo se busca primero en su sección; si no aparece ahí, en el texto
+# completo (la sección es un prefijo/sufijo del texto, el resultado es el mismo).
+CAMPOS = (
+    ('numero_proforma',  'cabecera',      re.compile(r'(P\d+\-\d+)', _F), "SIN-NUM"),
+    ('fecha_emision',    'cabecera',      re.compile(r'(\d{2}/\d{2}/\d{4})', _F), ""),
+    ('cliente_raw',      'cabecera',      re.compile(r'Se[nñ]or\(es\)\s*:\s*(.+?)(?:Direcci)', _F), ""),
+    ('dir_raw',          'cabecera',      re.compile(r'Direcci[oó]n\s*:\s*(.+?)(?:R\.U\.C\.)', _F), ""),
+    ('ruc_cliente',      'cabecera',      re.compile(r'R\.U\.C\.\s*:\s*(\d{11})', _F), ""),
+    ('telefono_cliente', 'cabecera',      re.compile(r'Tel[eé]fono\s*:\s*([\d\s]+)', _F), ""),
+    ('forma_pago',       'cabecera',      re.compile(r'(CR[EÉ]DITO\s+\d+\s+D[IÍ]AS)', _F), ""),
+    ('plazo_entrega',    'cabecera',      re.compile(r'(\d+\s+a\s+\d+\s+D[IÍ]AS|\d+\s+a\s+\d+\s+dias)', _F), ""),
+    ('obs_text',         'observaciones', re.compile(r'Observaciones\s*:\s*(.*?)(?:"SIRVASE|GRACIAS|www\.)', _F), ""),
+)
+
+# Marcadores de sección, localizados en una sola pasada
+_RE_SECCIONES = re.compile(
+    r'(?P<items>^[ \t]*Item\b)|(?P<fin_items>\bSON:|Venta Gravada)|(?P<obs>Observaciones\s*:)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+_RE_ATENCION   = re.compile(r'Atenci', re.IGNORECASE)
+_RE_DIR_CORTE  = re.compile(r'@|Atenci', re.IGNORECASE)
+_RE_EMAIL      = re.compile(r'[\w.\-]+@[\w.\-]+\.\w+')
+_RE_CONTACTO   = re.compile(r'\d+\s+a?\s*\d+\s+D[IÍ]AS\s+([\w][\w\s]+?)(?:\n|$)', re.IGNORECASE)
+_RE_ITEM       = re.compile(r'(\d+)\s+(\d+\.\d+)\s+(ZZ|NIU|UND|GLB)\s+(.+?)(?=\d+\.\d+\s+\d+\.\d+)', re.DOTALL)
+_RE_IMPORTES   = re.compile(r'([\d,]+\.\d+)\s+([\d,]+\.\d+)')
+_RE_VENTA_GRAVADA = re.compile(r'Venta Gravada\s*:?\s*(?:S/\.?\s*)?([\d,]+\.\d{2})', re.IGNORECASE)
+_RE_ITEMS_FALLBACK = re.compile(r'Item.*?Descripci[oó]n.*?([\d].+?)(?=SON:|Venta Gravada)', re.DOTALL | re.IGNORECASE)
+_RE_COMBO_KG   = re.compile(r'(\d+)\s*KG\s+Y\s+(\d+)\s*KG', re.IGNORECASE)
+_RE_BALANZA    = re.compile(r'BALANZA\s+\d+\s*KG')
+_RE_CODIGO     = re.compile(r'(IM-\d+)')
+_RE_AREA       = re.compile(r'/\s*([A-Z\s]+(?:MAESTRANZA|CALIDAD|MOLINO|AUTOCLAVE|ENSAMBLE)[A-Z\s]*)\s*$')
+_RE_COMPONENTE = re.compile(r'COMPRA DE (.+?)(?:PARA|$)', re.IGNORECASE)
+_RE_PREFIJO    = re.compile(r'^(EL\s+SERVICIO|SE)\s+(REALIZARA?|INCLUYE?)\s+', re.IGNORECASE)
+
+KW_BATERIA     = ('BATERIA', 'BATTERY')
+KW_CALIBRACION = ('CALIBR', 'VERIFIC', 'MICROMETRO', 'DINAMOMETRO', 'MANOMETRO', 'TERMOMETRO', 'DUROMETRO')
+KW_EXCLUIR     = ('COSTO', 'IGV', 'PRECIO', 'INCLUYE IGV', 'S/.', 'OBSERVACIONES:', 'ABONAR')
+
+# Fin del bloque útil: total en letras / resumen, cierre de observaciones y
+# comienzo de una sección nueva (anexos de términos y condiciones)
+_RE_TOTAL   = re.compile(r'\bSON:|Venta Gravada', re.IGNORECASE)
+_RE_OBS     = re.compile(r'Observaciones\s*:', re.IGNORECASE)
+_RE_FIN_OBS = re.compile(r'"SIRVASE|GRACIAS|www\.', re.IGNORECASE)
+_RE_ANEXO   = re.compile(r'\s*(?:ANEXO\b|T[EÉ]RMINOS\s+Y\s+CONDICIONES|CONDICIONES\s+GENERALES)', re.IGNORECASE)
+
+def _completa(texto):
+    """Ya apareció un total y, después de él, un bloque de observaciones cerrado"""
+    total = _RE_TOTAL.search(texto)
+    obs = total and _RE_OBS.search(texto, total.end())
+    return bool(obs and _RE_FIN_OBS.search(texto, obs.end()))
+
+def _leer_paginas(paginas, hasta_total=True):
+    """
+    Concatena el texto de las páginas en orden. Con hasta_total se detiene en
+    cuanto la proforma está completa (total y observaciones cerradas después
+    de él) o, pasado el total, en la primera página que abre una sección nueva
+    (anexos de términos y condiciones), que no se incluye. Si no, se lee hasta
+    el final: un subtotal por página o unas observaciones largas no cortan la
+    lectura.
+
+    Returns:
+        (texto, páginas leídas)
+    """
+    partes, total_visto = [], False
+    for extraer in paginas:
+        texto = extraer() or ""
+        if hasta_total and total_visto and _RE_ANEXO.match(texto):
+            break
+        partes.append(texto)
+        if not hasta_total:
+            continue
+        total_visto = total_visto or bool(_RE_TOTAL.search(texto))
+        if total_visto and _completa("\n".join(partes)):
+            break
+    return "\n".join(partes), len(partes)
+
+def leer_texto(pdf, backend="layout", hasta_total=True, info=None):
+    """
+    Extrae el texto de la proforma página por página (etapa costosa)
+
+    pdf es la ruta o los bytes del PDF. backend "layout" usa pdfplumber
+    (agrupa caracteres por posición); "rapido" usa el texto crudo de pypdf,
+    mucho más barato. En `info` se devuelven las páginas leídas y el total
+    del documento.
+    """
+    fuente = io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else pdf
+    if backend == "rapido":
+        reader = PdfReader(fuente)
+        texto, leidas = _leer_paginas((p.extract_text for p in reader.pages), hasta_total)
+        total = len(reader.pages)
+    else:
+        with pdfplumber.open(fuente) as pdf:
+            texto, leidas = _leer_paginas((p.extract_text for p in pdf.pages), hasta_total)
+            total = len(pdf.pages)
+    if info is not None:
+        info.update(backend=backend, paginas_leidas=leidas, paginas_total=total)
+    return texto
+
+def _filas_cuadran(texto, data):
+    """
+    El texto crudo de pypdf no respeta la posición de las celdas: en una tabla
+    armada celda por celda las pega sin espacios y el parser arma ítems
+    equivocados sin que falte ningún campo. Se acepta solo si los ítems son
+    correlativos y la suma de sus importes coincide con la Venta Gravada
+    """
+    items = data["items"]
+    venta = _RE_VENTA_GRAVADA.search(texto)
+    if not items or not venta or [it["item"] for it in items] != list(range(1, len(items) + 1)):
+        return False
+    fuente, filas = _filas_items(segmentar(texto))
+    if len(filas) != len(items):
+        return False
+    suma = 0.0
+    for fila in filas:
+        importes = _RE_IMPORTES.match(fuente, fila.end())
+        if not importes:
+            return False
+        suma += float(importes.group(2).replace(',', ''))
+    return abs(suma - float(venta.group(1).replace(',', ''))) < 0.01
 
-def extract_proforma(pdf_path):
-    with pdfplumber.open(pdf_path) as pdf:
-        full_text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+def _ms(segundos):
+    return round(segundos * 1000, 1)
+
+def extract_proforma(pdf, tiempos=None, info=None):
+    """
+    Extrae los datos de la proforma (ruta o bytes del PDF). En `tiempos` deja los milisegundos de
+    cada etapa (texto_<backend>, regex_<backend>) y en `info` el backend
+    que produjo el resultado y las páginas leídas
+    """
+    if BACKEND == "auto":
+        backends = ("rapido", "layout") if PYPDF_AVAILABLE else ("layout",)
+    elif BACKEND == "rapido" and PYPDF_AVAILABLE:
+        backends = ("rapido",)
+    else:
+        backends = ("layout",)
+
+    tiempos = {} if tiempos is None else tiempos
+    for backend in backends:
+        t = time.perf_counter()
+        texto = leer_texto(pdf, backend, info=info)
+        t_texto = time.perf_counter()
+        data = parsear_texto(texto)
+        tiempos[f"texto_{backend}"] = _ms(t_texto - t)
+        tiempos[f"regex_{backend}"] = _ms(time.perf_counter() - t_texto)
+        if backend != "rapido" or BACKEND == "rapido" or _filas_cuadran(texto, data):
+            break
+    return data
+
+def segmentar(full_text):
+    """
+    Divide el texto en cabecera, items y observaciones con una sola pasada.
+    Los ítems llegan hasta el último total del documento: un subtotal por
+    página (SON: / Venta Gravada) dentro de la tabla no la corta
+    """
+    pos = {}
+    for m in _RE_SECCIONES.finditer(full_text):
+        clave = m.lastgroup
+        if clave == 'fin_items':
+            if 'items' in pos:
+                pos['fin_items'] = m.start()
+            continue
+        pos.setdefault(clave, m.start())
+    ini_items = pos.get('items')
+    return {
+        'completo':      full_text,
+        'cabecera':      full_text[:ini_items] if ini_items is not None else full_text,
+        'items':         full_text[ini_items:pos.get('fin_items', len(full_text))] if ini_items is not None else full_text,
+        'observaciones': full_text[pos['obs']:] if 'obs' in pos else "",
+    }
+
+def evaluar_campos(secciones):
+    """Evalúa la tabla CAMPOS sobre las secciones del documento"""
+    valores = {}
+    for nombre, seccion, patron, default in CAMPOS:
+        m = patron.search(secciones[seccion])
+        if m is None and secciones[seccion] is not secciones['completo']:
+            m = patron.search(secciones['completo'])
+        valores[nombre] = clean(m.group(1)) if m else default
+    return valores
+
+def _buscar(secciones, seccion, patron):
+    return patron.search(secciones[seccion]) or patron.search(secciones['completo'])
+
+def _filas_items(secciones):
+    """Filas de la tabla de ítems; si la sección no trae ninguna, se buscan en todo el texto"""
+    filas = list(_RE_ITEM.finditer(secciones['items']))
+    if not filas and secciones['items'] is not secciones['completo']:
+        return secciones['completo'], list(_RE_ITEM.finditer(secciones['completo']))
+    return secciones['items'], filas
+
+def parsear_texto(full_text):
+    """Aplica las expresiones regulares sobre el texto ya extraído"""
+    secciones = segmentar(full_text)
+    campos    = evaluar_campos(secciones)
 
     # ═══ DATOS BÁSICOS ═══════════════════════════════════════════════════════
-    numero_proforma = find(full_text, r'(P\d+\-\d+)', default="SIN-NUM")
-    fecha_emision   = find(full_text, r'(\d{2}/\d{2}/\d{4})', default="")
+    numero_proforma = campos['numero_proforma']
+    fecha_emision   = campos['fecha_emision']
 
     # ═══ CLIENTE ═════════════════════════════════════════════════════════════
-    cliente_raw = find(full_text, r'Se[nñ]or\(es\)\s*:\s*(.+?)(?:Direcci)', default="")
-    cliente     = re.split(r'Atenci', cliente_raw, flags=re.IGNORECASE)[0].strip()
-    
-    dir_raw     = find(full_text, r'Direcci[oó]n\s*:\s*(.+?)(?:R\.U\.C\.)', default="")
-    direccion   = re.split(r'@|Atenci', dir_raw, flags=re.IGNORECASE)[0].strip()
-    
-    ruc_cliente = find(full_text, r'R\.U\.C\.\s*:\s*(\d{11})', default="")
+    cliente     = _RE_ATENCION.split(campos['cliente_raw'])[0].strip()
+    direccion   = _RE_DIR_CORTE.split(campos['dir_raw'])[0].strip()
+    ruc_cliente = campos['ruc_cliente']
 
-    all_emails      = re.findall(r'[\w.\-]+@[\w.\-]+\.\w+', full_text)
-    emails_cliente  = [e for e in all_emails if 'metromecanica' not in e.lower()]
-    email_cliente   = emails_cliente[0] if emails_cliente else ""
+    # El primer email del cliente suele estar en la cabecera
+    email_cliente = next((e for e in _RE_EMAIL.findall(secciones['cabecera']) if 'metromecanica' not in e.lower()), None)
+    if email_cliente is None:
+        email_cliente = next((e for e in _RE_EMAIL.findall(full_text) if 'metromecanica' not in e.lower()), "")
     
-    telefono_cliente= find(full_text, r'Tel[eé]fono\s*:\s*([\d\s]+)', default="").strip()
+    telefono_cliente= campos['telefono_cliente'].strip()
 
     # Contacto = columna "Garantia" de la proforma
-    cm = re.search(r'\d+\s+a?\s*\d+\s+D[IÍ]AS\s+([\w][\w\s]+?)(?:\n|$)', full_text, re.IGNORECASE)
+    cm = _buscar(secciones, 'cabecera', _RE_CONTACTO)
     contacto = clean(cm.group(1)) if cm else (
         email_cliente.split('@')[0].replace('.',' ').replace('_',' ').title() if email_cliente else ""
     )
 
-    forma_pago    = find(full_text, r'(CR[EÉ]DITO\s+\d+\s+D[IÍ]AS)', default="")
-    plazo_entrega = find(full_text, r'(\d+\s+a\s+\d+\s+D[IÍ]AS|\d+\s+a\s+\d+\s+dias)', default="")
+    forma_pago    = campos['forma_pago']
+    plazo_entrega = campos['plazo_entrega']
 
     # ═══ EXTRACCIÓN GENÉRICA DE ITEMS ════════════════════════════════════════
     # Detectar todos los items de la tabla
-    items_matches = re.findall(
-        r'(\d+)\s+(\d+\.\d+)\s+(ZZ|NIU|UND|GLB)\s+(.+?)(?=\d+\.\d+\s+\d+\.\d+)',
-        full_text,
-        re.DOTALL
-    )
+    items_matches = [m.groups() for m in _filas_items(secciones)[1]]
     
     items = []
     equipos_set = set()
     tipo_servicio = "GENERICO"
+    combo = False   # patrón "300 KG Y 500 KG": se busca una sola vez
     
     for item_num, cantidad, um, descripcion_raw in items_matches:
         desc_clean = clean(descripcion_raw)
+        desc_upper = desc_clean.upper()
         
         # Detectar tipo de servicio por palabras clave
-        if any(kw in desc_clean.upper() for kw in ['BATERIA', 'BATTERY']):
+        if any(kw in desc_upper for kw in KW_BATERIA):
             tipo_servicio = "REEMPLAZO_COMPONENTE"
             # Buscar patron combinado "300 KG Y 500 KG" en todo el texto
-            combo = re.search(r'(\d+)\s*KG\s+Y\s+(\d+)\s*KG', full_text, re.IGNORECASE)
+            if combo is False:
+                combo = _RE_COMBO_KG.search(full_text)
             if combo:
                 equipos_set.add(f"BALANZA {combo.group(1)} KG")
                 equipos_set.add(f"BALANZA {combo.group(2)} KG")
             else:
                 # Extraer equipos mencionados en la descripción
-                equipos = re.findall(r'BALANZA\s+\d+\s*KG', desc_clean.upper())
-                equipos_set.update(equipos)
+                equipos_set.update(_RE_BALANZA.findall(desc_upper))
         
-        elif any(kw in desc_clean.upper() for kw in ['CALIBR', 'VERIFIC', 'MICROMETRO', 'DINAMOMETRO', 'MANOMETRO', 'TERMOMETRO', 'DUROMETRO']):
+        elif any(kw in desc_upper for kw in KW_CALIBRACION):
             tipo_servicio = "CALIBRACION"
             # Extraer código del instrumento (ej: IM-012)
-            codigo_match = re.search(r'(IM-\d+)', desc_clean)
+            codigo_match = _RE_CODIGO.search(desc_clean)
             codigo = codigo_match.group(1) if codigo_match else f"ITEM-{item_num}"
             
             # Extraer área/ubicación (ej: MAESTRANZA, CONTROL DE CALIDAD)
-            area_match = re.search(r'/\s*([A-Z\s]+(?:MAESTRANZA|CALIDAD|MOLINO|AUTOCLAVE|ENSAMBLE)[A-Z\s]*)\s*$', desc_clean)
+            area_match = _RE_AREA.search(desc_clean)
             area = clean(area_match.group(1)) if area_match else "LABORATORIO"
             equipos_set.add(f"{codigo} - {area}")
         
@@ -92,7 +291,7 @@ def extract_proforma(pdf_path):
     # Si no se encontraron items con el patrón, intentar extracción más simple
     if not items:
         # Fallback: buscar línea por línea en la sección de items
-        items_section = re.search(r'Item.*?Descripci[oó]n.*?([\d].+?)(?=SON:|Venta Gravada)', full_text, re.DOTALL | re.IGNORECASE)
+        items_section = _RE_ITEMS_FALLBACK.search(full_text)
         if items_section:
             items.append({
                 "item": 1,
@@ -116,7 +315,7 @@ def extract_proforma(pdf_path):
     elif tipo_servicio == "REEMPLAZO_COMPONENTE":
         # Extraer el componente principal
         primer_item = items[0]['descripcion']
-        componente = re.search(r'COMPRA DE (.+?)(?:PARA|$)', primer_item, re.IGNORECASE)
+        componente = _RE_COMPONENTE.search(primer_item)
         if componente:
             descripcion_servicio = f"Suministro e instalación de {componente.group(1).strip()}"
         else:
@@ -126,18 +325,17 @@ def extract_proforma(pdf_path):
         descripcion_servicio = items[0]['descripcion'][:100] if items else "Servicio técnico especializado"
     
     # ═══ ALCANCE DEL SERVICIO (desde observaciones) ══════════════════════════
-    obs_text = find(full_text, r'Observaciones\s*:\s*(.*?)(?:"SIRVASE|GRACIAS|www\.)', default="")
+    obs_text = campos['obs_text']
     
     alcance_items = []
     actividades = []
     
     for linea in obs_text.split('\n'):
         linea_clean = linea.strip().lstrip('-').strip()
-        excluir = ['COSTO', 'IGV', 'PRECIO', 'INCLUYE IGV', 'S/.', 'OBSERVACIONES:', 'ABONAR']
         
-        if linea_clean and not any(k in linea_clean.upper() for k in excluir) and len(linea_clean) > 10:
+        if linea_clean and not any(k in linea_clean.upper() for k in KW_EXCLUIR) and len(linea_clean) > 10:
             # Limpiar prefijos comunes
-            linea_clean = re.sub(r'^(EL\s+SERVICIO|SE)\s+(REALIZARA?|INCLUYE?)\s+', '', linea_clean, flags=re.IGNORECASE)
+            linea_clean = _RE_PREFIJO.sub('', linea_clean)
             
             # Para actividades (checkboxes)
             if tipo_servicio == "CALIBRACION":
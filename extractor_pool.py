@@ -0,0 +1,182 @@
+"""
+extractor_pool.py - Pool de procesos para la extracción de proformas
+Mantiene intérpretes precalentados (pdfplumber ya importado) y aísla cada
+PDF en un proceso aparte: un PDF que cuelgue o tumbe al extractor no
+afecta al worker de gunicorn.
+
+El tiempo máximo de cada PDF corre dentro del worker desde que el trabajo
+empieza (la espera en cola no cuenta) y solo hace fallar a ese trabajo: el
+pool y los demás trabajos en curso siguen.
+"""
+import os
+import math
+import time
+import signal
+import threading
+import contextlib
+import faulthandler
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import extract_cache
+import metrics
+
+MAX_WORKERS = int(os.environ.get('EXTRACT_WORKERS', 2))
+MAX_PENDING = int(os.environ.get('EXTRACT_MAX_PENDING', MAX_WORKERS * 4))
+TIMEOUT     = float(os.environ.get('EXTRACT_TIMEOUT', 60))
+# Margen tras TIMEOUT antes de terminar un worker trabado en código C
+GRACIA      = float(os.environ.get('EXTRACT_GRACIA', 5))
+
+_lock     = threading.Lock()
+_slots    = threading.BoundedSemaphore(MAX_PENDING)
+_executor = None
+
+
+class ExtractionError(Exception):
+    """El extractor no pudo procesar el PDF"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """El PDF superó el tiempo máximo de extracción"""
+
+
+class ExtractionBusy(ExtractionError):
+    """La cola de extracción está llena"""
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 1)
+
+
+class _Vencido(BaseException):
+    """Dentro del worker: el trabajo en curso superó su tiempo"""
+
+
+_en_limite = False
+
+def _vencer(signum, frame):
+    if _en_limite:
+        raise _Vencido()
+
+
+@contextlib.contextmanager
+def _limite(segundos):
+    """
+    Dentro del worker: SIGALRM interrumpe el trabajo y el proceso sigue
+    sirviendo al pool. Si está trabado en código C que no suelta el
+    intérprete, faulthandler lo termina GRACIA s después
+    """
+    global _en_limite
+    signal.signal(signal.SIGALRM, _vencer)
+    _en_limite = True
+    signal.setitimer(signal.ITIMER_REAL, segundos)
+    faulthandler.dump_traceback_later(segundos + GRACIA, exit=True)
+    try:
+        yield
+    except _Vencido:
+        raise ExtractionTimeout(f'La extracción superó {segundos:.0f} s') from None
+    finally:
+        _en_limite = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        faulthandler.cancel_dump_traceback_later()
+
+
+def _job(pdf, enviado, limite):
+    """Se ejecuta dentro del proceso worker; pdf llega por el pipe del pool"""
+    import extract_proforma
+    inicio = time.time()
+    cpu, _ = metrics.uso_propio()
+    etapas = {}
+    with _limite(limite):
+        data = extract_proforma.extract_proforma(pdf, etapas)
+    cpu_fin, rss = metrics.uso_propio()
+    tiempos = {
+        'spawn': _ms(inicio - enviado),
+        'parse': round(sum(v for k, v in etapas.items() if k.startswith('texto_')), 1),
+        'regex': round(sum(v for k, v in etapas.items() if k.startswith('regex_')), 1),
+        **etapas,
+    }
+    return data, tiempos, (time.time() - inicio, cpu_fin - cpu, rss)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # forkserver: los workers nacen de un proceso limpio con
+            # pdfplumber precargado, no del worker de gunicorn con hilos
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(['extract_proforma'])
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=ctx)
+        return _executor
+
+
+def _descartar(executor):
+    """Elimina un pool roto o con un worker colgado; el siguiente job crea otro"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    # ProcessPoolExecutor no ofrece API pública para matar un worker colgado
+    for proc in list((getattr(executor, '_processes', None) or {}).values()):
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extraer(pdf, timeout=None):
+    """
+    Extrae los datos de una proforma en un proceso del pool. pdf son los
+    bytes subidos (viajan al worker sin pasar por disco) o una ruta. Un PDF
+    ya procesado (mismo contenido, misma versión del extractor) sale de
+    extract_cache sin tocar el pool.
+
+    Returns:
+        (data, tiempos) con los tiempos por etapa en milisegundos
+    """
+    inicio = time.perf_counter()
+    if isinstance(pdf, (bytes, bytearray)):
+        digest = extract_cache.sha256_datos(pdf)
+    else:
+        digest = extract_cache.sha256_archivo(pdf)
+    data   = extract_cache.obtener(digest)
+    if data is not None:
+        return data, {'cache': _ms(time.perf_counter() - inicio)}
+
+    timeout = TIMEOUT if timeout is None else timeout
+    if not _slots.acquire(timeout=timeout):
+        raise ExtractionBusy('Cola de extracción llena, intenta nuevamente')
+    # Último recurso si el worker no responde ni con faulthandler: la espera
+    # máxima en cola (todos los trabajos de adelante vencidos) más el propio
+    espera_max = (timeout + GRACIA) * (1 + math.ceil(MAX_PENDING / MAX_WORKERS))
+    try:
+        for intento in (1, 2):
+            executor = _get_executor()
+            try:
+                future = executor.submit(_job, pdf, time.time(), timeout)
+                data, tiempos, uso = future.result(timeout=espera_max)
+                metrics.observar_subproceso('extractor', *uso)
+                extract_cache.guardar(digest, data)
+                return data, tiempos
+            except FuturesTimeout:
+                _descartar(executor)
+                raise ExtractionTimeout(f'La extracción superó {timeout:.0f} s')
+            except BrokenProcessPool:
+                # Murió un worker de este pool (quizá con el trabajo de otra
+                # solicitud): se reintenta una vez en un pool nuevo
+                _descartar(executor)
+                if intento == 2:
+                    raise ExtractionError('El proceso extractor terminó inesperadamente')
+    finally:
+        _slots.release()
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,187 @@
+"""
+firma_pool.py - Pool de procesos para estampar membrete y firma en lote
+Cada worker parsea los overlays registrados una sola vez (firmar_endpoint
+los cachea por proceso) y estampa certificados completos en paralelo.
+
+El tiempo máximo de cada certificado corre dentro del worker desde que
+empieza y solo hace fallar a ese certificado: el pool sigue sirviendo a los
+demás lotes.
+"""
+import os
+import math
+import time
+import signal
+import hashlib
+import threading
+import contextlib
+import faulthandler
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+MAX_WORKERS = int(os.environ.get('FIRMA_WORKERS', os.cpu_count() or 2))
+TIMEOUT     = float(os.environ.get('FIRMA_TIMEOUT', 60))
+# Margen tras TIMEOUT antes de terminar un worker trabado en código C
+GRACIA      = float(os.environ.get('FIRMA_GRACIA', 5))
+
+_lock     = threading.Lock()
+_executor = None
+
+
+class FirmaError(Exception):
+    """No se pudo estampar el certificado"""
+
+
+class FirmaTimeout(FirmaError):
+    """El certificado superó el tiempo máximo de estampado"""
+
+
+class _Vencido(BaseException):
+    """Dentro del worker: el trabajo en curso superó su tiempo"""
+
+
+_en_limite = False
+
+def _vencer(signum, frame):
+    if _en_limite:
+        raise _Vencido()
+
+
+@contextlib.contextmanager
+def _limite(segundos):
+    """
+    Dentro del worker: SIGALRM interrumpe el trabajo y el proceso sigue
+    sirviendo al pool. Si está trabado en código C que no suelta el
+    intérprete, faulthandler lo termina GRACIA s después
+    """
+    global _en_limite
+    signal.signal(signal.SIGALRM, _vencer)
+    _en_limite = True
+    signal.setitimer(signal.ITIMER_REAL, segundos)
+    faulthandler.dump_traceback_later(segundos + GRACIA, exit=True)
+    try:
+        yield
+    except _Vencido:
+        raise FirmaTimeout(f'Sin respuesta tras {segundos:.0f} s') from None
+    finally:
+        _en_limite = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        faulthandler.cancel_dump_traceback_later()
+
+
+# Overlays subidos como override: se parsean una vez por worker y por contenido
+_subidos = {}
+
+
+def _overlay(valor, tipo):
+    """Dentro del worker: id registrado -> Overlay cacheado; bytes -> Overlay por hash"""
+    import firmar_endpoint
+    if isinstance(valor, str):
+        return firmar_endpoint.get_overlay(valor, tipo)
+    clave = (tipo, hashlib.sha256(valor).hexdigest())
+    if clave not in _subidos:
+        if len(_subidos) >= 8:
+            _subidos.clear()
+        _subidos[clave] = firmar_endpoint.Overlay(valor, tipo)
+    return _subidos[clave]
+
+
+def _job(pdf_bytes, membrete, firma, limite):
+    """Se ejecuta dentro del proceso worker. Devuelve (pdf, (pared, cpu, rss pico))"""
+    import firmar_endpoint
+    inicio = time.perf_counter()
+    cpu, _ = metrics.uso_propio()
+    with _limite(limite):
+        pdf = firmar_endpoint.aplicar_membrete_y_firma(
+            pdf_bytes, _overlay(membrete, 'membrete'), _overlay(firma, 'firma'))
+    cpu_fin, rss = metrics.uso_propio()
+    return pdf, (time.perf_counter() - inicio, cpu_fin - cpu, rss)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(['firmar_endpoint'])
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=ctx)
+        return _executor
+
+
+def _descartar(executor):
+    """Elimina un pool roto o con un worker colgado; el siguiente lote crea otro"""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    for proc in list((getattr(executor, '_processes', None) or {}).values()):
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def firmar_lote(certificados, membrete, firma, timeout=None):
+    """
+    Estampa los certificados en paralelo
+
+    Args:
+        certificados: lista de bytes de PDF
+        membrete, firma: id de asset registrado o bytes de un PDF subido
+        timeout: segundos por certificado, desde que su worker lo empieza
+
+    Yields:
+        (índice, pdf_bytes, None) o (índice, None, FirmaError) en orden de término
+    """
+    if not certificados:
+        return
+    timeout    = TIMEOUT if timeout is None else timeout
+    pendientes = dict(enumerate(certificados))
+    for intento in (1, 2):
+        executor = _get_executor()
+        futuros  = {executor.submit(_job, pdf, membrete, firma, timeout): i for i, pdf in pendientes.items()}
+        # Último recurso si un worker no responde ni con faulthandler
+        espera_max = (timeout + GRACIA) * math.ceil(len(futuros) / MAX_WORKERS + 1)
+        try:
+            for futuro in as_completed(futuros, timeout=espera_max):
+                indice = futuros[futuro]
+                try:
+                    resultado, uso = futuro.result()
+                    error = None
+                    metrics.observar_subproceso('firma', *uso)
+                    metrics.observar_etapa('stamp', uso[0])
+                except BrokenProcessPool:
+                    raise
+                except FirmaError as e:
+                    resultado, error = None, e
+                except Exception as e:
+                    resultado, error = None, FirmaError(str(e))
+                del pendientes[indice]
+                yield indice, resultado, error
+            return
+        except FuturesTimeout:
+            _descartar(executor)
+            for indice in sorted(pendientes):
+                yield indice, None, FirmaTimeout(f'Sin respuesta tras {timeout:.0f} s por certificado')
+            return
+        except BrokenProcessPool:
+            # Murió un worker (quizá con un certificado de otro lote): los
+            # pendientes se reenvían una vez a un pool nuevo
+            _descartar(executor)
+            if intento == 2:
+                for indice in sorted(pendientes):
+                    yield indice, None, FirmaError('El proceso de firma terminó inesperadamente')
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,8 +1,16 @@
 import os
 import io
-from flask import Blueprint, request, jsonify, send_file
+import json
+import time
+import threading
+import zipfile
+from flask import Blueprint, Response, request, jsonify, send_file
 from pypdf import PdfReader, PdfWriter
-from copy import deepcopy
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject, NameObject
+
+import firma_pool
+import zip_stream
+import metrics
 
 firmar_bp = Blueprint('firmar', __name__)
 
@@ -12,61 +20,216 @@ TARGET_W = 180
 FIRMA_X  = (PAGE_W - TARGET_W) / 2
 FIRMA_Y  = 25 + (2 * 72 / 2.54)
 
+# ═══ OVERLAYS REGISTRADOS ════════════════════════════════════════════════════
+# id -> (tipo, archivos candidatos en assets/; se usa el primero que sea un PDF)
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+ASSETS = {
+    'membrete-mmc-2025':       ('membrete', ('MEMBRETE_FINAL_MMC_2025.pdf', 'MEMBRETE FINAL MMC 2025.pdf')),
+    'firma-gabriel-2024-2025': ('firma',    ('FIRMA_GABRIEL_2024-2025.pdf', 'FIRMA GABRIEL 2024-2025.pdf')),
+}
+MEMBRETE_DEFAULT = os.environ.get('FIRMA_MEMBRETE_ID', 'membrete-mmc-2025')
+FIRMA_DEFAULT    = os.environ.get('FIRMA_FIRMA_ID', 'firma-gabriel-2024-2025')
+
+
+class AssetError(Exception):
+    """Overlay desconocido, de otro tipo o con un PDF inválido"""
+
+
+_INVALIDO = {'membrete': 'Membrete inválido', 'firma': 'Firma inválida'}
+
+
+class Overlay:
+    """
+    Página de membrete o firma parseada una sola vez y convertida en un Form
+    XObject. La firma lleva en /Matrix su escala y ubicación, así que se
+    dibuja tal cual sobre la primera página del certificado.
+    """
+
+    def __init__(self, pdf_bytes, tipo):
+        if not pdf_bytes.startswith(b'%PDF'):
+            raise AssetError(f"{_INVALIDO[tipo]}. Header: {pdf_bytes[:20]}")
+        self.tipo = tipo
+        reader = PdfReader(io.BytesIO(pdf_bytes), strict=False)
+        page   = reader.pages[0]
+        self.ancho = float(page.mediabox.width)
+        self.alto  = float(page.mediabox.height)
+        matriz = [1, 0, 0, 1, 0, 0]
+        if tipo == 'firma':
+            target_h = TARGET_W * (self.alto / self.ancho)
+            self.sx  = TARGET_W / self.ancho
+            self.sy  = target_h / self.alto
+            matriz   = [self.sx, 0, 0, self.sy, FIRMA_X, FIRMA_Y]
+
+        contenido = page.get('/Contents')
+        partes = contenido.get_object() if contenido is not None else []
+        if not isinstance(partes, ArrayObject):
+            partes = [partes]
+        stream = DecodedStreamObject()
+        stream.set_data(b'\n'.join(p.get_object().get_data() for p in partes))
+        self.xobject = stream.flate_encode()
+        self.xobject.update({
+            NameObject('/Type'):      NameObject('/XObject'),
+            NameObject('/Subtype'):   NameObject('/Form'),
+            NameObject('/BBox'):      ArrayObject(FloatObject(v) for v in page.cropbox),
+            NameObject('/Matrix'):    ArrayObject(FloatObject(v) for v in matriz),
+            NameObject('/Resources'): page.get('/Resources', DictionaryObject()),
+        })
+        # El vínculo del membrete se replica en cada página, como hacía merge_page
+        annots = page.get('/Annots') if tipo == 'membrete' else None
+        self.annots = list(annots.get_object()) if annots is not None else []
+        # Resuelve todos los objetos ahora: las copias posteriores leen de
+        # la caché del reader y no del stream, así se comparte entre hilos
+        self.incrustar(PdfWriter())
+
+    def incrustar(self, writer):
+        """Copia el XObject y sus recursos al writer. Devuelve (referencia, anotaciones)"""
+        ref = writer._add_object(self.xobject.clone(writer))
+        return ref, [a.clone(writer) for a in self.annots]
+
+
+_lock      = threading.Lock()
+_overlays  = {}   # id -> Overlay
+
+
+def _leer_asset(asset_id):
+    _, archivos = ASSETS[asset_id]
+    for archivo in archivos:
+        ruta = os.path.join(ASSETS_DIR, archivo)
+        if os.path.exists(ruta):
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+            if datos.startswith(b'%PDF'):
+                return datos
+    raise AssetError(f"El asset '{asset_id}' no tiene un PDF válido en {ASSETS_DIR}")
+
+
+def validar_asset(asset_id, tipo):
+    if asset_id not in ASSETS:
+        raise AssetError(f"Asset desconocido: '{asset_id}'")
+    if ASSETS[asset_id][0] != tipo:
+        raise AssetError(f"El asset '{asset_id}' no es de tipo {tipo}")
+    return asset_id
+
+
+def get_overlay(asset_id, tipo):
+    """Overlay registrado, parseado en el primer uso y reutilizado después"""
+    validar_asset(asset_id, tipo)
+    with _lock:
+        overlay = _overlays.get(asset_id)
+        if overlay is None:
+            overlay = _overlays[asset_id] = Overlay(_leer_asset(asset_id), tipo)
+        return overlay
+
+
+def _como_overlay(valor, tipo):
+    return valor if isinstance(valor, Overlay) else Overlay(valor, tipo)
+
+
+def _xobjects(page):
+    """Diccionario /XObject de la página, creándolo si no existe"""
+    recursos = page.get('/Resources')
+    if recursos is None:
+        recursos = page[NameObject('/Resources')] = DictionaryObject()
+    recursos = recursos.get_object()
+    xobjs = recursos.get('/XObject')
+    if xobjs is None:
+        xobjs = recursos[NameObject('/XObject')] = DictionaryObject()
+    return xobjs.get_object()
+
+
+def _registrar(xobjs, nombre, ref):
+    """Agrega ref a /XObject con un nombre que no pise uno del certificado"""
+    base, n = nombre, 1
+    while nombre in xobjs and xobjs.raw_get(nombre) != ref:
+        n += 1
+        nombre = f'{base}{n}'
+    xobjs[NameObject(nombre)] = ref
+    return nombre
 
-def aplicar_membrete_y_firma(pdf_bytes, membrete_bytes, firma_bytes):
-    cert_reader     = PdfReader(io.BytesIO(pdf_bytes),      strict=False)
-    membrete_reader = PdfReader(io.BytesIO(membrete_bytes), strict=False)
-    firma_reader    = PdfReader(io.BytesIO(firma_bytes),    strict=False)
 
-    firma_orig_w = float(firma_reader.pages[0].mediabox.width)
-    firma_orig_h = float(firma_reader.pages[0].mediabox.height)
-    TARGET_H     = TARGET_W * (firma_orig_h / firma_orig_w)
-    sx = TARGET_W / firma_orig_w
-    sy = TARGET_H / firma_orig_h
+def aplicar_membrete_y_firma(pdf_bytes, membrete, firma):
+    """
+    membrete y firma: Overlay registrado o bytes de un PDF subido.
 
-    membrete_page = membrete_reader.pages[0]
-    firma_page    = firma_reader.pages[0]
-    writer        = PdfWriter()
+    Membrete y firma se incrustan una sola vez por documento y cada página
+    los dibuja con `Do`. El contenido del certificado no se parsea ni se
+    reescribe: se envuelve entre dos streams cortos, también compartidos.
+    """
+    membrete = _como_overlay(membrete, 'membrete')
+    firma    = _como_overlay(firma, 'firma')
+    cert_reader = PdfReader(io.BytesIO(pdf_bytes), strict=False)
+    writer      = PdfWriter()
+    ref_membrete, annots_membrete = membrete.incrustar(writer)
+    ref_firma, _ = firma.incrustar(writer)
+    envolturas = {}
+
+    def envoltura(ops):
+        if ops not in envolturas:
+            stream = DecodedStreamObject()
+            stream.set_data(ops.encode('ascii'))
+            envolturas[ops] = writer._add_object(stream)
+        return envolturas[ops]
 
     for i, page in enumerate(cert_reader.pages):
-        nueva = deepcopy(page)
-        nueva.merge_page(deepcopy(membrete_page), expand=False, over=False)
+        nueva = writer.add_page(page)
+        xobjs = _xobjects(nueva)
+        antes   = f"q {_registrar(xobjs, '/MMCMembrete', ref_membrete)} Do Q q\n"
+        despues = '\nQ\n'
         if i == 0:
-            firma = deepcopy(firma_page)
-            firma.add_transformation([sx, 0, 0, sy, FIRMA_X, FIRMA_Y])
-            firma.mediabox.lower_left  = (0, 0)
-            firma.mediabox.upper_right = (PAGE_W, PAGE_H)
-            nueva.merge_page(firma, over=True)
-        writer.add_page(nueva)
+            despues = f"\nQ q {_registrar(xobjs, '/MMCFirma', ref_firma)} Do Q\n"
+
+        contenido = nueva.get('/Contents')
+        if contenido is None:
+            partes = []
+        elif isinstance(contenido.get_object(), ArrayObject):
+            partes = list(contenido.get_object())
+        else:
+            partes = [contenido if isinstance(contenido, IndirectObject) else writer._add_object(contenido)]
+        nueva[NameObject('/Contents')] = ArrayObject([envoltura(antes), *partes, envoltura(despues)])
+
+        if annots_membrete:
+            annots = nueva.get('/Annots')
+            if annots is None:
+                nueva[NameObject('/Annots')] = ArrayObject(annots_membrete)
+            else:
+                annots.get_object().extend(annots_membrete)
 
     out = io.BytesIO()
     writer.write(out)
     return out.getvalue()
 
 
+def _overlay_request(tipo, default_id):
+    """Archivo subido en el campo `tipo` (override) o asset `<tipo>_id` registrado"""
+    subido = request.files.get(tipo)
+    if subido is not None:
+        return Overlay(subido.read(), tipo)
+    return get_overlay(request.form.get(f'{tipo}_id') or default_id, tipo)
+
+
 @firmar_bp.route('/firmar-pdf', methods=['POST'])
 def firmar_pdf():
-    # Recibe: file, membrete, firma — todos como multipart
-    if 'file' not in request.files:
-        return jsonify({"error": "Falta campo 'file'"}), 400
-    if 'membrete' not in request.files:
-        return jsonify({"error": "Falta campo 'membrete'"}), 400
-    if 'firma' not in request.files:
-        return jsonify({"error": "Falta campo 'firma'"}), 400
-
-    pdf_bytes      = request.files['file'].read()
-    membrete_bytes = request.files['membrete'].read()
-    firma_bytes    = request.files['firma'].read()
+    # Recibe: file y, opcionalmente, membrete/firma como multipart o
+    # membrete_id/firma_id de los assets registrados (por defecto los de assets/)
+    with metrics.etapa('upload'):
+        if 'file' not in request.files:
+            return jsonify({"error": "Falta campo 'file'"}), 400
 
+    pdf_bytes = request.files['file'].read()
     if not pdf_bytes.startswith(b'%PDF'):
         return jsonify({"error": f"PDF inválido. Header: {pdf_bytes[:20]}"}), 400
-    if not membrete_bytes.startswith(b'%PDF'):
-        return jsonify({"error": f"Membrete inválido. Header: {membrete_bytes[:20]}"}), 400
-    if not firma_bytes.startswith(b'%PDF'):
-        return jsonify({"error": f"Firma inválida. Header: {firma_bytes[:20]}"}), 400
 
     try:
-        resultado = aplicar_membrete_y_firma(pdf_bytes, membrete_bytes, firma_bytes)
+        membrete = _overlay_request('membrete', MEMBRETE_DEFAULT)
+        firma    = _overlay_request('firma', FIRMA_DEFAULT)
+    except AssetError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Overlay ilegible: {e}"}), 400
+
+    try:
+        with metrics.etapa('stamp'):
+            resultado = aplicar_membrete_y_firma(pdf_bytes, membrete, firma)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -76,3 +239,113 @@ def firmar_pdf():
         as_attachment=True,
         download_name=request.files['file'].filename or "firmado.pdf"
     )
+
+
+# ═══ FIRMA EN LOTE ═══════════════════════════════════════════════════════════
+def _certificados_lote():
+    """
+    PDFs del formulario, sueltos (campo file, repetible) o dentro de ZIPs.
+    Devuelve [(nombre, bytes)]; el total respeta los topes de zip_stream
+    """
+    certificados, total = [], 0
+    for f in request.files.getlist('file') + request.files.getlist('zip'):
+        nombre = os.path.basename(f.filename or '')
+        datos  = f.read()
+        if nombre.lower().endswith('.zip'):
+            nuevos = zip_stream.leer_entradas(datos, '.pdf',
+                                              max_bytes=zip_stream.LOTE_MAX_BYTES - total,
+                                              max_entradas=zip_stream.LOTE_MAX_ENTRADAS - len(certificados))
+        else:
+            nuevos = [(nombre or 'certificado.pdf', datos)]
+        certificados.extend(nuevos)
+        total += sum(len(d) for _, d in nuevos)
+        if len(certificados) > zip_stream.LOTE_MAX_ENTRADAS:
+            raise zip_stream.LoteExcedido(f'El lote supera {zip_stream.LOTE_MAX_ENTRADAS} archivos')
+    return certificados
+
+
+def _overlay_lote(tipo, default_id):
+    """Para el pool: bytes del override subido o id del asset registrado"""
+    subido = request.files.get(tipo)
+    if subido is not None:
+        datos = subido.read()
+        if not datos.startswith(b'%PDF'):
+            raise AssetError(f"{_INVALIDO[tipo]}. Header: {datos[:20]}")
+        return datos
+    return validar_asset(request.form.get(f'{tipo}_id') or default_id, tipo)
+
+
+def _nombre_unico(nombre, usados):
+    base, ext = os.path.splitext(nombre)
+    candidato, n = nombre, 1
+    while candidato in usados:
+        n += 1
+        candidato = f'{base} ({n}){ext}'
+    usados.add(candidato)
+    return candidato
+
+
+@firmar_bp.route('/firmar-lote', methods=['POST'])
+def firmar_lote():
+    """
+    Estampa membrete y firma en muchos certificados (campo file repetible o
+    zip) con el pool de procesos. Responde un ZIP en streaming con
+    firmados/<nombre> y manifiesto.json (estado por archivo, en orden de envío)
+    """
+    try:
+        with metrics.etapa('upload'):
+            certificados = _certificados_lote()
+    except zip_stream.LoteExcedido as e:
+        return jsonify({"error": str(e)}), 413
+    except zipfile.BadZipFile:
+        return jsonify({"error": "El ZIP subido no es válido"}), 400
+    if not certificados:
+        return jsonify({"error": "Debes subir uno o más PDFs (campo 'file') o un ZIP (campo 'zip')"}), 400
+    try:
+        membrete = _overlay_lote('membrete', MEMBRETE_DEFAULT)
+        firma    = _overlay_lote('firma', FIRMA_DEFAULT)
+    except AssetError as e:
+        return jsonify({"error": str(e)}), 400
+
+    manifiesto = [{'indice': i, 'archivo': nombre} for i, (nombre, _) in enumerate(certificados)]
+    validos = []
+    for item, (_, datos) in zip(manifiesto, certificados):
+        if datos.startswith(b'%PDF'):
+            validos.append(item['indice'])
+        else:
+            item.update(estado='error', error=f"PDF inválido. Header: {datos[:20]}")
+
+    def generar():
+        zs, usados = zip_stream.ZipStream(), set()
+        try:
+            for j, resultado, error in firma_pool.firmar_lote([certificados[i][1] for i in validos], membrete, firma):
+                item = manifiesto[validos[j]]
+                if error is not None:
+                    item.update(estado='error', error=str(error))
+                    continue
+                item.update(estado='ok', salida=f"firmados/{_nombre_unico(item['archivo'], usados)}")
+                yield zs.agregar(item['salida'], resultado)
+        finally:
+            for item in manifiesto:
+                if 'estado' not in item:
+                    item.update(estado='error', error='Lote interrumpido')
+        resumen = {
+            'total': len(manifiesto),
+            'ok': sum(1 for m in manifiesto if m['estado'] == 'ok'),
+            'errores': sum(1 for m in manifiesto if m['estado'] == 'error'),
+            'archivos': manifiesto,
+        }
+        yield zs.agregar('manifiesto.json', json.dumps(resumen, ensure_ascii=False, indent=2))
+        yield zs.cerrar()
+
+    nombre_zip = f"certificados_firmados_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(generar(), mimetype='application/zip', headers={'Content-Disposition': f'attachment; filename={nombre_zip}'})
+
+
+@firmar_bp.route('/firmar-pdf/assets')
+def listar_assets():
+    return jsonify({
+        'membrete_default': MEMBRETE_DEFAULT,
+        'firma_default': FIRMA_DEFAULT,
+        'assets': [{'id': asset_id, 'tipo': tipo} for asset_id, (tipo, _) in ASSETS.items()],
+    })
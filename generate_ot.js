@@ -112,10 +112,21 @@ function cell(content, {
 }
 
 // ═══ GENERADOR DE NÚMERO CORRELATIVO ═════════════════════════════════════════
-function generateOTNumber(proforma_num, fecha_emision) {
+// El servidor asigna ot_number/expediente desde el correlativo de la base de
+// auditoría; el número por timestamp queda solo para el uso por línea de comandos.
+function generateOTNumber(data) {
+  const fecha_emision = data.fecha_emision;
   // Extraer año de la fecha de emisión
   const year = fecha_emision ? fecha_emision.split('/')[2] : new Date().getFullYear();
   
+  if (data.ot_number) {
+    return {
+      ot_number: data.ot_number,
+      expediente: data.expediente || `${Date.now()}`,
+      codigo_doc: `RTL-01/Ed02-${year}/LAB`
+    };
+  }
+  
   // Generar número correlativo basado en timestamp para unicidad
   const timestamp = Date.now();
   const seq = String(timestamp).slice(-4);
@@ -927,6 +938,15 @@ function buildFooter(otInfo) {
   });
 }
 
+// ═══ SECCIONES ESTÁTICAS ══════════════════════════════════════════════════════
+// No dependen de la proforma: se construyen una sola vez por proceso y se
+// reutilizan en cada documento (relevante en modo --serve)
+const _estaticas = {};
+function estatica(builder) {
+  if (!_estaticas[builder.name]) _estaticas[builder.name] = builder();
+  return _estaticas[builder.name];
+}
+
 // ═══ GENERADOR PRINCIPAL ═════════════════════════════════════════════════════
 function generateOT(data) {
   if (!data.aprobada) {
@@ -934,7 +954,7 @@ function generateOT(data) {
     process.exit(0);
   }
   
-  const otInfo = generateOTNumber(data.numero_proforma, data.fecha_emision);
+  const otInfo = generateOTNumber(data);
   
   const doc = new Document({
     styles: {
@@ -958,17 +978,17 @@ function generateOT(data) {
         para(" ", { spacing: { before: 240 } }),
         buildSeccion1_InfoComercial(data, otInfo),
         para(" ", { spacing: { before: 240 } }),
-        buildSeccion1_5_Observaciones(),
+        estatica(buildSeccion1_5_Observaciones),
         para(" ", { spacing: { before: 240 } }),
         buildSeccion2_Servicio(data),
         para(" ", { spacing: { before: 240 } }),
-        buildSeccion3_Areas(),
+        estatica(buildSeccion3_Areas),
         para(" ", { spacing: { before: 240 } }),
         buildSeccion4_Actividades(data),
         para(" ", { spacing: { before: 240 } }),
         buildSeccion5_RequisitosISO(data),
         para(" ", { spacing: { before: 240 } }),
-        buildSeccion6_Firmas(),
+        estatica(buildSeccion6_Firmas),
         para(" ", { spacing: { before: 200 } }),
         buildFooter(otInfo)
       ]
@@ -978,11 +998,44 @@ function generateOT(data) {
   return { doc, ot_num: otInfo.ot_number };
 }
 
+// ═══ MODO SERVIDOR (NDJSON por stdin/stdout) ══════════════════════════════════
+// Proceso persistente usado por ot_renderer.py. Una petición por línea:
+//   entrada: {"id": 1, "data": {...}}
+//   salida:  {"id": 1, "ok": true, "ot_num": "OT-2026-0001", "docx": "<base64>"}
+//            {"id": 1, "ok": false, "error": "..."}
+async function serve() {
+  const readline = require('readline');
+  const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+  const responder = msg => process.stdout.write(JSON.stringify(msg) + '\n');
+
+  // Precalentar las secciones estáticas antes de la primera petición
+  [buildSeccion1_5_Observaciones, buildSeccion3_Areas, buildSeccion6_Firmas].forEach(estatica);
+
+  for await (const line of rl) {
+    if (!line.trim()) continue;
+    let id = null;
+    try {
+      const req = JSON.parse(line);
+      id = req.id;
+      if (!req.data || !req.data.aprobada) {
+        throw new Error("Proforma no aprobada. No se genera OT.");
+      }
+      const { doc, ot_num } = generateOT(req.data);
+      const buffer = await Packer.toBuffer(doc);
+      responder({ id, ok: true, ot_num, docx: buffer.toString('base64') });
+    } catch (e) {
+      responder({ id, ok: false, error: String((e && e.message) || e) });
+    }
+  }
+}
+
 // ═══ MAIN ═════════════════════════════════════════════════════════════════════
 async function main() {
   let data;
   
-  if (process.argv.includes('--stdin')) {
+  if (process.argv.includes('--serve')) {
+    return serve();
+  } else if (process.argv.includes('--stdin')) {
     const chunks = [];
     process.stdin.on('data', c => chunks.push(c));
     await new Promise(r => process.stdin.on('end', r));
@@ -994,7 +1047,7 @@ async function main() {
   } else if (process.argv[2] && process.argv[2].startsWith('{')) {
     data = JSON.parse(process.argv[2]);
   } else {
-    console.error("Uso: node generate_ot.js '<json>' | --file data.json | --stdin");
+    console.error("Uso: node generate_ot.js '<json>' | --file data.json | --stdin | --serve");
     process.exit(1);
   }
   
@@ -0,0 +1,137 @@
+"""
+jobs.py - Trabajos en segundo plano con seguimiento de progreso
+Ejecuta el procesamiento de proformas fuera del request HTTP en un executor
+acotado. Cada trabajo acumula sus eventos de progreso para consultarlos por
+polling o como Server-Sent Events. El registro vive en memoria del proceso.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+MAX_QUEUE   = int(os.environ.get('JOB_MAX_QUEUE', 16))
+TTL         = float(os.environ.get('JOB_TTL', 3600))
+
+
+class QueueFull(Exception):
+    """No hay capacidad para aceptar más trabajos"""
+
+
+class Job:
+    def __init__(self):
+        self.id        = uuid.uuid4().hex
+        self.creado    = time.time()
+        self.etapa     = 'queued'
+        self.eventos   = []
+        self.resultado = None
+        self.status    = None
+        self.terminado = False
+        self.fin       = None
+        self._cond     = threading.Condition()
+
+    def emitir(self, etapa, datos=None, final=False):
+        with self._cond:
+            self.etapa = etapa
+            self.eventos.append({'etapa': etapa, 'datos': datos or {}, 't': time.time()})
+            if final:
+                self.terminado = True
+                self.fin = time.time()
+            self._cond.notify_all()
+
+    def terminar(self, resultado, status=200):
+        self.resultado, self.status = resultado, status
+
+    def esperar_eventos(self, desde, timeout):
+        """Devuelve los eventos a partir del índice `desde`, esperando hasta `timeout`"""
+        with self._cond:
+            if len(self.eventos) <= desde and not self.terminado:
+                self._cond.wait(timeout)
+            return self.eventos[desde:], self.terminado
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                'id': self.id,
+                'etapa': self.etapa,
+                'terminado': self.terminado,
+                'resultado': self.resultado,
+                'status': self.status,
+                'eventos': [e['etapa'] for e in self.eventos],
+            }
+
+
+_lock     = threading.Lock()
+_slots    = threading.BoundedSemaphore(MAX_QUEUE)
+_jobs     = {}
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='job')
+        return _executor
+
+
+def _purgar():
+    limite = time.time() - TTL
+    with _lock:
+        for job_id in [j.id for j in _jobs.values() if j.terminado and j.fin < limite]:
+            del _jobs[job_id]
+
+
+def _ejecutar(job, fn, args):
+    try:
+        fn(job, *args)
+    except Exception as e:
+        job.terminar({'error': str(e)}, 500)
+        job.emitir('error', {'error': str(e)}, final=True)
+    finally:
+        _slots.release()
+
+
+def enviar(fn, *args):
+    """
+    Encola fn(job, *args). fn informa su avance con job.emitir(...), fija el
+    resultado con job.terminar(...) y es responsable de emitir el evento final
+    (puede hacerlo más tarde desde un callback)
+
+    Raises:
+        QueueFull si ya hay MAX_QUEUE trabajos pendientes o en curso
+    """
+    if not _slots.acquire(blocking=False):
+        raise QueueFull('Demasiados trabajos en curso, intenta nuevamente')
+    _purgar()
+    job = Job()
+    with _lock:
+        _jobs[job.id] = job
+    job.emitir('queued')
+    try:
+        _get_executor().submit(_ejecutar, job, fn, args)
+    except Exception:
+        _slots.release()
+        raise
+    return job
+
+
+def obtener(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def stream_sse(job, desde=0, keepalive=15):
+    """Generador de Server-Sent Events con los eventos del trabajo"""
+    while True:
+        eventos, terminado = job.esperar_eventos(desde, keepalive)
+        if not eventos and not terminado:
+            yield ': keepalive\n\n'
+            continue
+        for ev in eventos:
+            yield f"id: {desde}\nevent: {ev['etapa']}\ndata: {json.dumps(ev['datos'], ensure_ascii=False)}\n\n"
+            desde += 1
+        if terminado and desde >= len(job.eventos):
+            return
@@ -0,0 +1,322 @@
+"""
+metrics.py - Trazas por solicitud, métricas Prometheus y logs JSON
+Cada solicitud recibe un id (el X-Request-ID entrante si es válido) que se
+devuelve en la respuesta y acompaña a todas las líneas de log que se emitan
+mientras se atiende. Las etapas (upload, extract, render, audit, convert,
+stamp...) y los subprocesos (tiempo de pared, CPU y RSS pico) se acumulan en
+la traza de la solicitud y en histogramas que /metrics expone en el formato de
+texto de Prometheus.
+
+Uso:
+    with metrics.etapa('render'):
+        ...
+    metrics.observar_subproceso('soffice', pared_s, cpu_s, rss_pico_bytes)
+    metrics.log('mensaje', clave=valor)
+"""
+import os
+import re
+import json
+import time
+import uuid
+import bisect
+import logging
+import resource
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+PREFIJO   = 'metromecanica'
+# Segundos: desde una descarga servida de caché hasta una conversión LibreOffice lenta
+BUCKETS   = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_RE_REQUEST_ID = re.compile(r'[\w.:-]{1,64}$')
+_CLK_TCK       = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+_lock     = threading.Lock()
+_registro = []
+_traza    = contextvars.ContextVar('traza', default=None)
+
+
+# ═══ LOGS JSON ═══════════════════════════════════════════════════════════════
+
+class _FormatoJSON(logging.Formatter):
+    def format(self, record):
+        evento = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname.lower(),
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+        }
+        traza = _traza.get()
+        if traza is not None:
+            evento['request_id'] = traza.id
+        evento.update(getattr(record, 'datos', {}))
+        if record.exc_info:
+            evento['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger('metromecanica')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(_FormatoJSON())
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def log(mensaje, nivel=logging.INFO, **datos):
+    """Línea JSON con el request_id de la solicitud en curso y los campos dados"""
+    logger.log(nivel, mensaje, extra={'datos': datos})
+
+
+# ═══ HISTOGRAMAS Y MÁXIMOS ═══════════════════════════════════════════════════
+
+def _etiquetas(nombres, valores):
+    escapar = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{n}="{escapar(v)}"' for n, v in zip(nombres, valores))
+
+
+class Histograma:
+    """Histograma Prometheus con una serie por combinación de etiquetas"""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre, self.ayuda = f'{PREFIJO}_{nombre}', ayuda
+        self.etiquetas = etiquetas
+        self.buckets   = tuple(buckets)
+        self._series   = {}   # valores -> [conteo por bucket..., fuera de rango, suma]
+        _registro.append(self)
+
+    def observar(self, valor, *valores):
+        with _lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.buckets) + 1) + [0.0]
+            serie[bisect.bisect_left(self.buckets, valor)] += 1
+            serie[-1] += valor
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with _lock:
+            series = sorted((v, list(s)) for v, s in self._series.items())
+        for valores, serie in series:
+            base = _etiquetas(self.etiquetas, valores)
+            sep  = ',' if base else ''
+            acumulado = 0
+            for le, conteo in zip(self.buckets + ('+Inf',), serie):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{base}{sep}le="{le}"}} {acumulado}')
+            lineas.append(f'{self.nombre}_sum{{{base}}} {serie[-1]:.6f}')
+            lineas.append(f'{self.nombre}_count{{{base}}} {acumulado}')
+        return lineas
+
+
+class Maximo:
+    """Gauge con el mayor valor observado por combinación de etiquetas"""
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda = f'{PREFIJO}_{nombre}', ayuda
+        self.etiquetas = etiquetas
+        self._series   = {}
+        _registro.append(self)
+
+    def observar(self, valor, *valores):
+        with _lock:
+            if valor > self._series.get(valores, float('-inf')):
+                self._series[valores] = valor
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} gauge']
+        with _lock:
+            series = sorted(self._series.items())
+        for valores, valor in series:
+            lineas.append(f'{self.nombre}{{{_etiquetas(self.etiquetas, valores)}}} {valor}')
+        return lineas
+
+
+HTTP      = Histograma('http_request_duration_seconds', 'Duración de las solicitudes HTTP por ruta', ('ruta', 'metodo', 'estado'))
+ETAPAS    = Histograma('stage_duration_seconds', 'Duración de cada etapa del procesamiento', ('etapa',))
+SUB_PARED = Histograma('subprocess_wall_seconds', 'Tiempo de pared por trabajo de subproceso', ('programa',))
+SUB_CPU   = Histograma('subprocess_cpu_seconds', 'Tiempo de CPU (usuario + sistema) por trabajo de subproceso', ('programa',))
+SUB_RSS   = Maximo('subprocess_peak_rss_bytes', 'RSS pico observado en los subprocesos', ('programa',))
+
+
+# ═══ TRAZA DE LA SOLICITUD ═══════════════════════════════════════════════════
+
+class Traza:
+    """Tiempos acumulados de una solicitud; los hilos a los que se propaga suman aquí"""
+
+    def __init__(self, request_id):
+        self.id     = request_id
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.subprocesos = {}
+        self._lock  = threading.Lock()
+
+    def sumar_etapa(self, nombre, segundos):
+        with self._lock:
+            self.etapas[nombre] = round(self.etapas.get(nombre, 0) + segundos * 1000, 1)
+
+    def sumar_subproceso(self, programa, pared, cpu, rss):
+        with self._lock:
+            s = self.subprocesos.setdefault(programa, {'trabajos': 0, 'pared_ms': 0.0, 'cpu_ms': 0.0})
+            s['trabajos'] += 1
+            s['pared_ms']  = round(s['pared_ms'] + pared * 1000, 1)
+            if cpu is not None:
+                s['cpu_ms'] = round(s['cpu_ms'] + cpu * 1000, 1)
+            if rss is not None:
+                s['rss_pico_mb'] = max(s.get('rss_pico_mb', 0), round(rss / 2**20, 1))
+
+    def resumen(self):
+        with self._lock:
+            return {'etapas_ms': dict(self.etapas), 'subprocesos': {k: dict(v) for k, v in self.subprocesos.items()}}
+
+
+def traza_actual():
+    return _traza.get()
+
+
+def observar_etapa(nombre, segundos):
+    ETAPAS.observar(segundos, nombre)
+    traza = _traza.get()
+    if traza is not None:
+        traza.sumar_etapa(nombre, segundos)
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide el bloque como etapa `nombre` (también si termina con una excepción)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar_etapa(nombre, time.perf_counter() - inicio)
+
+
+def observar_subproceso(programa, pared, cpu=None, rss_pico=None):
+    """Registra un trabajo hecho por un subproceso (segundos y bytes; None si no se pudo medir)"""
+    SUB_PARED.observar(pared, programa)
+    if cpu is not None:
+        SUB_CPU.observar(cpu, programa)
+    if rss_pico is not None:
+        SUB_RSS.observar(rss_pico, programa)
+    traza = _traza.get()
+    if traza is not None:
+        traza.sumar_subproceso(programa, pared, cpu, rss_pico)
+
+
+def uso_proceso(pid):
+    """
+    (segundos de CPU acumulados, RSS pico en bytes) de un proceso vivo, leídos
+    de /proc. (None, None) si no se puede (otro sistema o el proceso terminó).
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            campos = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(campos[11]) + int(campos[12])) / _CLK_TCK
+        with open(f'/proc/{pid}/status') as f:
+            hwm = next((l for l in f if l.startswith('VmHWM:')), None)
+        return cpu, int(hwm.split()[1]) * 1024 if hwm else None
+    except (OSError, ValueError, IndexError):
+        return None, None
+
+
+def uso_propio():
+    """(segundos de CPU, RSS pico en bytes) del proceso actual; para workers de pools"""
+    return time.process_time(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def propagar(fn):
+    """fn ligada a una copia del contexto actual, para ejecutarla en otro hilo"""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+# ═══ FLASK ═══════════════════════════════════════════════════════════════════
+
+def exponer():
+    """Todas las métricas en el formato de texto de Prometheus"""
+    lineas = []
+    for metrica in list(_registro):
+        lineas.extend(metrica.exponer())
+    propio = resource.getrusage(resource.RUSAGE_SELF)
+    hijos  = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for nombre, ayuda, tipo, valor in (
+        ('process_cpu_seconds_total', 'CPU usada por el proceso del servidor', 'counter', propio.ru_utime + propio.ru_stime),
+        ('process_peak_rss_bytes', 'RSS pico del proceso del servidor', 'gauge', propio.ru_maxrss * 1024),
+        ('children_cpu_seconds_total', 'CPU de los subprocesos ya terminados', 'counter', hijos.ru_utime + hijos.ru_stime),
+        ('children_peak_rss_bytes', 'RSS pico del mayor subproceso ya terminado', 'gauge', hijos.ru_maxrss * 1024),
+    ):
+        lineas += [f'# HELP {PREFIJO}_{nombre} {ayuda}', f'# TYPE {PREFIJO}_{nombre} {tipo}', f'{PREFIJO}_{nombre} {valor}']
+    return '\n'.join(lineas) + '\n'
+
+
+def _iterar_con_traza(iterable, traza):
+    """Recorre una respuesta en streaming con la traza activa (el contexto de Flask ya se cerró)"""
+    iterador = iter(iterable)
+    fin = object()
+    try:
+        while True:
+            token = _traza.set(traza)
+            try:
+                parte = next(iterador, fin)
+            finally:
+                _traza.reset(token)
+            if parte is fin:
+                return
+            yield parte
+    finally:
+        cerrar = getattr(iterador, 'close', None)
+        if cerrar is not None:
+            token = _traza.set(traza)
+            try:
+                cerrar()
+            finally:
+                _traza.reset(token)
+
+
+def instrumentar(app):
+    """Traza cada solicitud de la app (blueprints incluidos) y registra /metrics"""
+    from flask import request, Response
+
+    @app.before_request
+    def _iniciar_traza():
+        entrante = request.headers.get('X-Request-ID', '')
+        _traza.set(Traza(entrante if _RE_REQUEST_ID.match(entrante) else uuid.uuid4().hex))
+
+    @app.after_request
+    def _cerrar_traza(response):
+        traza = _traza.get()
+        if traza is None:
+            return response
+        response.headers['X-Request-ID'] = traza.id
+        ruta   = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        datos  = {'metodo': request.method, 'ruta': ruta, 'path': request.path, 'estado': response.status_code}
+        def _fin():
+            duracion = time.perf_counter() - traza.inicio
+            HTTP.observar(duracion, ruta, datos['metodo'], str(datos['estado']))
+            if ruta != '/metrics':
+                token = _traza.set(traza)
+                try:
+                    log('solicitud', ms=round(duracion * 1000, 1), **datos, **traza.resumen(),
+                        rss_pico_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))
+                finally:
+                    _traza.reset(token)
+        if response.is_streamed and not response.direct_passthrough:
+            # ZIP, CSV y SSE generados al vuelo: se mide y se registra al cerrar la respuesta
+            response.response = _iterar_con_traza(response.response, traza)
+            response.call_on_close(_fin)
+        else:
+            _fin()
+        return response
+
+    @app.teardown_request
+    def _soltar_traza(_error=None):
+        # Los hilos de gunicorn se reutilizan: la traza no debe pasar a la siguiente solicitud
+        _traza.set(None)
+
+    @app.route('/metrics')
+    def metricas_prometheus():
+        return Response(exponer(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,345 @@
+"""
+office_converter.py - Pool de instancias LibreOffice para conversión a PDF
+Cada instancia usa su propio perfil (-env:UserInstallation) para que dos
+conversiones simultáneas no compitan por el perfil por defecto.
+
+Si el módulo `uno` está disponible (paquete python3-uno) cada instancia es
+un soffice residente que recibe los documentos por UNO; si no, cada trabajo
+lanza `soffice --convert-to` reutilizando el perfil ya inicializado del slot.
+Las instancias se reciclan tras LO_MAX_CONVERSIONS trabajos o si se cuelgan,
+y el soffice residente se reinicia si el trabajo pide otro entorno (locale).
+En modo CLI cada soffice se recoge con wait4: su tiempo de CPU y RSS pico van
+a metrics junto con el tiempo de pared.
+"""
+import os
+import time
+import queue
+import logging
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+
+import metrics
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    UNO_AVAILABLE = True
+except ImportError:
+    UNO_AVAILABLE = False
+
+POOL_SIZE       = int(os.environ.get('LO_INSTANCES', 2))
+MAX_CONVERSIONS = int(os.environ.get('LO_MAX_CONVERSIONS', 50))
+TIMEOUT         = float(os.environ.get('LO_TIMEOUT', 90))
+QUEUE_TIMEOUT   = float(os.environ.get('LO_QUEUE_TIMEOUT', 60))
+STARTUP_TIMEOUT = float(os.environ.get('LO_STARTUP_TIMEOUT', 30))
+PROFILE_ROOT    = os.environ.get('LO_PROFILE_ROOT', os.path.join(tempfile.gettempdir(), 'mmc_lo_profiles'))
+SOFFICE         = shutil.which('soffice') or shutil.which('libreoffice') or 'soffice'
+
+
+class ConversionError(Exception):
+    """LibreOffice no pudo convertir el documento"""
+
+
+class ConversionTimeout(ConversionError):
+    """La conversión superó el tiempo máximo"""
+
+
+class ConversionBusy(ConversionError):
+    """No hubo una instancia libre dentro del tiempo de espera"""
+
+
+def _opciones_cli(filter_name, filter_options):
+    if not filter_name:
+        return 'pdf'
+    opciones = ','.join(
+        f"{k}={str(v).lower() if isinstance(v, bool) else v}"
+        for k, v in (filter_options or {}).items()
+    )
+    return f'pdf:{filter_name}:{opciones}' if opciones else f'pdf:{filter_name}'
+
+
+def _prop(nombre, valor):
+    p = PropertyValue()
+    p.Name, p.Value = nombre, valor
+    return p
+
+
+class Instancia:
+    """Un slot del pool: perfil propio y, con UNO, un soffice residente"""
+
+    def __init__(self, idx):
+        self.idx         = idx
+        self.perfil      = os.path.join(PROFILE_ROOT, f'{os.getpid()}_{idx}')
+        self.pipe_name   = f'mmc_lo_{os.getpid()}_{idx}'
+        self.proc        = None
+        self.desktop     = None
+        self.entorno     = None    # entorno con el que arrancó el soffice residente
+        self.conversiones = 0
+        # proc/desktop los cambia el hilo del trabajo; el watchdog solo mata el grupo
+        self._lock       = threading.Lock()
+        self._vencido    = threading.Event()
+
+    def _args_base(self):
+        return [
+            SOFFICE, '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation=file://{self.perfil}',
+        ]
+
+    def _popen(self, cmd, env, stderr=subprocess.PIPE):
+        # Sesión propia: al matar el grupo caen oosplash y soffice.bin
+        return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr,
+                                env=env, start_new_session=True)
+
+    def _matar_grupo(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            proc.kill()
+
+    def _matar(self, proc):
+        if proc is not None and proc.poll() is None:
+            self._matar_grupo(proc)
+            proc.wait()
+
+    def _vencer(self):
+        """Watchdog: marca el trabajo como vencido y mata el soffice actual, sin tocar el estado"""
+        with self._lock:
+            self._vencido.set()
+            proc = self.proc
+        if proc is not None and proc.poll() is None:
+            self._matar_grupo(proc)
+
+    def reciclar(self, borrar_perfil=False):
+        with self._lock:
+            proc, self.proc, self.desktop, self.entorno = self.proc, None, None, None
+        self._matar(proc)
+        self.conversiones = 0
+        if borrar_perfil:
+            shutil.rmtree(self.perfil, ignore_errors=True)
+
+    # ── Modo residente (UNO) ────────────────────────────────────────────────
+    def _arrancar(self, env):
+        os.makedirs(self.perfil, exist_ok=True)
+        cmd = self._args_base() + [f'--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext']
+        with self._lock:
+            self.proc, self.entorno = self._popen(cmd, env), _huella(env)
+            if self._vencido.is_set():
+                self._matar_grupo(self.proc)
+        local    = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        limite   = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f'uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext')
+                break
+            except Exception:
+                if self.proc is None or self.proc.poll() is not None or time.monotonic() > limite:
+                    self.reciclar(borrar_perfil=True)
+                    raise ConversionError('No se pudo iniciar LibreOffice')
+                time.sleep(0.25)
+        desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+        with self._lock:
+            self.desktop = desktop
+
+    def _convertir_uno(self, src, dst, filter_name, filter_options, infilter, env):
+        # El entorno (LANG/LC_NUMERIC: coma decimal del certificado) solo
+        # rige al arrancar: si este trabajo pide otro, se reinicia la instancia
+        if self.proc is not None and self.proc.poll() is None and self.entorno != _huella(env):
+            self.reciclar()
+            _sumar(reinicios_por_entorno=1)
+        if self.proc is None or self.proc.poll() is not None:
+            self.reciclar()
+            self._arrancar(env)
+        carga = [_prop('Hidden', True)]
+        if infilter:
+            carga.append(_prop('FilterName', infilter))
+        doc = self.desktop.loadComponentFromURL(uno.systemPathToFileUrl(src), '_blank', 0, tuple(carga))
+        if doc is None:
+            raise ConversionError('LibreOffice no pudo abrir el documento')
+        try:
+            filtro = filter_name or ('calc_pdf_Export' if doc.supportsService('com.sun.star.sheet.SpreadsheetDocument') else 'writer_pdf_Export')
+            datos  = tuple(_prop(k, v) for k, v in (filter_options or {}).items())
+            salida = [_prop('FilterName', filtro)]
+            if datos:
+                salida.append(_prop('FilterData', uno.Any('[]com.sun.star.beans.PropertyValue', datos)))
+            doc.storeToURL(uno.systemPathToFileUrl(dst), tuple(salida))
+        finally:
+            doc.close(True)
+
+    # ── Modo por trabajo (CLI) ──────────────────────────────────────────────
+    def _convertir_cli(self, src, outdir, filter_name, filter_options, infilter, env, timeout):
+        os.makedirs(self.perfil, exist_ok=True)
+        cmd = self._args_base()
+        if infilter:
+            cmd.append(f'--infilter={infilter}')
+        cmd += ['--convert-to', _opciones_cli(filter_name, filter_options), '--outdir', outdir, src]
+        with tempfile.TemporaryFile() as errores:
+            proc   = self._popen(cmd, env, stderr=errores)
+            inicio = time.monotonic()
+            vencido  = threading.Event()
+            watchdog = threading.Timer(timeout, lambda: (vencido.set(), self._matar_grupo(proc)))
+            watchdog.start()
+            try:
+                # wait4 en lugar de communicate: devuelve el rusage de este soffice.
+                # Su ru_maxrss parte del RSS de este proceso (vfork + exec), así
+                # que el pico informado es una cota superior
+                _, estado, uso = os.wait4(proc.pid, 0)
+            finally:
+                watchdog.cancel()
+            proc.returncode = os.waitstatus_to_exitcode(estado)
+            metrics.observar_subproceso('soffice', time.monotonic() - inicio,
+                                        uso.ru_utime + uso.ru_stime, uso.ru_maxrss * 1024)
+            if vencido.is_set():
+                raise subprocess.TimeoutExpired(SOFFICE, timeout)
+            errores.seek(0)
+            stderr = errores.read().decode('utf-8', 'replace').strip()
+        if stderr:
+            metrics.log('salida de LibreOffice', logging.DEBUG if proc.returncode == 0 else logging.WARNING,
+                        programa='soffice', codigo=proc.returncode, stderr=stderr[-2000:])
+        if proc.returncode != 0:
+            raise ConversionError(stderr or f'soffice devolvió {proc.returncode}')
+
+    def convertir(self, src, outdir, filter_name, filter_options, infilter, env, timeout):
+        dst = os.path.join(outdir, os.path.splitext(os.path.basename(src))[0] + '.pdf')
+        if UNO_AVAILABLE:
+            # El watchdog mata soffice; la llamada UNO bloqueada falla enseguida
+            # y este hilo recicla la instancia
+            self._vencido.clear()
+            watchdog = threading.Timer(timeout, self._vencer)
+            watchdog.start()
+            try:
+                self._convertir_uno(src, dst, filter_name, filter_options, infilter, env)
+            except Exception as e:
+                if self._vencido.is_set():
+                    raise subprocess.TimeoutExpired(SOFFICE, timeout)
+                if isinstance(e, ConversionError):
+                    raise
+                self.reciclar()
+                raise ConversionError(str(e))
+            finally:
+                watchdog.cancel()
+        else:
+            self._convertir_cli(src, outdir, filter_name, filter_options, infilter, env, timeout)
+        self.conversiones += 1
+        if MAX_CONVERSIONS and self.conversiones >= MAX_CONVERSIONS:
+            self.reciclar()
+        if not os.path.exists(dst):
+            raise ConversionError('PDF no generado')
+        return dst
+
+
+def _huella(env):
+    return hash(frozenset(env.items()))
+
+
+# ═══ POOL Y MÉTRICAS ═════════════════════════════════════════════════════════
+_lock = threading.Lock()
+_pool = None
+_metricas = {
+    'en_cola': 0,
+    'en_proceso': 0,
+    'conversiones': 0,
+    'errores': 0,
+    'timeouts': 0,
+    'reciclajes_por_cuelgue': 0,
+    'reinicios_por_entorno': 0,
+    'tiempo_total_s': 0.0,
+    'tiempo_max_s': 0.0,
+    'espera_total_s': 0.0,
+}
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = queue.Queue()
+            for i in range(POOL_SIZE):
+                _pool.put(Instancia(i))
+        return _pool
+
+
+def _sumar(**valores):
+    with _lock:
+        for k, v in valores.items():
+            _metricas[k] += v
+
+
+def convertir_a_pdf(src, outdir, filter_name=None, filter_options=None, infilter=None,
+                    env=None, timeout=TIMEOUT, queue_timeout=QUEUE_TIMEOUT):
+    """
+    Convierte un documento de oficina a PDF con una instancia libre del pool
+
+    Args:
+        src: Ruta del DOCX/XLSX de entrada
+        outdir: Carpeta donde dejar el PDF (mismo nombre base que src)
+        filter_name: Filtro de exportación (ej. 'calc_pdf_Export'); None = automático
+        filter_options: Dict de FilterData (ej. {'EmbedStandardFonts': True})
+        infilter: Filtro de importación forzado
+
+    Returns:
+        Ruta del PDF generado
+    """
+    pool = _get_pool()
+    _sumar(en_cola=1)
+    t_cola = time.monotonic()
+    try:
+        instancia = pool.get(timeout=queue_timeout)
+    except queue.Empty:
+        raise ConversionBusy('Todas las instancias de LibreOffice están ocupadas')
+    finally:
+        espera = time.monotonic() - t_cola
+        _sumar(en_cola=-1, espera_total_s=espera)
+        metrics.observar_etapa('convert_wait', espera)
+
+    _sumar(en_proceso=1)
+    inicio = time.monotonic()
+    try:
+        pdf = instancia.convertir(src, outdir, filter_name, filter_options, infilter,
+                                  env or os.environ.copy(), timeout)
+    except subprocess.TimeoutExpired:
+        instancia.reciclar(borrar_perfil=True)
+        _sumar(timeouts=1, errores=1, reciclajes_por_cuelgue=1)
+        raise ConversionTimeout(f'LibreOffice no respondió en {timeout:.0f} s')
+    except Exception:
+        _sumar(errores=1)
+        raise
+    else:
+        duracion = time.monotonic() - inicio
+        metrics.observar_etapa('convert', duracion)
+        if UNO_AVAILABLE:
+            # soffice residente: no hay rusage por documento, solo el tiempo de pared
+            metrics.observar_subproceso('soffice', duracion)
+        with _lock:
+            _metricas['conversiones'] += 1
+            _metricas['tiempo_total_s'] += duracion
+            _metricas['tiempo_max_s'] = max(_metricas['tiempo_max_s'], duracion)
+        return pdf
+    finally:
+        _sumar(en_proceso=-1)
+        pool.put(instancia)
+
+
+def get_metricas():
+    """Profundidad de cola y tiempos de conversión del pool"""
+    with _lock:
+        m = dict(_metricas)
+    m['modo'] = 'uno' if UNO_AVAILABLE else 'cli'
+    m['instancias'] = POOL_SIZE
+    m['tiempo_medio_s'] = round(m['tiempo_total_s'] / m['conversiones'], 3) if m['conversiones'] else 0.0
+    m['tiempo_total_s'] = round(m['tiempo_total_s'], 3)
+    m['tiempo_max_s'] = round(m['tiempo_max_s'], 3)
+    m['espera_total_s'] = round(m['espera_total_s'], 3)
+    return m
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    while pool is not None and not pool.empty():
+        pool.get_nowait().reciclar()
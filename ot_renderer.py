@@ -0,0 +1,126 @@
+"""
+ot_renderer.py - Pool de renderizadores DOCX persistentes (generate_ot.js --serve)
+Cada renderer es un proceso Node de larga vida que recibe peticiones NDJSON
+por stdin y devuelve el DOCX en base64 por stdout. Si un proceso muere o se
+cuelga se descarta y se vuelve a lanzar en la siguiente petición. El CPU de
+cada render se mide como diferencia del acumulado del proceso en /proc.
+"""
+import os
+import json
+import time
+import queue
+import base64
+import itertools
+import threading
+import subprocess
+
+import metrics
+
+BASE_DIR  = os.path.dirname(os.path.abspath(__file__))
+GENERATOR = os.path.join(BASE_DIR, "generate_ot.js")
+
+POOL_SIZE = int(os.environ.get('OT_RENDERERS', 2))
+TIMEOUT   = float(os.environ.get('OT_RENDER_TIMEOUT', 60))
+
+
+class RenderError(Exception):
+    """generate_ot.js no pudo generar la OT"""
+
+
+class Renderer:
+    """Un proceso `node generate_ot.js --serve` con su canal NDJSON"""
+
+    def __init__(self):
+        self.proc = None
+        self._ids = itertools.count(1)
+
+    def _ensure_started(self):
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(
+                ['node', GENERATOR, '--serve'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                cwd=BASE_DIR
+            )
+
+    def kill(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def render(self, data, timeout=TIMEOUT):
+        self._ensure_started()
+        req_id = next(self._ids)
+        linea  = json.dumps({'id': req_id, 'data': data}, ensure_ascii=False) + '\n'
+
+        # Si el renderer no responde a tiempo se mata: readline() devuelve b''
+        watchdog = threading.Timer(timeout, self.proc.kill)
+        watchdog.start()
+        cpu_antes, _ = metrics.uso_proceso(self.proc.pid)
+        inicio = time.monotonic()
+        try:
+            self.proc.stdin.write(linea.encode('utf-8'))
+            self.proc.stdin.flush()
+            respuesta = self.proc.stdout.readline()
+        except (BrokenPipeError, OSError):
+            respuesta = b''
+        finally:
+            watchdog.cancel()
+        cpu_despues, rss = metrics.uso_proceso(self.proc.pid)
+        metrics.observar_subproceso('node', time.monotonic() - inicio,
+                                    cpu_despues - cpu_antes if cpu_antes is not None and cpu_despues is not None else None,
+                                    rss)
+
+        if not respuesta:
+            self.kill()
+            raise RenderError('El renderer de OT terminó inesperadamente')
+        try:
+            msg = json.loads(respuesta)
+        except ValueError:
+            msg = {}
+        if msg.get('id') != req_id:
+            self.kill()
+            raise RenderError('Respuesta desincronizada del renderer de OT')
+        if not msg.get('ok'):
+            raise RenderError(msg.get('error', 'Error desconocido'))
+        return msg['ot_num'], base64.b64decode(msg['docx'])
+
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = queue.Queue()
+            for _ in range(POOL_SIZE):
+                _pool.put(Renderer())
+        return _pool
+
+
+def render_ot(data, timeout=TIMEOUT):
+    """
+    Genera la OT con un renderer libre del pool
+
+    Returns:
+        (ot_num, docx_bytes)
+    """
+    pool = _get_pool()
+    try:
+        renderer = pool.get(timeout=timeout)
+    except queue.Empty:
+        raise RenderError('Todos los renderers de OT están ocupados')
+    try:
+        return renderer.render(data, timeout=timeout)
+    finally:
+        pool.put(renderer)
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    while pool is not None and not pool.empty():
+        pool.get_nowait().kill()
@@ -0,0 +1,135 @@
+"""
+pdf_cache.py - Conversión anticipada de OTs a PDF con caché por contenido
+El PDF se genera en segundo plano en cuanto existe el DOCX y se guarda como
+<sha256 del DOCX>.pdf: solo se vuelve a convertir si el DOCX cambia.
+El DOCX se lee de artifact_store (suelto o empaquetado), que también lleva la
+cuenta de los PDFs para desalojarlos por LRU cuando se supera la cuota.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import office_converter
+import artifact_store
+
+BASE_DIR  = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "ordenes_generadas", ".pdf_cache")
+
+LISTO     = 'listo'
+PENDIENTE = 'pendiente'
+ERROR     = 'error'
+
+_lock      = threading.Lock()
+_executor  = None
+_pendientes = {}   # sha256 -> Future
+_errores    = {}   # sha256 -> mensaje
+
+
+def ruta_pdf(digest):
+    return os.path.join(CACHE_DIR, f'{digest}.pdf')
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=office_converter.POOL_SIZE,
+                                           thread_name_prefix='pdf-cache')
+        return _executor
+
+
+def _convertir(docx_path, digest):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=CACHE_DIR)
+    try:
+        # Copia con el hash como nombre: el DOCX puede estar dentro de un paquete
+        src = os.path.join(tmpdir, f'{digest}.docx')
+        with open(src, 'wb') as f:
+            f.write(artifact_store.leer(docx_path))
+        pdf = office_converter.convertir_a_pdf(src, tmpdir)
+        os.replace(pdf, ruta_pdf(digest))
+        artifact_store.registrar_pdf(digest, ruta_pdf(digest))
+        with _lock:
+            _errores.pop(digest, None)
+    except Exception as e:
+        with _lock:
+            _errores[digest] = str(e)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        with _lock:
+            _pendientes.pop(digest, None)
+
+
+def programar(docx_path):
+    """Encola la conversión del DOCX si su PDF no está ya en caché o en curso"""
+    digest = artifact_store.sha256(docx_path)
+    if os.path.exists(ruta_pdf(digest)):
+        return digest
+    executor = _get_executor()
+    with _lock:
+        if digest not in _pendientes:
+            _errores.pop(digest, None)
+            _pendientes[digest] = executor.submit(_convertir, docx_path, digest)
+    return digest
+
+
+def _estado(digest):
+    pdf = ruta_pdf(digest)
+    if os.path.exists(pdf):
+        artifact_store.usar_pdf(digest)
+        return LISTO, pdf
+    with _lock:
+        if digest in _pendientes:
+            return PENDIENTE, None
+        if digest in _errores:
+            return ERROR, _errores[digest]
+    return None, None
+
+
+def consultar(docx_path, programar_si_falta=True):
+    """
+    Estado del PDF correspondiente al DOCX
+
+    Returns:
+        (estado, detalle) con detalle = ruta del PDF si está LISTO,
+        mensaje si hubo ERROR, None si está PENDIENTE
+    """
+    digest = artifact_store.sha256(docx_path)
+    estado, detalle = _estado(digest)
+    if estado == ERROR:
+        # Se informa una vez; la siguiente consulta reintenta la conversión
+        with _lock:
+            _errores.pop(digest, None)
+    if estado is not None:
+        return estado, detalle
+    if programar_si_falta:
+        programar(docx_path)
+    return PENDIENTE, None
+
+
+def al_terminar(docx_path, callback):
+    """Llama callback(estado, detalle) cuando termine la conversión del DOCX"""
+    digest = artifact_store.sha256(docx_path)
+    with _lock:
+        future = _pendientes.get(digest)
+    if future is not None:
+        future.add_done_callback(lambda _f: callback(*_estado(digest)))
+    else:
+        estado, detalle = _estado(digest)
+        callback(estado or ERROR, detalle or 'Conversión no programada')
+
+
+def esperar(docx_path, timeout=None):
+    """Programa la conversión si hace falta y bloquea hasta que termine"""
+    programar(docx_path)
+    listo = threading.Event()
+    resultado = []
+    def _fin(estado, detalle):
+        resultado.append((estado, detalle))
+        listo.set()
+    al_terminar(docx_path, _fin)
+    if not listo.wait(timeout):
+        return PENDIENTE, None
+    return resultado[0]
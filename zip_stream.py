@@ -0,0 +1,87 @@
+"""
+zip_stream.py - Escritura de ZIP en streaming para respuestas HTTP
+zipfile acepta destinos no posicionables (usa data descriptors), así que los
+bytes de cada entrada se pueden enviar al cliente apenas se escriben.
+"""
+import io
+import os
+import zipfile
+
+# Tope de lo que puede ocupar un lote ya descomprimido y de cuántas entradas
+# trae: un ZIP de pocos MB puede expandirse a decenas de GB
+LOTE_MAX_BYTES    = int(float(os.environ.get('LOTE_MAX_MB', 50)) * 1024 * 1024)
+LOTE_MAX_ENTRADAS = int(os.environ.get('LOTE_MAX_ENTRADAS', 500))
+
+
+class LoteExcedido(Exception):
+    """El lote supera LOTE_MAX_BYTES descomprimido o LOTE_MAX_ENTRADAS"""
+
+
+class _Buffer(io.RawIOBase):
+    """Destino de solo escritura que acumula bytes hasta que se drenan"""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def drenar(self):
+        datos, self._partes = b''.join(self._partes), []
+        return datos
+
+
+class ZipStream:
+    """
+    Uso:
+        zs = ZipStream()
+        yield zs.agregar('a.docx', datos)
+        yield zs.cerrar()
+    """
+
+    def __init__(self, compresion=zipfile.ZIP_DEFLATED):
+        self._buf = _Buffer()
+        self._zip = zipfile.ZipFile(self._buf, mode='w', compression=compresion)
+
+    def agregar(self, nombre, datos):
+        self._zip.writestr(nombre, datos)
+        return self._buf.drenar()
+
+    def agregar_archivo(self, nombre, ruta):
+        self._zip.write(ruta, nombre)
+        return self._buf.drenar()
+
+    def cerrar(self):
+        self._zip.close()
+        return self._buf.drenar()
+
+
+def leer_entradas(datos, extension, max_bytes=None, max_entradas=None):
+    """
+    Devuelve [(nombre, bytes)] de las entradas del ZIP con la extensión dada.
+    Los topes se verifican con los tamaños declarados antes de descomprimir
+    nada (zipfile no entrega más que file_size por entrada); quien reúne
+    varios ZIPs pasa lo que le queda de LOTE_MAX_BYTES y LOTE_MAX_ENTRADAS.
+
+    Raises:
+        LoteExcedido: el ZIP supera alguno de los topes
+        zipfile.BadZipFile: el archivo no es un ZIP válido
+    """
+    max_bytes    = LOTE_MAX_BYTES if max_bytes is None else max_bytes
+    max_entradas = LOTE_MAX_ENTRADAS if max_entradas is None else max_entradas
+    with zipfile.ZipFile(io.BytesIO(datos)) as zf:
+        elegidas = []
+        for info in zf.infolist():
+            nombre = info.filename.rsplit('/', 1)[-1]
+            if info.is_dir() or nombre.startswith('.') or not nombre.lower().endswith(extension):
+                continue
+            elegidas.append((nombre, info))
+        if len(elegidas) > max_entradas:
+            raise LoteExcedido(f'El lote supera {LOTE_MAX_ENTRADAS} archivos')
+        if sum(info.file_size for _, info in elegidas) > max_bytes:
+            raise LoteExcedido(f'El lote supera {LOTE_MAX_BYTES // (1024 * 1024)} MB descomprimido')
+        return [(nombre, zf.read(info)) for nombre, info in elegidas]